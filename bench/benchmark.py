@@ -0,0 +1,196 @@
+#!/bin/env python
+#
+#   benchmark.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   Runs a set of benchmark scenarios against synthetic logs
+#   from loggen.py, reporting lines per second and peak RSS
+#   for each. Every scenario runs in a fresh process so the
+#   peak RSS belongs to that scenario alone. The results are
+#   written as JSON, and can be compared with an earlier
+#   results file to catch throughput regressions.
+#
+#   python bench/benchmark.py -n 200000 -o results.json
+#   python bench/benchmark.py -n 200000 --compare results.json
+#
+############################
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from loggen import LogGenerator
+
+# Each scenario is run against each of these LogFormats
+FORMATS = ["combined", "common"]
+SCENARIOS = ["parse", "filter", "endtoend", "worstcase"]
+
+
+def peakrss(who=resource.RUSAGE_SELF):
+    """
+    Peak resident set size in KB
+    """
+    return resource.getrusage(who).ru_maxrss
+
+
+############
+# SCENARIO #
+############
+def scenario(name, conf, log, sigconf):
+    """
+    Run a single scenario in this process and return its results, called in a
+    child process by runscenario
+    """
+    from lib.httplog import HTTPLog
+    from lib.filter import Filter
+
+    os.chdir(ROOT)
+    _lines = 0
+    if name == "parse":
+        # Only parse the log, streaming through it
+        _start = time.time()
+        _log = HTTPLog(conf=conf, log="logs/access_log", fullpath=log, stream=True)
+        for _record in _log.records():
+            _lines += 1
+        _seconds = time.time() - _start
+        _rss = peakrss()
+    elif name == "filter":
+        # Load the log first, then time runfilter alone
+        _log = HTTPLog(conf=conf, log="logs/access_log", fullpath=log)
+        _lines = len(_log.logmatch)
+        _filter = Filter(_log, sigconf)
+        _start = time.time()
+        _filter.runfilter("host")
+        _seconds = time.time() - _start
+        _rss = peakrss()
+    elif name == "endtoend":
+        # The whole httpdefender.py run, as cron would do it
+        _lines = sum(1 for _line in open(log, "rb"))
+        _output = tempfile.mktemp(prefix="httpdefender-bench-")
+        _start = time.time()
+        _devnull = open(os.devnull, "w")
+        subprocess.check_call([sys.executable, os.path.join(ROOT, "httpdefender.py"), "-c", conf,
+                               "-p", log, "-o", _output, "-f", sigconf], stdout=_devnull, cwd=ROOT)
+        _seconds = time.time() - _start
+        _rss = peakrss(resource.RUSAGE_CHILDREN)
+        if os.path.exists(_output):
+            os.unlink(_output)
+    elif name == "worstcase":
+        # Hostile lines built to be slow to match against the log format regex
+        _log = HTTPLog(conf=conf, log="logs/access_log", fullpath=log, stream=True)
+        _worst = _log.compiledformat.worstcase(4096)
+        _lines = _worst["lines"]
+        _seconds = _worst["seconds"]
+        _rss = peakrss()
+        return {"lines": _lines, "seconds": _seconds, "linespersec": _lines / max(_seconds, 1e-9),
+                "peakrsskb": _rss, "worst": _worst["worst"], "worstseconds": _worst["worstseconds"]}
+    else:
+        raise ValueError("Unknown scenario %s" % name)
+    return {"lines": _lines, "seconds": _seconds, "linespersec": _lines / max(_seconds, 1e-9),
+            "peakrsskb": _rss}
+
+
+def runscenario(name, conf, log, sigconf):
+    """
+    Run a scenario in a fresh python process and return its results
+    """
+    _out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--scenario", name,
+                                    "--conf", conf, "--log", log, "-f", sigconf])
+    return json.loads(_out.strip().splitlines()[-1])
+
+
+###########
+# COMPARE #
+###########
+def compare(results, baseline, tolerance):
+    """
+    Print how each scenario compares with the baseline results, returning the
+    names of those whose lines per second dropped by more than tolerance
+    """
+    _regressions = []
+    _old = dict((_result["name"], _result) for _result in baseline["results"])
+    for _result in results["results"]:
+        if _result["name"] not in _old:
+            continue
+        _ratio = _result["linespersec"] / max(_old[_result["name"]]["linespersec"], 1e-9)
+        _flag = ""
+        if _ratio < 1 - tolerance:
+            _flag = "  REGRESSION"
+            _regressions.append(_result["name"])
+        print "%-20s %6.2fx lines/sec  %6.2fx peak rss%s" % (
+            _result["name"], _ratio,
+            _result["peakrsskb"] / float(max(_old[_result["name"]]["peakrsskb"], 1)), _flag)
+    return _regressions
+
+
+def gitcommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                                       stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def arguments():
+    parser = argparse.ArgumentParser(description="Benchmark httpdefender parsing and filtering.")
+    parser.add_argument("-n", type=int, default=100000, help="lines in each synthetic log. Default; 100000")
+    parser.add_argument("-o", default="bench_results.json", help="results file. Default; bench_results.json")
+    parser.add_argument("-f", default="signatures_conf.py", help="signature file. Default; signatures_conf.py")
+    parser.add_argument("--botmix", type=float, default=0.05, help="fraction of bot requests. Default; 0.05")
+    parser.add_argument("--agents", type=int, default=2000, help="distinct browser agents. Default; 2000")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the logs. Default; 1")
+    parser.add_argument("--only", help="comma separated scenarios to run, of %s" % ", ".join(SCENARIOS))
+    parser.add_argument("--dir", help="where to write the synthetic logs. Default; a temporary directory")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="drop in lines/sec that counts as a regression. Default; 0.1")
+    # Used internally to run a scenario in a child process
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--conf", help=argparse.SUPPRESS)
+    parser.add_argument("--log", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = arguments()
+    if args.scenario:
+        print json.dumps(scenario(args.scenario, args.conf, args.log, args.f))
+        sys.exit(0)
+
+    _scenarios = args.only.split(",") if args.only else SCENARIOS
+    _dir = args.dir or tempfile.mkdtemp(prefix="httpdefender-bench-")
+    _results = {"commit": gitcommit(), "python": platform.python_version(), "time": int(time.time()),
+                "lines": args.n, "botmix": args.botmix, "agents": args.agents, "seed": args.seed,
+                "results": []}
+    for _format in FORMATS:
+        _conf, _log = LogGenerator(args.n, _format, args.botmix, args.agents, seed=args.seed).write(
+            os.path.join(_dir, _format))
+        for _name in _scenarios:
+            _result = runscenario(_name, _conf, _log, args.f)
+            _result["name"] = "%s-%s" % (_name, _format)
+            _results["results"].append(_result)
+            print "%-20s %12.0f lines/sec %10d KB peak rss" % (
+                _result["name"], _result["linespersec"], _result["peakrsskb"])
+            if "worst" in _result:
+                print "%-20s %12.1f us for the slowest line, %s" % (
+                    "", _result["worstseconds"] * 1e6, _result["worst"])
+
+    _file = open(args.o, "w")
+    json.dump(_results, _file, indent=2, sort_keys=True)
+    _file.close()
+    print "results written to %s" % args.o
+
+    if args.compare:
+        if compare(_results, json.load(open(args.compare)), args.tolerance):
+            sys.exit(1)
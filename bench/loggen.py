@@ -0,0 +1,132 @@
+#!/bin/env python
+#
+#   loggen.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Generates synthetic apache access logs, and an httpd.conf
+#   to go with them, for benchmarking httpdefender. The same
+#   seed and settings always give exactly the same log.
+#
+#   python bench/loggen.py -o /tmp/bench -n 1000000 --format combined
+#
+############################
+import argparse
+import os
+import random
+
+# The LogFormats we can generate, as they appear in the default httpd.conf
+FORMATS = {
+    "combined": '%h %l %u %t \\"%r\\" %>s %b \\"%{Referer}i\\" \\"%{User-Agent}i\\"',
+    "common": '%h %l %u %t \\"%r\\" %>s %b',
+}
+
+# Agents of bots listed in signatures_conf.py
+BOTS = ["Siege 3.0.5", "Arachni/v1.0", "HTTrack 3.0x", "WebZIP/4.0", "larbin_2.6.3",
+        "EmailSiphon", "Download Demon/3.5.0.11", "WebCopier v4.6", "Zeus 32297 Webster Pro V2.9",
+        "ia_archiver (+http://www.alexa.com/site/help/webmasters)"]
+
+BROWSERS = ["Mozilla/5.0 (X11; Linux x86_64; rv:%d.0) Gecko/20100101 Firefox/%d.0",
+            "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%d.0.%d Safari/537.36",
+            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9) AppleWebKit/537.71 Version/%d.0 Safari/%d.71"]
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+class LogGenerator():
+    """
+    @Summary    Writes a deterministic synthetic access log.
+
+    @Parameters
+                lines="number of log lines"
+                logformat="combined or common"
+                botmix="fraction of requests made by bots" i.e. 0.05
+                agents="number of distinct browser agents"
+                hosts="number of distinct client IPs"
+                seed="random seed"
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, lines=100000, logformat="combined", botmix=0.05, agents=2000, hosts=50000, seed=1):
+        if logformat not in FORMATS:
+            raise ValueError("Unknown format %s; use %s" % (logformat, ", ".join(sorted(FORMATS))))
+        self.lines = lines
+        self.logformat = logformat
+        self.botmix = botmix
+        self.random = random.Random(seed)
+        self.agents = [self.random.choice(BROWSERS) % (self.random.randint(10, 99), self.random.randint(1000, 9999))
+                       for _idx in range(agents)]
+        self.hosts = ["%d.%d.%d.%d" % (self.random.randint(1, 223), self.random.randint(0, 255),
+                                       self.random.randint(0, 255), self.random.randint(1, 254))
+                      for _idx in range(hosts)]
+        # Bots keep to a small set of hosts of their own
+        self.bothosts = self.hosts[:max(1, hosts // 100)]
+
+    def line(self, idx):
+        """
+        Return log line number idx, one request per second from 2013/12/13
+        """
+        _random = self.random
+        _bot = _random.random() < self.botmix
+        _host = _random.choice(self.bothosts if _bot else self.hosts)
+        _agent = _random.choice(BOTS) if _bot else _random.choice(self.agents)
+        _second = idx % 86400
+        _time = "%02d/%s/2013:%02d:%02d:%02d +0000" % (13 + idx // 86400 % 15, MONTHS[11],
+                                                      _second // 3600, _second // 60 % 60, _second % 60)
+        _request = "%s /%s/%d.html HTTP/1.1" % (_random.choice(["GET", "GET", "GET", "POST", "HEAD"]),
+                                              _random.choice(["blog", "shop", "static", "api"]),
+                                              _random.randint(1, 5000))
+        _status = _random.choice([200, 200, 200, 200, 304, 404, 500])
+        _size = _random.randint(100, 99999) if _status == 200 else "-"
+        _line = '%s - - [%s] "%s" %s %s' % (_host, _time, _request, _status, _size)
+        if self.logformat == "combined":
+            _line += ' "http://example.com/%d" "%s"' % (_random.randint(1, 100), _agent)
+        return _line + "\n"
+
+    def write(self, directory):
+        """
+        Write access_log and an httpd.conf pointing at it into directory, returning
+        the (conf, log) paths
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        _conf = os.path.join(directory, "httpd.conf")
+        _log = os.path.join(directory, "access_log")
+        _file = open(_conf, "w")
+        _file.write('LogFormat "%s" %s\n' % (FORMATS[self.logformat], self.logformat))
+        _file.write("CustomLog logs/access_log %s\n" % self.logformat)
+        _file.close()
+        _file = open(_log, "w")
+        _batch = []
+        for _idx in xrange(self.lines):
+            _batch.append(self.line(_idx))
+            if len(_batch) == 10000:
+                _file.write("".join(_batch))
+                _batch = []
+        _file.write("".join(_batch))
+        _file.close()
+        return _conf, _log
+
+
+def arguments():
+    parser = argparse.ArgumentParser(description="Generate a synthetic apache access log.")
+    parser.add_argument("-o", required=True, help="directory to write access_log and httpd.conf to")
+    parser.add_argument("-n", type=int, default=100000, help="number of lines. Default; 100000")
+    parser.add_argument("--format", default="combined", help="combined or common. Default; combined")
+    parser.add_argument("--botmix", type=float, default=0.05, help="fraction of bot requests. Default; 0.05")
+    parser.add_argument("--agents", type=int, default=2000, help="distinct browser agents. Default; 2000")
+    parser.add_argument("--hosts", type=int, default=50000, help="distinct client IPs. Default; 50000")
+    parser.add_argument("--seed", type=int, default=1, help="random seed. Default; 1")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = arguments()
+    generator = LogGenerator(args.n, args.format, args.botmix, args.agents, args.hosts, args.seed)
+    print "wrote %s and %s" % generator.write(args.o)
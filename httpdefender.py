@@ -33,11 +33,13 @@
 #   for each entry, this could become quite intense if you have
 #   a huge file with over 300,000 lines in it etc.
 #
-#   One pitfall to this script is it isn't a daemonized process
-#   that looks over only the recent entries in the log. It
-#   imports the entire log, parses it, and then writes all of the
-#   entries to a file, in the future I would like to modify this
-#   to loop and read in a file stream.
+#   By default it streams through the entire log, parses it, and then
+#   writes all of the matching entries to a file. With --follow it
+#   instead tails the log, only parsing new entries as they are written,
+#   and appends any new offenders to the output file as they are seen.
+#   With one or more --target it monitors many logs at once, i.e. every
+#   vhost's own CustomLog, in this one process with one set of signatures
+#   and one output.
 #
 #   Currently all this does is loop through one big file, pick out
 #   the matches and stick the unique IPs in a blacklist.off file,
@@ -45,8 +47,21 @@
 #   with these. For the future it may be cool to integrate this with something
 ##########################################################################
 import argparse
+import time
 from lib.httplog import HTTPLog, LogError, InitError, ConfigError
 from lib.filter import Filter, InitErr, ConfErr
+from lib.follow import Follower, FollowError
+from lib.monitor import Monitor, MonitorError
+from lib.parallel import parallelfilter, ParallelError
+from lib.blacklist import Blacklist, BlacklistError
+from lib.sinks import SINKS, SinkError
+from lib.ratelimit import RateDetector, RateError, parserate
+from lib.timeseek import parsetime, TimeSeekError
+from lib.stats import Stats
+from lib.report import Report, Distinct, ReportError
+from lib.sketch import BloomFilter, SketchError
+from lib.pipeline import records
+from lib.store import OffenderStore, StoreError
 from datetime import datetime
 
 __title__ = "httpdefender"
@@ -61,10 +76,83 @@ def arguments():
     parser = argparse.ArgumentParser(description='Run the httpdefender script.')
     parser.add_argument("-c", help="the absolute path of the apache config file. Default; /etc/httpd/conf/httpd.conf")
     parser.add_argument("-l", help="the name of the logfile defined in the config file. Default; logs/access_log")
-    parser.add_argument("-p", help="the fullpath of the log in question. Default; /var/log/httpd/access_log")
+    parser.add_argument("-p", nargs="+", help="the fullpath of the log in question, more than one path or a glob "
+                        "such as '/var/log/httpd/access_log*' reads the rotated and compressed logs too. "
+                        "Default; /var/log/httpd/access_log")
     parser.add_argument("-o", help="where to output the results to. Default; blacklist.off")
     parser.add_argument("-r", help="what the results should be i.e time, host, request, agent. Default; host")
     parser.add_argument("-f", help="which signature python config file to be used. Default; signatures_conf.py")
+    parser.add_argument("-s", "--signatures", nargs="+",
+                        help="extra signature lists, JSON or plain text with one signature per line. A text "
+                             "list is for agents unless given as field:path, i.e. referrer:spam.txt")
+    parser.add_argument("--sig-cache", dest="sigcache",
+                        help="where the compiled signatures are cached, 'none' to not cache them. "
+                             "Default; ~/.cache/httpdefender")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="keep the entries already in the output and only add the new ones")
+    parser.add_argument("--sink", choices=["plain"] + sorted(SINKS),
+                        help="the output format, a plain list or a batch for ipset restore, nft -f or hosts.deny "
+                             "holding only the changes since the last run. Default; plain")
+    parser.add_argument("--state", help="where a batch sink keeps what it has added. Default; the output path.state")
+    parser.add_argument("--commit", action="store_true",
+                        help="once the last batch of --sink has been applied, save its state so the next batch "
+                             "is worked out from it, and exit without reading the log")
+    parser.add_argument("--timeout", type=int,
+                        help="seconds a batch sink blocks each new entry for. Default; until it stops offending")
+    parser.add_argument("--set-name", dest="setname",
+                        help="the ipset set, or nftables table and set, name. Default; httpdefender")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="filter the log in this many worker processes, 0 for one per core. "
+                             "Default; 1, or one per core when there are several logs")
+    parser.add_argument("--mmap", action="store_true",
+                        help="parse the log through a memory map, only copying out the fields that are needed")
+    parser.add_argument("--columnar", action="store_true",
+                        help="load the log into a compact columnar store and filter each distinct value once")
+    parser.add_argument("--cache-size", dest="cachesize", type=int,
+                        help="how many field verdicts to cache, 0 turns the cache off. Default; 10000")
+    parser.add_argument("--rate", help="also flag hosts making more than COUNT requests in SECONDS, i.e. 600/60")
+    parser.add_argument("--rate-4xx", dest="rate4xx",
+                        help="also flag hosts getting more than COUNT 4xx responses in SECONDS, i.e. 100/60")
+    parser.add_argument("--stats", nargs="?", const="text", choices=["text", "json"],
+                        help="report the time spent in each phase, the lines parsed and rejected and the "
+                             "hits and match time of every signature, as text or json. Default; text")
+    parser.add_argument("--report", nargs="?", const="text", choices=["text", "json"],
+                        help="report the top hosts, agents, paths and statuses and the requests of each minute, "
+                             "counted in the same pass as the filter, as text or json. Default; text")
+    parser.add_argument("--top", type=int, help="how many of each field --report lists. Default; 10")
+    parser.add_argument("--since", help="only read the lines logged from this time on, i.e. 10m, 2h, 1d, "
+                                        "@1386928800 or '2013-12-13 10:00'. Default; the start of the log")
+    parser.add_argument("--until", help="only read the lines logged up to this time, as --since. "
+                                        "Default; the end of the log")
+    parser.add_argument("--offenders", metavar="PATH",
+                        help="keep every offender in this sqlite database across runs, with its hits, signatures "
+                             "and when it was first and last seen, and blacklist what it holds")
+    parser.add_argument("--ttl", type=int,
+                        help="seconds an offender stays in --offenders after it was last seen. Default; for good")
+    parser.add_argument("--probabilistic", action="store_true",
+                        help="remember the offenders in a fixed size Bloom filter rather than keeping them all, "
+                             "writing them out as they are found, and estimate the distinct hosts, agents and "
+                             "offenders with HyperLogLog")
+    parser.add_argument("--capacity", type=int,
+                        help="offenders the Bloom filter of --probabilistic is sized for. Default; 1000000")
+    parser.add_argument("--error", type=float,
+                        help="the share of new offenders --probabilistic may take for ones already seen, "
+                             "up to --capacity of them. Default; 0.001")
+    parser.add_argument("--precision", type=int,
+                        help="HyperLogLog precision of --probabilistic, 4 to 18, each is 2**precision bytes "
+                             "with an error of 1.04/sqrt(2**precision). Default; 14")
+    parser.add_argument("--follow", action="store_true",
+                        help="tail the log and append new offenders to the output as they are logged")
+    parser.add_argument("--checkpoint", help="where --follow keeps its log offset. Default; httpdefender.offset")
+    parser.add_argument("--interval", type=float,
+                        help="seconds between checks of the log when inotify is unavailable. Default; 1")
+    parser.add_argument("--target", nargs=3, action="append", metavar=("CONF", "LOG", "PATH"),
+                        help="monitor the log at PATH, in the format of LOG in the apache config CONF, "
+                             "give it once per log or PATH as a quoted glob, the logs are followed together "
+                             "and their offenders appended to the output")
+    parser.add_argument("--discover", action="append", metavar="CONF",
+                        help="monitor every log written by a CustomLog in the apache config CONF, or a file it "
+                             "includes, as --target does")
     return parser.parse_args()
 
 
@@ -79,15 +167,130 @@ if __name__ == "__main__":
     # Set up some constants
     CONF = args.c or "/etc/httpd/conf/httpd.conf"
     LOG = args.l or "logs/access_log"
-    FULLPATH = args.p or "/var/log/httpd/access_log"
+    FULLPATH = args.p or ["/var/log/httpd/access_log"]
     OUTPUT = args.o or "blacklist.off"
     RESULTS = args.r or "host"
     SIGNATURE_CONF = args.f or "signatures_conf.py"
+    SIGNATURE_LISTS = args.signatures or []
+    SIGNATURE_CACHE = args.sigcache or "~/.cache/httpdefender"
+    if SIGNATURE_CACHE.lower() == "none":
+        SIGNATURE_CACHE = None
+    INCREMENTAL = args.incremental
+    SINK = args.sink or "plain"
+    STATE = args.state
+    TIMEOUT = args.timeout
+    SET_NAME = args.setname or "httpdefender"
+    JOBS = args.jobs
+    BACKEND = "mmap" if args.mmap else "chunked"
+    STORE = "columnar" if args.columnar else "tuples"
+    CACHESIZE = args.cachesize if args.cachesize is not None else 10000
+    RATE = args.rate
+    RATE4XX = args.rate4xx
+    STATS = args.stats
+    FOLLOW = args.follow
+    CHECKPOINT = args.checkpoint or "httpdefender.offset"
+    INTERVAL = args.interval or 1.0
+    TARGETS = args.target or []
+    DISCOVER = args.discover or []
+    try:
+        SINCE = parsetime(args.since) if args.since else None
+        UNTIL = parsetime(args.until) if args.until else None
+    except TimeSeekError as err:
+        print err
+        exit(1)
+    REPORT = args.report
+    TOP = args.top if args.top is not None else 10
+    OFFENDERS = args.offenders
+    TTL = args.ttl
+    if TTL is not None and not OFFENDERS:
+        print "--ttl is how long --offenders keeps an offender, it needs --offenders"
+        exit(1)
+    if OFFENDERS and (TARGETS or DISCOVER):
+        print "--offenders keeps the offenders of one log, it can't be used with --target or --discover"
+        exit(1)
+    PROBABILISTIC = args.probabilistic
+    PRECISION = args.precision if args.precision is not None else 14
+    _bloom = None
+    if not PROBABILISTIC and (args.capacity, args.error, args.precision) != (None, None, None):
+        print "--capacity, --error and --precision size the sketches of --probabilistic, they need --probabilistic"
+        exit(1)
+    if PROBABILISTIC:
+        if SINK != "plain" or OFFENDERS:
+            print "--probabilistic doesn't keep the offenders to write a --sink batch or --offenders store from"
+            exit(1)
+        if JOBS is not None and JOBS != 1:
+            print "--probabilistic writes the offenders out as one process finds them, it can't be used with --jobs"
+            exit(1)
+        try:
+            _bloom = BloomFilter(args.capacity if args.capacity is not None else 1000000,
+                                 args.error if args.error is not None else 0.001)
+        except SketchError as err:
+            print err
+            exit(1)
+    if REPORT and (FOLLOW or TARGETS or DISCOVER):
+        print "--report counts a log read once, it can't be used with --follow, --target or --discover"
+        exit(1)
+    if (SINCE is not None or UNTIL is not None) and (FOLLOW or TARGETS or DISCOVER):
+        print "--since and --until pick the lines of a log to read once, not with --follow, --target or --discover"
+        exit(1)
+    if SINK != "plain" and (FOLLOW or TARGETS or DISCOVER):
+        # A batch is a delta for one run, following appends to a plain list as it goes
+        print "--sink %s writes a batch per run, it can't be used with --follow, --target or --discover" % SINK
+        exit(1)
+    if STORE == "columnar" and JOBS is not None and JOBS != 1:
+        # The whole log is loaded into one store in this process, there is nothing to share out
+        print "--columnar filters one store of the whole log in one process, it can't be used with --jobs"
+        exit(1)
 
+    if args.commit:
+        # Only once the firewall has loaded a batch does it hold what the state says
+        if SINK == "plain":
+            print "--commit saves the state of a --sink batch once it is applied, give the --sink"
+            exit(1)
+        try:
+            if SINKS[SINK](OUTPUT, state=STATE).commit():
+                print "committed the state of the %s batch %s" % (SINK, OUTPUT)
+            else:
+                print "there is no %s batch of %s waiting to be committed" % (SINK, OUTPUT)
+        except SinkError as err:
+            print err
+            exit(1)
+        exit(0)
+
+    if TARGETS or DISCOVER:
+        try:
+            _monitor = Monitor(SIGNATURE_CONF, SIGNATURE_LISTS, SIGNATURE_CACHE, CACHESIZE, RESULTS,
+                               checkpoint=CHECKPOINT, interval=INTERVAL, backend=BACKEND,
+                               rate=RATE and parserate(RATE), rate4xx=RATE4XX and parserate(RATE4XX), seen=_bloom)
+            _targets = []
+            for _conf in DISCOVER:
+                _targets.extend(_monitor.discover(_conf))
+            for _conf, _log, _path in TARGETS:
+                _targets.extend(_monitor.addtarget(_conf, _log, _path))
+            for _target in _targets:
+                print "following %s with the %s parser..." % (_target.path, _target.httplog.parserpath)
+            print "monitoring %s logs for '%s' keyword..." % (len(_monitor.targets), RESULTS)
+            # Carry on from the offenders we already have, so none are written twice
+            _blacklist = Blacklist(OUTPUT)
+            _blacklist.load(seen=_bloom)
+            _monitor.matches = list(_blacklist.entries)
+            for _target, _value in _monitor.run():
+                print "%s %s" % (_value, _target.path)
+                _blacklist.appendentries([_value])
+        except KeyboardInterrupt:
+            print "stopped monitoring"
+            exit(0)
+        except (MonitorError, RateError, FollowError, BlacklistError, ConfErr, IOError, OSError) as err:
+            print err
+            exit(1)
+
+    # Phases are always timed, the log and filter only gather their stats when asked to
+    _stats = Stats()
     log = False
     try:
         print "opening config file %s..." % CONF
-        log = HTTPLog(conf=CONF, log=LOG, fullpath=FULLPATH)
+        log = HTTPLog(conf=CONF, log=LOG, fullpath=FULLPATH, stream=True, backend=BACKEND, store=STORE,
+                      stats=_stats if STATS else None, confcache=SIGNATURE_CACHE, since=SINCE, until=UNTIL)
     except LogError as err:
         print err
         exit(1)
@@ -102,28 +305,170 @@ if __name__ == "__main__":
         _filter = False
         try:
             print "setting up filter from config file %s..." % SIGNATURE_CONF
-            _filter = Filter(log, SIGNATURE_CONF)
+            _filter = Filter(log, SIGNATURE_CONF, cachesize=CACHESIZE, stats=_stats if STATS else None,
+                             lists=SIGNATURE_LISTS, cachedir=SIGNATURE_CACHE)
+            if RATE or RATE4XX:
+                _filter.adddetector(RateDetector(log.logschema, requests=RATE and parserate(RATE),
+                                                 errors=RATE4XX and parserate(RATE4XX),
+                                                 clftime=log.compiledformat.clftime))
+            _report = None
+            if REPORT:
+                _report = Report(log.logschema, top=TOP)
+                _filter.addobserver(_report)
+            _distinct = None
+            if PROBABILISTIC:
+                _filter.seen = _bloom
+                _distinct = Distinct(log.logschema, RESULTS, precision=PRECISION)
+                _filter.addobserver(_distinct)
+            _offenders = None
+            if OFFENDERS:
+                print "keeping offenders in %s..." % OFFENDERS
+                _offenders = OffenderStore(OFFENDERS, _filter, RESULTS, ttl=TTL)
+                _filter.addobserver(_offenders)
+            # Only the fields we filter on and output have to be taken from the log
+            log.fields = _filter.fieldsused(RESULTS)
+            log.parser()
+            print "parsing the log with the %s parser..." % log.parserpath
+            if SINCE is not None or UNTIL is not None:
+                print "reading the lines logged from %s to %s..." % (
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(SINCE)) if SINCE is not None else "the start",
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(UNTIL)) if UNTIL is not None else "the end")
         except InitErr as err:
             print err
             exit(1)
         except ConfErr as err:
             print err
             exit(1)
+        except RateError as err:
+            print err
+            exit(1)
+        except ReportError as err:
+            print err
+            exit(1)
+        except StoreError as err:
+            print err
+            exit(1)
+        if FOLLOW:
+            try:
+                print "following %s for '%s' keyword..." % (log.logpath, RESULTS)
+                _follower = Follower(log, checkpoint=CHECKPOINT, interval=INTERVAL)
+                # Carry on from the offenders we already have, so none are written twice
+                _blacklist = Blacklist(OUTPUT)
+                _blacklist.load(seen=_bloom)
+                _filter.matches = list(_blacklist.entries)
+                _records = _follower.follow()
+                try:
+                    for _value in _filter.filterrecords(_records, RESULTS):
+                        print _value
+                        _blacklist.appendentries([_value])
+                finally:
+                    # Make sure the checkpoint is saved and the offenders written however we stop
+                    _records.close()
+                    if _offenders is not None:
+                        _offenders.close()
+            except KeyboardInterrupt:
+                print "stopped following %s" % log.logpath
+                exit(0)
+            except (FollowError, BlacklistError, StoreError, ConfErr, IOError, OSError) as err:
+                print err
+                exit(1)
+            # Once following stops, i.e. the follower is stopped, never carry on to a batch run
+            exit(0)
+
+        if JOBS is None:
+            # Several logs are read in parallel, one worker per core, unless they have to be
+            # read in order for the detectors and reports or loaded into a single columnar store
+            _ordered = _filter.detectors or _filter.observers or STORE == "columnar"
+            JOBS = 0 if len(log.logpaths) > 1 and not _ordered else 1
+
+        _found = 0
         try:
             print "running filters for '%s' keyword" % RESULTS
-            _filter.runfilter(RESULTS)
-        except ConfErr as err:
+            if STORE == "columnar" and JOBS == 1:
+                # Now we know the fields we need, load them into the columnar store
+                log.load()
+            with _stats.phase("runfilter"):
+                if _bloom is not None:
+                    # The matches aren't kept, so they are written out as they are found
+                    print "writing output to %s as it is found..." % OUTPUT
+                    _blacklist = Blacklist(OUTPUT)
+                    if INCREMENTAL:
+                        _blacklist.load(seen=_bloom)
+                        for _batch in records(_filter.filtervalues(RESULTS), 10000):
+                            _blacklist.appendentries(_batch)
+                            _found += len(_batch)
+                    else:
+                        _found = _blacklist.write(_filter.filtervalues(RESULTS))
+                elif JOBS == 1:
+                    _filter.runfilter(RESULTS)
+                else:
+                    parallelfilter(_filter, RESULTS, JOBS)
+        except (ConfErr, ParallelError, LogError, StoreError, BlacklistError) as err:
             print err
             exit(1)
 
-        if len(_filter.matches):
+        _matches = _filter.matches
+        if _offenders is not None:
+            # The blacklist is then everything in the store, from this run and those before
+            try:
+                try:
+                    _offenders.flush()
+                    _expired = _offenders.expire()
+                    _matches = _offenders.blacklist()
+                finally:
+                    _offenders.close()
+                if _expired:
+                    print "expired %s offenders not seen for %s seconds" % (_expired, TTL)
+                print "%s offenders in %s" % (len(_matches), OFFENDERS)
+            except StoreError as err:
+                print err
+                exit(1)
+
+        _new = []
+        if SINK != "plain":
+            # Even with no matches the batch is written, it may have entries to remove
+            try:
+                with _stats.phase("output"):
+                    _sink = SINKS[SINK](OUTPUT, state=STATE, timeout=TIMEOUT, name=SET_NAME)
+                    _new, _removed = _sink.write(_matches, keep=INCREMENTAL)
+                    print "writing %s batch to %s, %s to add and %s to remove..." % (
+                        SINK, OUTPUT, len(_new), len(_removed))
+                    if _sink.skipped:
+                        print "skipped %s matches that aren't IP addresses" % len(_sink.skipped)
+            except SinkError as err:
+                print err
+                exit(1)
+        elif len(_matches) or _offenders is not None:
             try:
-                print "writing output to %s..." % OUTPUT
-                _blacklist = open(OUTPUT ,"w+")
-                _blacklist.writelines('\n'.join(_filter.matches))
-            except Exception as err:
+                with _stats.phase("output"):
+                    _blacklist = Blacklist(OUTPUT)
+                    if INCREMENTAL:
+                        # Only the matches that aren't already blacklisted are appended, the rest of
+                        # it is left as it is
+                        _blacklist.load()
+                        _new = _blacklist.append(_matches)
+                        if _new:
+                            print "appending %s new entries to %s..." % (len(_new), OUTPUT)
+                    else:
+                        _new = _blacklist.merge(_matches)
+                        # An offender can expire from the store, so its blacklist is always written
+                        if _new or _offenders is not None:
+                            print "writing output to %s..." % OUTPUT
+                            _blacklist.write()
+            except BlacklistError as err:
                 print err
                 exit(1)
 
-        print "httpdefender completed with %s matches!" % len(_filter.matches)
+        if _filter.cache is not None and (_filter.cache.hits or _filter.cache.misses):
+            print "verdict cache: %s hits, %s misses, %s entries" % (
+                _filter.cache.hits, _filter.cache.misses, len(_filter.cache))
+        if STATS:
+            print _stats.report(STATS)
+        if _report is not None:
+            print _report.report(REPORT)
+        if _distinct is not None:
+            print _distinct.report(REPORT or "text")
+            print "the Bloom filter holds %s offenders, a new one is taken for one seen before %.4f%% of the time" % (
+                len(_bloom), 100 * _bloom.errorrate())
+        print "httpdefender completed with %s matches, %s new!" % (len(_filter.matches) + _found, len(_new) + _found)
 
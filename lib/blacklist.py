@@ -0,0 +1,164 @@
+#!/bin/env python
+#
+#   blacklist.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The Blacklist class looks after the output file,
+#   i.e. blacklist.off. It can load the entries that
+#   are already there, merge in new matches using a
+#   set, and write the file out atomically so nothing
+#   reading it ever sees it half written.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "tempfile" in vars():
+    import tempfile
+
+
+class BlacklistError(Exception):
+    pass
+
+
+class Blacklist():
+    """
+    @Summary    The blacklist output file, one entry per line.
+
+    @Guide      Call load to read in the current entries, then merge the matches of a Filter,
+                merge returns only the entries that weren't already there. write then replaces
+                the file in one go through a rename.
+
+    @Parameters
+                path="the blacklist file" i.e. "blacklist.off"
+
+    @Example    blacklist = Blacklist("blacklist.off")
+                blacklist.load()
+                new = blacklist.merge(filter.matches)
+                blacklist.write()
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.existing = set()
+
+    ########
+    # LOAD #
+    ########
+    def load(self, seen=None):
+        """
+        Read the entries already in the blacklist, a missing file is an empty blacklist.
+        With seen, i.e. a BloomFilter, they are only added to it and not kept here
+        """
+        if not os.path.exists(self.path):
+            return
+        try:
+            _file = open(self.path, "r")
+            try:
+                for _line in _file:
+                    _line = _line.strip()
+                    if not _line:
+                        continue
+                    if seen is not None:
+                        seen.add(_line)
+                    elif _line not in self.existing:
+                        self.existing.add(_line)
+                        self.entries.append(_line)
+            finally:
+                _file.close()
+        except IOError as err:
+            raise BlacklistError("Unable to read blacklist %s; %s" % (self.path, err))
+
+    #########
+    # MERGE #
+    #########
+    def merge(self, values):
+        """
+        Add values to the blacklist, returning a list of the ones that are new
+        """
+        _new = []
+        for _value in values:
+            if _value not in self.existing:
+                self.existing.add(_value)
+                self.entries.append(_value)
+                _new.append(_value)
+        return _new
+
+    #########
+    # WRITE #
+    #########
+    def write(self, entries=None):
+        """
+        Write every entry out to a temporary file next to the blacklist and rename
+        it over the top, so the blacklist is replaced atomically. entries, any
+        iterable, i.e. Filter.filtervalues, is written in their place as it is read.
+        Returns the number of entries written
+        """
+        _dir = os.path.dirname(os.path.abspath(self.path))
+        _written = 0
+        try:
+            _fd, _tmp = tempfile.mkstemp(prefix=".%s." % os.path.basename(self.path), dir=_dir)
+            try:
+                _file = os.fdopen(_fd, "w")
+                for _entry in (self.entries if entries is None else entries):
+                    _file.write("%s\n" % _entry)
+                    _written += 1
+                _file.flush()
+                os.fsync(_file.fileno())
+                _file.close()
+                # mkstemp creates the file 0600, give it the usual permissions
+                _umask = os.umask(0)
+                os.umask(_umask)
+                os.chmod(_tmp, 0666 & ~_umask)
+                os.rename(_tmp, self.path)
+            except:
+                os.unlink(_tmp)
+                raise
+        except (IOError, OSError) as err:
+            raise BlacklistError("Unable to write blacklist %s; %s" % (self.path, err))
+        return _written
+
+    ##########
+    # APPEND #
+    ##########
+    def append(self, values):
+        """
+        Merge values and append only the new ones to the end of the blacklist in
+        a single write, returning the new entries
+        """
+        _new = self.merge(values)
+        if _new:
+            self.appendentries(_new)
+        return _new
+
+    def appendentries(self, entries):
+        """
+        Append entries to the end of the blacklist in a single write as they are,
+        without merging them, i.e. when they are known to be new
+        """
+        try:
+            _fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+            try:
+                # Make sure we start on a line of our own
+                _prefix = ""
+                _size = os.fstat(_fd).st_size
+                if _size:
+                    _file = open(self.path, "rb")
+                    _file.seek(_size - 1)
+                    if _file.read(1) != "\n":
+                        _prefix = "\n"
+                    _file.close()
+                os.write(_fd, _prefix + "".join("%s\n" % _entry for _entry in entries))
+            finally:
+                os.close(_fd)
+        except (IOError, OSError) as err:
+            raise BlacklistError("Unable to append to blacklist %s; %s" % (self.path, err))
@@ -0,0 +1,263 @@
+#!/bin/env python
+#
+#   columnar.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The ColumnStore class holds parsed log records
+#   column by column rather than as a list of tuples.
+#   Hosts are packed as integers, status and size go
+#   into compact integer arrays, times are held as epoch
+#   seconds and every other field is dictionary encoded,
+#   so each distinct agent, referer or request string is
+#   only stored once.
+#
+############################
+if not "array" in vars():
+    from array import array
+
+if not "socket" in vars():
+    import socket
+
+if not "struct" in vars():
+    import struct
+
+if "TimeDecoder" not in vars():
+    from lib.timestamp import TimeDecoder, TimeError, logstamp
+
+
+class ColumnError(Exception):
+    pass
+
+
+class DictColumn():
+    """
+    A dictionary encoded column, each distinct value is stored once in values
+    and every row holds the integer code of its value.
+    """
+    def __init__(self):
+        self.values = []
+        self.index = {}
+        self.codes = array("I")
+
+    def encode(self, value):
+        _code = self.index.get(value)
+        if _code is None:
+            _code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return _code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+    def decode(self, code):
+        return self.values[code]
+
+
+class IntColumn():
+    """
+    A column of integers, i.e. status or size, "-" and missing values are
+    stored as the blank integer.
+    """
+    def __init__(self, typecode, blank=-1):
+        self.codes = array(typecode)
+        self.blank = blank
+
+    def append(self, value):
+        if value is None or value == "-":
+            self.codes.append(self.blank)
+        else:
+            self.codes.append(int(value))
+
+    def decode(self, code):
+        if code == self.blank:
+            return "-"
+        return str(code)
+
+
+class HostColumn():
+    """
+    A column of hosts, IPv4 addresses are packed into their integer value,
+    anything else is dictionary encoded above 2**32 so it can never clash
+    with an address.
+    """
+    OTHER = 1 << 32
+
+    def __init__(self):
+        self.codes = array("L")
+        self.other = DictColumn()
+
+    def append(self, value):
+        _code = None
+        if value and value.count(".") == 3:
+            try:
+                _packed = socket.inet_aton(value)
+                # Only pack addresses that come back out exactly as they went in,
+                # inet_aton reads 010.0.0.1 as octal for instance
+                if socket.inet_ntoa(_packed) == value:
+                    _code = struct.unpack("!I", _packed)[0]
+            except socket.error:
+                pass
+        if _code is None:
+            _code = self.OTHER + self.other.encode(value)
+        self.codes.append(_code)
+
+    def decode(self, code):
+        if code >= self.OTHER:
+            return self.other.decode(code - self.OTHER)
+        return socket.inet_ntoa(struct.pack("!I", code))
+
+
+class TimeColumn():
+    """
+    A column of %t timestamps held as epoch seconds, each code is the epoch shifted up
+    ZONEBITS bits with the index of its zone in zones below it, so epoch gives the time
+    of a row as an integer. Anything else, or a timestamp that wouldn't be written back
+    exactly as it came in, is dictionary encoded as a negative code.
+    """
+    ZONEBITS = 6
+
+    def __init__(self, size=4096):
+        self.codes = array("l")
+        self.zones = []
+        self.zoneindex = {}
+        self.other = DictColumn()
+        self.decoder = TimeDecoder(size)
+        self.size = size
+        self.index = {}  # The codes of the timestamps seen last, neighbouring rows share them
+        self.stamps = {}  # The timestamps of the codes decoded last
+
+    def append(self, value):
+        _code = self.index.get(value)
+        if _code is None:
+            _code = self.encode(value)
+        self.codes.append(_code)
+
+    def encode(self, value):
+        _code = None
+        if value and len(value) == 26:
+            try:
+                _epoch = self.decoder.decode(value)
+            except TimeError:
+                _epoch = -1
+            _zone = value[21:]
+            _zoneidx = self.zoneindex.get(_zone)
+            if _zoneidx is None and _epoch >= 0 and len(self.zones) < 1 << self.ZONEBITS:
+                _zoneidx = self.zoneindex[_zone] = len(self.zones)
+                self.zones.append(_zone)
+            if _zoneidx is not None and _epoch >= 0 and logstamp(_epoch, _zone) == value:
+                _code = _epoch << self.ZONEBITS | _zoneidx
+        if _code is None:
+            _code = -1 - self.other.encode(value)
+        if len(self.index) >= self.size:
+            self.index.clear()
+        self.index[value] = _code
+        return _code
+
+    def epoch(self, code):
+        """
+        Return the epoch seconds of a code, None if it isn't a timestamp
+        """
+        if code < 0:
+            return None
+        return code >> self.ZONEBITS
+
+    def decode(self, code):
+        if code < 0:
+            return self.other.decode(-1 - code)
+        _stamp = self.stamps.get(code)
+        if _stamp is None:
+            _stamp = logstamp(code >> self.ZONEBITS, self.zones[code & ((1 << self.ZONEBITS) - 1)])
+            if len(self.stamps) >= self.size:
+                self.stamps.clear()
+            self.stamps[code] = _stamp
+        return _stamp
+
+
+class ColumnStore():
+    """
+    @Summary    A compact columnar store for parsed log records, laid out using the logschema
+                of an HTTPLog.
+
+    @Guide      Records are appended as the tuples HTTPLog produces, and can be read back the same
+                way by iterating over the store. A Filter can instead work on the columns directly,
+                evaluating each signature once per distinct value rather than once per line.
+                    If fields is given, only those fields are kept, the rest are None when records
+                are read back.
+
+    @Parameters
+                schema="logschema of the HTTPLog" i.e. {"host": 0, "agent": 8, ...}
+                fields="list of fields to keep" i.e. ["host", "agent"], defaults to all
+
+    @Example    store = ColumnStore(log.logschema)
+                store.append(record)
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, schema, fields=None):
+        self.schema = schema
+        self.width = max(schema.values()) + 1 if schema else 0
+        self.rows = 0
+        self.columns = {}
+        for _field in schema:
+            if fields and _field not in fields:
+                continue
+            if _field == "host":
+                self.columns[_field] = HostColumn()
+            elif _field == "status":
+                self.columns[_field] = IntColumn("H", 0)
+            elif _field == "size":
+                self.columns[_field] = IntColumn("l")
+            elif _field == "time":
+                self.columns[_field] = TimeColumn()
+            else:
+                self.columns[_field] = DictColumn()
+        # (record index, column) pairs used when appending and rebuilding records
+        self._layout = [(schema[_field], _column) for _field, _column in self.columns.items()]
+
+    ##########
+    # APPEND #
+    ##########
+    def append(self, record):
+        """
+        Add a parsed log record to the store
+        """
+        for _idx, _column in self._layout:
+            _column.append(record[_idx])
+        self.rows += 1
+
+    ##########
+    # COLUMN #
+    ##########
+    def column(self, field):
+        """
+        Return the column for field
+        """
+        if field not in self.columns:
+            raise ColumnError("No column for %s in this store" % field)
+        return self.columns[field]
+
+    ##########
+    # RECORD #
+    ##########
+    def record(self, row):
+        """
+        Rebuild the record tuple for a row
+        """
+        _record = [None] * self.width
+        for _idx, _column in self._layout:
+            _record[_idx] = _column.decode(_column.codes[row])
+        return tuple(_record)
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        for _row in xrange(self.rows):
+            yield self.record(_row)
@@ -0,0 +1,360 @@
+#!/bin/env python
+#
+#   confindex.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The ConfIndex class reads an apache config once,
+#   following its Include and IncludeOptional files, and
+#   maps the target of every CustomLog and TransferLog to
+#   its LogFormat string. The index is kept in memory and
+#   on disk, checked against the mtime of every file it
+#   read, so the config tree is only parsed again when
+#   one of them changes.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "re" in vars():
+    import re
+
+if not "glob" in vars():
+    import glob
+
+if not "marshal" in vars():
+    import marshal
+
+if not "hashlib" in vars():
+    import hashlib
+
+if not "tempfile" in vars():
+    import tempfile
+
+
+class ConfIndexError(Exception):
+    pass
+
+
+# The format TransferLog uses when no LogFormat without a nickname is given
+DEFAULTFORMAT = '%h %l %u %t \\"%r\\" %>s %b'
+
+
+class ConfIndex():
+    """
+    @Summary    An index of the logs an apache config writes and the LogFormat of each.
+
+    @Guide      Each file is read once, a line ending in \ is joined to the next and comments are
+                skipped. Include and IncludeOptional are followed where they appear, relative to
+                the ServerRoot, wildcards are expanded and a directory includes every file in it,
+                a missing Include is an error but a missing IncludeOptional isn't. ${VAR} is
+                expanded from Define, the environment and, for the Debian layout, the envvars file
+                next to the config. Sections such as <IfModule> are all read as if they are active.
+                    Every LogFormat is kept by nickname, and every CustomLog, with its format given
+                inline or by nickname, and TransferLog is added to logs in the order they appear.
+                The files read, and the directories a wildcard was expanded in, are kept with their
+                mtimes, see load for the cache.
+
+    @Parameters
+                conf="the main apache config file" i.e. "/etc/httpd/conf/httpd.conf"
+
+    @Example    index = ConfIndex.load("/etc/apache2/apache2.conf")
+                index.findlog("access.log") -> {"target": "${APACHE_LOG_DIR}/access.log",
+                                                 "path": "/var/log/apache2/access.log",
+                                                 "nickname": "combined", "format": "%h %l ...", ...}
+    """
+    # Bump this when what is cached changes
+    VERSION = 1
+    # Quoted arguments keep their escapes, LogFormat strings are compiled with them
+    _arguments = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+    _variable = re.compile(r"\$\{(\w+)\}")
+    # The indexes already loaded in this process, by the absolute path of their config
+    _loaded = {}
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, conf):
+        self.conf = os.path.abspath(conf)
+        self.serverroot = os.path.dirname(self.conf)
+        self.defines = {}
+        self.formats = {}  # nickname -> format
+        self.defaultformat = DEFAULTFORMAT
+        self.logs = []  # A dictionary for each CustomLog and TransferLog, in order
+        self.mtimes = {}  # Every file and directory read -> its mtime
+        self.environment = {}  # The environment variables used -> their values
+        self._reading = []  # The files being read, to catch an Include loop
+        self._vhost = None
+
+    ########
+    # LOAD #
+    ########
+    @classmethod
+    def load(cls, conf, cachedir=None):
+        """
+        Return the index of conf, as already loaded in this process or cached in
+        cachedir if none of its files have changed since, otherwise parsed and cached
+        """
+        _conf = os.path.abspath(conf)
+        _index = cls._loaded.get(_conf)
+        if _index is not None and _index.current():
+            return _index
+        _cachepath = None
+        if cachedir:
+            _cachepath = os.path.join(os.path.expanduser(cachedir),
+                                      "confindex-%s.db" % hashlib.sha1(_conf).hexdigest()[:12])
+            _index = cls.readcache(_conf, _cachepath)
+        if _index is None:
+            _index = cls(_conf)
+            _index.parse()
+            if _cachepath:
+                _index.writecache(_cachepath)
+        cls._loaded[_conf] = _index
+        return _index
+
+    def current(self):
+        """
+        Return True if no file the index was read from has changed
+        """
+        for _path, _mtime in self.mtimes.items():
+            try:
+                if os.stat(_path).st_mtime != _mtime:
+                    return False
+            except OSError:
+                if _mtime is not None:
+                    return False
+        for _name, _value in self.environment.items():
+            if os.environ.get(_name) != _value:
+                return False
+        return True
+
+    #########
+    # PARSE #
+    #########
+    def parse(self):
+        if not (os.path.exists(self.conf) and os.access(self.conf, os.R_OK)):
+            raise ConfIndexError("Error opening config file; check permissions and path")
+        self.readenvvars(os.path.join(os.path.dirname(self.conf), "envvars"))
+        self.readfile(self.conf)
+        # A CustomLog naming a LogFormat defined after it still finds it
+        for _log in self.logs:
+            if _log["format"] is None:
+                _log["format"] = self.formats.get(_log["nickname"])
+
+    def readenvvars(self, path):
+        """
+        Take the exported variables from a Debian style envvars file, it is shell, so
+        only plain export NAME=value lines are understood
+        """
+        self.mtimes[path] = self.mtime(path)
+        if self.mtimes[path] is None:
+            return
+        for _line in open(path, "r"):
+            _match = re.match(r"\s*export\s+(\w+)=(.*)$", _line)
+            if _match:
+                _value = _match.group(2).strip().strip("'\"")
+                # Anything we don't know, i.e. $SUFFIX, is empty as it is by default
+                _value = re.sub(r"\$\{?(\w+)\}?", lambda _var: self.defines.get(_var.group(1), ""), _value)
+                self.defines.setdefault(_match.group(1), _value)
+
+    def mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    ############
+    # READFILE #
+    ############
+    def readfile(self, path):
+        _real = os.path.realpath(path)
+        if _real in self._reading:
+            raise ConfIndexError("Include loop; %s includes itself" % path)
+        try:
+            _file = open(path, "r")
+            try:
+                _lines = _file.read().splitlines()
+            finally:
+                _file.close()
+        except IOError as err:
+            raise ConfIndexError("Unable to read config %s; %s" % (path, err))
+        self.mtimes[path] = self.mtime(path)
+        self._reading.append(_real)
+        try:
+            _pending = ""
+            for _number, _line in enumerate(_lines, 1):
+                _line = _pending + _line.strip()
+                if _line.endswith("\\"):
+                    _pending = _line[:-1]
+                    continue
+                _pending = ""
+                if _line and not _line.startswith("#"):
+                    self.directive(_line, path, _number)
+        finally:
+            self._reading.pop()
+
+    def expand(self, value):
+        def _expand(match):
+            _name = match.group(1)
+            if _name in self.defines:
+                return self.defines[_name]
+            if _name in os.environ:
+                self.environment[_name] = os.environ[_name]
+                return os.environ[_name]
+            self.environment[_name] = None
+            return match.group(0)
+        return self._variable.sub(_expand, value)
+
+    #############
+    # DIRECTIVE #
+    #############
+    def directive(self, line, path, number):
+        """
+        Index one directive
+        """
+        _words = [_bare or _quoted for _quoted, _bare in self._arguments.findall(line)]
+        _name = _words[0].lower()
+        _args = _words[1:]
+        if _name == "<virtualhost":
+            self._vhost = " ".join(_args).rstrip(">")
+        elif _name == "</virtualhost>":
+            self._vhost = None
+        elif _name == "servername" and _args and self._vhost is not None:
+            self._vhost = self.expand(_args[0])
+        elif _name == "serverroot" and _args:
+            self.serverroot = self.expand(_args[0])
+        elif _name == "define" and _args:
+            self.defines[_args[0]] = self.expand(_args[1]) if len(_args) > 1 else ""
+        elif _name in ("include", "includeoptional") and _args:
+            self.include(self.expand(_args[0]), _name == "includeoptional", path, number)
+        elif _name == "logformat" and _args:
+            if len(_args) > 1:
+                self.formats[_args[1]] = _args[0]
+            else:
+                self.defaultformat = _args[0]
+        elif _name in ("customlog", "transferlog") and _args:
+            if _name == "transferlog":
+                _nickname, _format = None, self.defaultformat
+            elif len(_args) < 2:
+                raise ConfIndexError("%s:%s; CustomLog needs a log and a format" % (path, number))
+            elif "%" in _args[1]:
+                # An inline format rather than a nickname
+                _nickname, _format = None, _args[1]
+            else:
+                _nickname, _format = _args[1], self.formats.get(_args[1])
+            _target = _args[0]
+            self.logs.append({"target": _target, "path": self.logpath(self.expand(_target)),
+                              "nickname": _nickname, "format": _format, "vhost": self._vhost,
+                              "file": path, "line": number})
+
+    def resolve(self, path):
+        if os.path.isabs(path):
+            return path
+        return os.path.join(self.serverroot, path)
+
+    def logpath(self, target):
+        """
+        The file a log target writes to, None for a piped log
+        """
+        if target.startswith("|"):
+            return None
+        return os.path.normpath(self.resolve(target))
+
+    ###########
+    # INCLUDE #
+    ###########
+    def include(self, pattern, optional, path, number):
+        _pattern = self.resolve(pattern)
+        if glob.has_magic(_pattern):
+            # A new file in the directory has to be picked up, so watch the directory too
+            _directory = os.path.dirname(_pattern)
+            self.mtimes[_directory] = self.mtime(_directory)
+            _paths = sorted(glob.glob(_pattern))
+            if not _paths and not optional and not glob.has_magic(_directory):
+                raise ConfIndexError("%s:%s; Include %s matches no files" % (path, number, pattern))
+        elif os.path.isdir(_pattern):
+            self.mtimes[_pattern] = self.mtime(_pattern)
+            _paths = sorted(os.path.join(_pattern, _name) for _name in os.listdir(_pattern))
+        elif os.path.exists(_pattern):
+            _paths = [_pattern]
+        elif optional:
+            return
+        else:
+            raise ConfIndexError("%s:%s; Include %s doesn't exist" % (path, number, pattern))
+        for _path in _paths:
+            if os.path.isdir(_path):
+                self.include(_path, optional, path, number)
+            else:
+                self.readfile(_path)
+
+    ###########
+    # FINDLOG #
+    ###########
+    def findlog(self, log):
+        """
+        Return the first log whose target is log, or failing that the first whose
+        target or path ends with or contains it
+        """
+        for _test in (lambda _log: log in (_log["target"], _log["path"]),
+                      lambda _log: _log["target"].endswith(log) or (_log["path"] or "").endswith(log),
+                      lambda _log: log in _log["target"]):
+            for _log in self.logs:
+                if _test(_log):
+                    return _log
+        return None
+
+    #########
+    # CACHE #
+    #########
+    @classmethod
+    def readcache(cls, conf, path):
+        """
+        Return the index cached at path, or None if there isn't one, it can't be
+        read or any of its files have changed
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            _file = open(path, "rb")
+            try:
+                _saved = marshal.load(_file)
+            finally:
+                _file.close()
+            if _saved.get("version") != cls.VERSION or _saved.get("conf") != conf:
+                return None
+            _index = cls(conf)
+            for _name in ("serverroot", "defines", "formats", "defaultformat", "logs", "mtimes", "environment"):
+                setattr(_index, _name, _saved[_name])
+        except (IOError, EOFError, ValueError, TypeError, KeyError, AttributeError):
+            return None
+        if not _index.current():
+            return None
+        return _index
+
+    def writecache(self, path):
+        """
+        Save the index to path atomically, the cache is only a speed up so failing
+        to write it isn't an error
+        """
+        _saved = {"version": self.VERSION, "conf": self.conf}
+        for _name in ("serverroot", "defines", "formats", "defaultformat", "logs", "mtimes", "environment"):
+            _saved[_name] = getattr(self, _name)
+        try:
+            _dir = os.path.dirname(path)
+            if not os.path.isdir(_dir):
+                os.makedirs(_dir)
+            _fd, _tmp = tempfile.mkstemp(prefix=".confindex-", dir=_dir)
+            try:
+                _file = os.fdopen(_fd, "wb")
+                marshal.dump(_saved, _file)
+                _file.close()
+                os.rename(_tmp, path)
+            except:
+                os.unlink(_tmp)
+                raise
+        except (IOError, OSError, ValueError):
+            pass
@@ -16,12 +16,24 @@
 if not "os" in vars():
     import os
 
-if not "re" in vars():
-    import re
-
 if "HTTPLog" not in vars() or "httplog" not in vars():
             from lib.httplog import HTTPLog
 
+if "Matcher" not in vars():
+    from lib.matcher import Matcher, MatchError
+
+if "SignatureDB" not in vars():
+    from lib.sigdb import SignatureDB, SignatureError, matcherfor, ALLOW
+
+if "IPTreeError" not in vars():
+    from lib.iptree import IPTreeError
+
+if "TimeRangeError" not in vars():
+    from lib.timerange import TimeRangeError
+
+if not "time" in vars():
+    import time
+
 
 class InitErr(Exception):
     pass
@@ -31,25 +43,84 @@ class ConfErr(Exception):
     pass
 
 
+class VerdictCache():
+    """
+    A bounded cache of signature verdicts keyed by (field index, value). It is an
+    approximate LRU using two generations of dict, lookups hit the current one and
+    then the previous one, promoting anything found there. When the current one is
+    full it becomes the previous one, so the least recently used entries are the
+    ones dropped and at most size entries are held. Plain dicts keep a lookup far
+    cheaper than running the signatures again.
+    """
+    def __init__(self, size=10000):
+        self.size = size
+        self.current = {}
+        self.previous = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        _value = self.current.get(key)
+        if _value is None:
+            _value = self.previous.get(key)
+            if _value is None:
+                self.misses += 1
+                return None
+            self.put(key, _value)
+        self.hits += 1
+        return _value
+
+    def put(self, key, value):
+        if len(self.current) >= max(1, self.size // 2):
+            self.previous = self.current
+            self.current = {}
+        self.current[key] = value
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+
 class Filter():
     """
     The filter class takes in an instance of HTTPLog, if it
     cannot be found, it will return an InitError. It also
     must take in a filename of where the signatures will be
     kept, the default is signatures.conf. There is a signatures_conf.py.sample
-    file with this, check here for examples.
+    file with this, check here for examples. Extra plain text or JSON
+    signature lists can be given too, and with a cachedir the compiled
+    signatures are cached there, see SignatureDB. Filters of several
+    logs can share one SignatureDB, so the signatures are only loaded
+    once. Hosts in the allow list of the signatures are skipped before
+    any signature is run.
     """
 
     ########
     # INIT #
     ########
-    def __init__(self, httplog, sigconf="signatures_conf.py"):
+    def __init__(self, httplog, sigconf="signatures_conf.py", cachesize=10000, stats=None, lists=None,
+                 cachedir=None, sigdb=None):
         if not isinstance(httplog, HTTPLog):
             raise InitErr("Filter requires a valid instance of HTTPLog")
 
         self.httplog = httplog
         self.sigconf = sigconf
+        self.sigdb = sigdb if sigdb is not None else SignatureDB(sigconf, lists, cachedir)
         self.matches = []
+        # With a BloomFilter the matches are only remembered in it and not kept in matches,
+        # so a long run takes a fixed amount of memory, see filtervalues
+        self.seen = None
+        self.compiled = None  # The compiled signatures, built on first use
+        self.allow = None  # The CIDRMatcher of the allow list, if there is one
+        self.detectors = []  # Anything else flagging records, i.e. a RateDetector
+        self.observers = []  # Anything counting every record, i.e. a Report
+        # The signatures matching each recently seen field value, so repeated agents
+        # etc aren't checked again, a cachesize of 0 turns this off
+        self.cache = VerdictCache(cachesize) if cachesize else None
+        # With a Stats instance the hits and match time of every signature are recorded,
+        # each signature is then run on its own so this is for finding slow signatures
+        self.stats = stats
+        # Specify our signature types we can expect to find in our config file
+        self.signature_types = ["agent", "host", "remotelog", "user", "request", "status", "size", "referrer", "time"]
 
     ############
     # OPENCONF #
@@ -64,36 +135,411 @@ class Filter():
         else:
             raise ConfErr("Check signature config path and permissions")
 
+    ##################
+    # LOADSIGNATURES #
+    ##################
+    def loadsignatures(self):
+        """
+        Load the signature config file and lists, returning a dictionary of each
+        field to its compiled Matcher
+        """
+        try:
+            return self.sigdb.load()
+        except SignatureError as err:
+            raise ConfErr(str(err))
+
+    ##################
+    # COMPILEFILTERS #
+    ##################
+    def compilefilters(self, confsignatures):
+        """
+        Compile the configured signatures of each field into a single Matcher,
+        returning a list of (schema index, Matcher) for every field we can filter on,
+        the signatures of a field can be a list or an already compiled Matcher. Host
+        signatures get a CIDRMatcher and time signatures a TimeMatcher.
+        """
+        _schema = self.httplog.logschema
+        _compiled = []
+        for _signature in self.signature_types:
+            # If the signature is configured and the field is in our log
+            if _signature in confsignatures and len(confsignatures[_signature]):
+                # The host is usually field 0, so check the schema has it rather than its index
+                if _signature in _schema:
+                    _sigidx = _schema[_signature]
+                    _matcher = confsignatures[_signature]
+                    if isinstance(_matcher, (list, tuple)):
+                        try:
+                            _matcher = matcherfor(_signature, _matcher)
+                        except (MatchError, IPTreeError, TimeRangeError) as err:
+                            raise ConfErr("%s signatures; %s" % (_signature, err))
+                    _compiled.append((_sigidx, _matcher))
+                    if self.stats is not None:
+                        # List every signature, so the ones that never hit show up too
+                        for _regex in _matcher.signatures:
+                            self.stats.signature(_signature, _regex)
+        return _compiled
+
+    def compilesignatures(self):
+        """
+        Load and compile the signature config, timing both when we have stats
+        """
+        if self.stats is None:
+            _confsignatures = self.loadsignatures()
+            self.allow = _confsignatures.get(ALLOW)
+            return self.compilefilters(_confsignatures)
+        with self.stats.phase("loadsignatures"):
+            _confsignatures = self.loadsignatures()
+            self.allow = _confsignatures.get(ALLOW)
+        with self.stats.phase("compilefilters"):
+            return self.compilefilters(_confsignatures)
+
+    #############
+    # ALLOWLIST #
+    #############
+    def allowlist(self):
+        """
+        Return (schema index of the host, match) for the allow list, match giving
+        None for a host that isn't allowed, or None when there is no allow list
+        """
+        if self.allow is None or not len(self.allow):
+            return None
+        _schema = self.httplog.logschema
+        if "host" not in _schema:
+            raise ConfErr("The allow list needs a log format with the host, %h")
+        return _schema["host"], self.allow.match
+
+    ###############
+    # ADDDETECTOR #
+    ###############
+    def adddetector(self, detector):
+        """
+        Add a detector, i.e. a RateDetector, its check method is given every record
+        and a record is a match if any detector or signature flags it
+        """
+        self.detectors.append(detector)
+
+    def addobserver(self, observer):
+        """
+        Add an observer, i.e. a Report, its observe method is given every record,
+        allow listed or not, and whether it was flagged
+        """
+        self.observers.append(observer)
+
+    ##############
+    # FIELDSUSED #
+    ##############
+    def fieldsused(self, req="host"):
+        """
+        Return the list of log fields a run for req needs, the configured
+        signature fields plus req itself
+        """
+        self.openconf()
+        _confsignatures = self.loadsignatures()
+        _fields = [_field for _field in self.signature_types
+                   if _field in _confsignatures and len(_confsignatures[_field])]
+        if ALLOW in _confsignatures and "host" not in _fields:
+            _fields.append("host")
+        for _detector in self.detectors + self.observers:
+            _fields.extend(_field for _field in _detector.fields if _field not in _fields)
+        if req not in _fields:
+            _fields.append(req)
+        return _fields
+
+    ###############
+    # CHECKRECORD #
+    ###############
+    def checkrecord(self, record, compiled):
+        """
+        Return True if any of the compiled filters match the log record
+        """
+        if self.stats is not None:
+            return self.profilerecord(record, compiled)
+        _cache = self.cache
+        for _sigidx, _matcher in compiled:
+            _value = record[_sigidx]
+            if _cache is None:
+                if _matcher.match(_value) is not None:
+                    return True
+                continue
+            _key = (_sigidx, _value)
+            _ids = _cache.get(_key)
+            if _ids is None:
+                _ids = tuple(_matcher.matchall(_value))
+                _cache.put(_key, _ids)
+            if _ids:
+                return True
+        return False
+
+    #################
+    # PROFILERECORD #
+    #################
+    def profilerecord(self, record, compiled):
+        """
+        checkrecord with stats, every field is checked and the hits of each signature
+        counted, values that aren't cached are run against each signature on its own
+        so its match time can be recorded
+        """
+        _cache = self.cache
+        _stats = self.stats
+        _fields = dict((_idx, _field) for _field, _idx in self.httplog.logschema.items())
+        _hit = False
+        for _sigidx, _matcher in compiled:
+            _value = record[_sigidx]
+            _field = _fields[_sigidx]
+            _ids = _cache.get((_sigidx, _value)) if _cache is not None else None
+            if _ids is None and not isinstance(_matcher, Matcher):
+                # A CIDRMatcher is one tree lookup for all of its addresses, and a TimeMatcher
+                # decodes the time once for all of its ranges, so time them as a whole
+                _start = time.time()
+                _ids = tuple(_matcher.matchall(_value))
+                _stats.signature(_field, "(time ranges)" if _field == "time" else "(ip tree)",
+                                 hits=1 if _ids else 0, evaluations=1, seconds=time.time() - _start)
+                if _cache is not None:
+                    _cache.put((_sigidx, _value), _ids)
+            elif _ids is None:
+                _ids = []
+                for _idx, _regex in enumerate(_matcher.getregexes()):
+                    _start = time.time()
+                    _match = _regex.match(_value)
+                    _stats.signature(_field, _matcher.signatures[_idx], evaluations=1, seconds=time.time() - _start)
+                    if _match:
+                        _ids.append(_idx)
+                _ids = tuple(_ids)
+                if _cache is not None:
+                    _cache.put((_sigidx, _value), _ids)
+            for _idx in _ids:
+                _stats.signature(_field, _matcher.signatures[_idx], hits=1)
+            if _ids:
+                _hit = True
+        return _hit
+
+    ##############
+    # RECORDHITS #
+    ##############
+    def recordhits(self, record, compiled):
+        """
+        Return a list of (field index, signature) for every signature matching the log record
+        """
+        _hits = []
+        _cache = self.cache
+        for _sigidx, _matcher in compiled:
+            _value = record[_sigidx]
+            _ids = _cache.get((_sigidx, _value)) if _cache is not None else None
+            if _ids is None:
+                _ids = tuple(_matcher.matchall(_value))
+                if _cache is not None:
+                    _cache.put((_sigidx, _value), _ids)
+            for _idx in _ids:
+                _hits.append((_sigidx, _matcher.signatures[_idx]))
+        return _hits
+
     ###############
     # APPLYFILTER #
     ###############
-    def applyfilter(self, signatures, filtername):
+    def applyfilter(self, signatures, filtername, records=None):
         """
         Run this against each filter in the filter conf file,
         take in the name of the filter as well as the filter
-        list of regex itself
+        list of regex itself, optionally the records to run
+        against, otherwise the records of our httplog are used
         """
         if len(signatures):
-            # Make a local copy of the logschema and logmatch
-            _schema = self.httplog.logschema
-            _log = self.httplog.logmatch
-            _sigidx = False
+            if records is None:
+                records = self.httplog.records()
+            _compiled = self.compilefilters({filtername: signatures})
             _thisresults = []
-            # If our filtername is in the schema
-            if filtername in _schema:
-                _sigidx = _schema[filtername]
-            if _sigidx:
+            if _compiled:
                 # Well run our search against each line in the log
-                for _line in _log:
-                    for _signature in signatures:
-                        # If we get a signature match, send it to the results list
-                        if re.match(re.compile(_signature), _line[_sigidx]):
-                            _thisresults.append(_line)
+                for _line in records:
+                    # If we get a signature match, send it to the results list
+                    if self.checkrecord(_line, _compiled):
+                        _thisresults.append(_line)
             return _thisresults
 
         else:
             return []
 
+    #################
+    # FILTERRECORDS #
+    #################
+    def filterrecords(self, records, req="host"):
+        """
+        Generator; run our signatures against each of the records and yield the req
+        field of every match the first time it is seen, each new value is also added
+        to our object matches.
+        """
+        if self.openconf():
+
+            # Make a local copy of the logschema
+            _schema = self.httplog.logschema
+            if req not in _schema:
+                raise ConfErr("Unknown result field '%s'; choose one of %s" % (req, ", ".join(sorted(_schema))))
+            _reqidx = _schema[req]
+            _match = self.recordmatcher()
+            self.checkfields()
+            # Use a set so we are unique at all times, no duplicates
+            _seen = set(self.matches) if self.seen is None else self.seen
+            _keep = self.seen is None
+            _observers = self.observers
+            if _observers:
+                # The same as below, with every record and its verdict given to the observers
+                for _line in records:
+                    _hit = _match(_line)
+                    for _observer in _observers:
+                        _observer.observe(_line, _hit)
+                    if _hit:
+                        _value = _line[_reqidx]
+                        if _value not in _seen:
+                            _seen.add(_value)
+                            if _keep:
+                                self.matches.append(_value)
+                            yield _value
+            else:
+                for _line in records:
+                    if _match(_line):
+                        _value = _line[_reqidx]
+                        if _value not in _seen:
+                            _seen.add(_value)
+                            if _keep:
+                                self.matches.append(_value)
+                            yield _value
+
+    ###############
+    # CHECKFIELDS #
+    ###############
+    def checkfields(self):
+        """
+        Raise a ConfErr if there is nothing to match a record on; none of the signature
+        fields are in the LogFormat and there are no detectors or observers
+        """
+        if not (self.compiled or self.detectors or self.observers):
+            raise ConfErr("None of the signature fields are in the LogFormat for %s, there is nothing to match"
+                          % self.httplog.logtype)
+
+    #################
+    # RECORDMATCHER #
+    #################
+    def recordmatcher(self):
+        """
+        Return a function taking a log record and returning True if it matches; the
+        host isn't in the allow list and a signature or detector flags the record.
+        The signatures are compiled first if they haven't been.
+        """
+        # Compile every configured signature up front, only once per Filter
+        if self.compiled is None:
+            self.compiled = self.compilesignatures()
+        _compiled = self.compiled
+        _checkrecord = self.checkrecord
+        _detectors = self.detectors
+        _allowlist = self.allowlist()
+
+        def _match(record):
+            if _allowlist is not None and _allowlist[1](record[_allowlist[0]]) is not None:
+                return False
+            _hit = _checkrecord(record, _compiled)
+            # Every detector has to see every record to keep its counts
+            for _detector in _detectors:
+                if _detector.check(record):
+                    _hit = True
+            return _hit
+        return _match
+
+    ###########
+    # EXPLAIN #
+    ###########
+    def explain(self, record):
+        """
+        Return (field, signature) for every signature matching the log record,
+        as recordhits but by field name
+        """
+        if self.compiled is None:
+            self.compiled = self.compilesignatures()
+        _fields = dict((_idx, _field) for _field, _idx in self.httplog.logschema.items())
+        return [(_fields[_sigidx], _signature) for _sigidx, _signature in self.recordhits(record, self.compiled)]
+
+    #################
+    # FILTERCOLUMNS #
+    #################
+    def filtercolumns(self, store, req="host"):
+        """
+        Generator; the same as filterrecords but run straight over the columns
+        of a ColumnStore. Each signature is checked once per distinct value of
+        a column, every row after that is a lookup on the value's code.
+        """
+        if self.openconf():
+
+            _schema = self.httplog.logschema
+            if req not in _schema:
+                raise ConfErr("Unknown result field '%s'; choose one of %s" % (req, ", ".join(sorted(_schema))))
+            if self.compiled is None:
+                self.compiled = self.compilesignatures()
+            _fields = dict((_idx, _field) for _field, _idx in _schema.items())
+            _reqcol = store.column(req)
+            # For each filtered column keep its codes, its decoder and the verdicts seen so far
+            _checks = []
+            for _sigidx, _matcher in self.compiled:
+                _column = store.column(_fields[_sigidx])
+                _checks.append((_column.codes, _column.decode, _matcher.match, {}))
+            # The allow list is checked once per distinct host too
+            _allowlist = self.allowlist()
+            if _allowlist is not None:
+                _column = store.column("host")
+                _allowcodes, _allowdecode, _allowed = _column.codes, _column.decode, {}
+
+            _seen = set(self.matches) if self.seen is None else self.seen
+            _keep = self.seen is None
+            _detectors = self.detectors
+            _observers = self.observers
+            self.checkfields()
+            for _row in xrange(len(store)):
+                if _allowlist is not None:
+                    _code = _allowcodes[_row]
+                    _allow = _allowed.get(_code)
+                    if _allow is None:
+                        _allow = _allowed[_code] = _allowlist[1](_allowdecode(_code)) is not None
+                    if _allow:
+                        if _observers:
+                            _record = store.record(_row)
+                            for _observer in _observers:
+                                _observer.observe(_record, False)
+                        continue
+                _hit = False
+                for _codes, _decode, _match, _verdicts in _checks:
+                    _code = _codes[_row]
+                    _hit = _verdicts.get(_code)
+                    if _hit is None:
+                        _hit = _verdicts[_code] = _match(_decode(_code)) is not None
+                    if _hit:
+                        break
+                if _detectors or _observers:
+                    # Detectors and observers work on whole records, so rebuild this one for them
+                    _record = store.record(_row)
+                    for _detector in _detectors:
+                        if _detector.check(_record):
+                            _hit = True
+                    for _observer in _observers:
+                        _observer.observe(_record, _hit)
+                if _hit:
+                    _value = _reqcol.decode(_reqcol.codes[_row])
+                    if _value not in _seen:
+                        _seen.add(_value)
+                        if _keep:
+                            self.matches.append(_value)
+                        yield _value
+
+    ################
+    # FILTERVALUES #
+    ################
+    def filtervalues(self, req="host"):
+        """
+        Generator; run the filter over the whole log, yielding the req field of
+        each match the first time it is seen. With seen set to a BloomFilter this
+        is the way to get them, as they aren't kept in matches.
+        """
+        if self.httplog.logstore is not None:
+            return self.filtercolumns(self.httplog.logstore, req)
+        return self.filterrecords(self.httplog.records(), req)
+
     #############
     # RUNFILTER #
     #############
@@ -102,38 +548,8 @@ class Filter():
         run the filter against the config file, the req value
         is what field you would like to return if there
         is a match found, by default it is host.
+            The log records are walked once, so a streaming
+        httplog is never loaded into memory as a whole.
         """
-        if self.openconf():
-
-            # Create an empty results file
-            _results = []
-            # Make a local copy of the logschema
-            _schema = self.httplog.logschema
-            # Import the config file
-            _signatures_conf = __import__(self.sigconf.replace(".py", ""))
-            # Clone the signatures dictionary from signatures_conf file
-            _confsignatures = _signatures_conf.signatures
-            # Specify our signature types we can expect to find in our config file
-            _signature_types = ["agent", "host", "remotelog", "user", "request", "status", "size", "referrer", "time"]
-            for _signature in _signature_types:
-                # If the signature is configured
-                if _signature in _confsignatures:
-                    # Apply the filter and get the results
-                    _thisresults = self.applyfilter(_confsignatures[_signature], _signature)
-                    for _line in _thisresults:
-                        # If this result isn't already in our main results list, append it
-                        if not _line in _results:
-                            _results.append(_line)
-
-            # Make sure we are unique at all times, no duplicates
-            _results = list(set(_results))
-
-            # For each result we have in our unique list, add it to our object matches
-            # using our request type req, by default this is host
-            for _result in _results:
-                self.matches.append(_result[_schema[req]])
-
-            # Now truncate our main object matches to have only uniques
-            self.matches = list(set(self.matches))
-
-
+        for _value in self.filtervalues(req):
+            pass
@@ -0,0 +1,335 @@
+#!/bin/env python
+#
+#   follow.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The Follower class tails the log of an HTTPLog,
+#   only parsing the bytes appended since it last
+#   looked. It wakes on inotify where the kernel has
+#   it and polls otherwise, copes with logrotate and
+#   keeps a byte offset checkpoint on disk so that a
+#   restart carries on where it left off.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "json" in vars():
+    import json
+
+if not "time" in vars():
+    import time
+
+if not "select" in vars():
+    import select
+
+if not "ctypes" in vars():
+    import ctypes
+    import ctypes.util
+
+
+class FollowError(Exception):
+    pass
+
+
+class Inotify():
+    """
+    A very small ctypes wrapper around the linux inotify calls, raises
+    FollowError if inotify isn't available so the caller can fall back
+    to polling.
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+
+    ########
+    # INIT #
+    ########
+    def __init__(self):
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self.fd = self._libc.inotify_init()
+        except (OSError, AttributeError) as err:
+            raise FollowError("inotify unavailable; %s" % err)
+        if self.fd < 0:
+            raise FollowError("inotify unavailable; %s" % os.strerror(ctypes.get_errno()))
+
+    def watch(self, path, mask):
+        """
+        Add a watch on path for the events in mask
+        """
+        if self._libc.inotify_add_watch(self.fd, path, mask) < 0:
+            raise FollowError("Unable to watch %s; %s" % (path, os.strerror(ctypes.get_errno())))
+
+    def wait(self, timeout):
+        """
+        Block until an event arrives or timeout seconds pass, the events are drained
+        and discarded, we only care that something happened
+        """
+        _ready = select.select([self.fd], [], [], timeout)[0]
+        if _ready:
+            os.read(self.fd, 65536)
+        return bool(_ready)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Follower():
+    """
+    @Summary    Follows the log of an HTTPLog instance, yielding the parsed records of any new
+                lines as they are written.
+
+    @Guide      The HTTPLog should be created with stream=True so the existing log isn't loaded.
+                Only complete lines are parsed, a partially written line is held back until its
+                newline arrives. If the inode of the log changes, the rest of the old file is read
+                and then the new file is followed from the start, if the log shrinks it is treated
+                as truncated and also read from the start.
+                    The new lines are read chunksize bytes at a time and each record is handed out
+                as soon as it is parsed, so a long backlog behind an old checkpoint is never held in
+                memory at once. If a checkpoint file is given, the inode and the byte offset past the
+                last record handed out are saved to it and loaded back on the next start, otherwise
+                following starts at the end of the log, so a record read but not yet handed out when
+                we stop is read again rather than lost.
+                    follow does all of this itself, to follow several logs at once call start with a
+                shared Inotify, then poll each Follower whenever it wakes, see Monitor.
+
+    @Parameters
+                httplog="HTTPLog instance to follow"
+                checkpoint="path of the offset checkpoint file" i.e. "httpdefender.offset"
+                interval="seconds between polls, or the longest we wait on inotify" i.e. 1.0
+
+    @Example    follower = Follower(log, checkpoint="httpdefender.offset")
+                for record in follower.follow(): ...
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, httplog, checkpoint=None, interval=1.0):
+        self.httplog = httplog
+        # Only the newest log is followed, that's the one apache writes to
+        httplog.checklog()
+        self.path = httplog.logpath
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.inode = None
+        self.offset = 0  # How far the log has been read
+        self.position = None  # The (inode, offset) past the last record handed out, what is checkpointed
+        self.inotify = None
+        self.shared = None  # An Inotify shared with other Followers, which we don't own
+        self.log = None
+        self.parse = None
+        self.running = False
+        self.saved = None  # The (inode, offset) last written to the checkpoint
+        self.loadcheckpoint()
+
+    ##################
+    # LOADCHECKPOINT #
+    ##################
+    def loadcheckpoint(self):
+        """
+        Resume from the checkpoint if it is for the same file, otherwise start at the
+        end of the log
+        """
+        _stat = os.stat(self.path)
+        self.inode = _stat.st_ino
+        self.offset = _stat.st_size
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            try:
+                _saved = json.load(open(self.checkpoint, "r"))
+                _inode, _offset = int(_saved["inode"]), int(_saved["offset"])
+            except (IOError, ValueError, KeyError, TypeError) as err:
+                raise FollowError("Unable to read checkpoint %s; %s" % (self.checkpoint, err))
+            # Only resume if this is the same file and it hasn't been truncated since
+            if _inode == self.inode and _offset <= _stat.st_size:
+                self.offset = _offset
+        self.position = (self.inode, self.offset)
+
+    ##################
+    # SAVECHECKPOINT #
+    ##################
+    def savecheckpoint(self):
+        """
+        Write the inode and offset past the last record handed out to the checkpoint
+        file, via a rename so a crash never leaves it half written
+        """
+        if not self.checkpoint or self.saved == self.position:
+            return
+        _inode, _offset = self.position
+        _tmp = "%s.tmp" % self.checkpoint
+        _file = open(_tmp, "w")
+        try:
+            json.dump({"path": self.path, "inode": _inode, "offset": _offset}, _file)
+            _file.flush()
+            os.fsync(_file.fileno())
+        finally:
+            _file.close()
+        os.rename(_tmp, self.checkpoint)
+        self.saved = (_inode, _offset)
+
+    ###########
+    # READNEW #
+    ###########
+    def readnew(self, log):
+        """
+        Generator; yield each complete line appended to the open log past our
+        offset and the offset just past it, reading a chunk at a time and moving
+        our offset on as the lines are handed out. The partial line at the end
+        is left for the next read.
+        """
+        log.seek(self.offset)
+        _offset = self.offset
+        _tail = ""
+        while True:
+            _chunk = log.read(self.httplog.chunksize)
+            if not _chunk:
+                break
+            _split = (_tail + _chunk).split("\n")
+            _tail = _split.pop()
+            for _line in _split:
+                _offset += len(_line) + 1
+                self.offset = _offset
+                yield _line, _offset
+
+    ###########
+    # ROTATED #
+    ###########
+    def rotated(self):
+        """
+        Return True if the log at our path is no longer the file we are reading, or
+        it has been truncated
+        """
+        try:
+            _stat = os.stat(self.path)
+        except OSError:
+            # Moved away and not yet recreated, keep reading the old one
+            return False
+        return _stat.st_ino != self.inode or _stat.st_size < self.offset
+
+    #########
+    # WATCH #
+    #########
+    def watch(self):
+        """
+        Set up inotify for the log and its directory, so we see both writes and
+        logrotate creating a new file, fall back to polling if we can't
+        """
+        if self.shared is not None:
+            try:
+                self.addwatches(self.shared)
+            except FollowError:
+                # The shared wait still times out, so this log is polled instead
+                pass
+            return
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        try:
+            self.inotify = Inotify()
+            self.addwatches(self.inotify)
+        except FollowError:
+            if self.inotify:
+                self.inotify.close()
+            self.inotify = None
+
+    def addwatches(self, inotify):
+        inotify.watch(self.path, Inotify.IN_MODIFY | Inotify.IN_ATTRIB |
+                      Inotify.IN_MOVE_SELF | Inotify.IN_DELETE_SELF)
+        inotify.watch(os.path.dirname(os.path.abspath(self.path)),
+                      Inotify.IN_CREATE | Inotify.IN_MOVED_TO)
+
+    ########
+    # WAIT #
+    ########
+    def wait(self):
+        """
+        Wait for the log to change, or for interval seconds when polling
+        """
+        if self.inotify:
+            self.inotify.wait(self.interval)
+        else:
+            time.sleep(self.interval)
+
+    #########
+    # START #
+    #########
+    def start(self, inotify=None):
+        """
+        Open the log and start watching it, on inotify if given one shared with
+        other Followers
+        """
+        self.parse = self.httplog.parser()
+        self.shared = inotify
+        self.running = True
+        self.watch()
+        self.log = open(self.path, "rb")
+
+    ########
+    # POLL #
+    ########
+    def poll(self):
+        """
+        Generator; yield the parsed record of every new line in the log, moving
+        on to the new file when the log has been rotated. Our position is moved
+        past each record as it is yielded, so a checkpoint only ever covers the
+        records already handed out.
+        """
+        _parse = self.parse
+        while True:
+            # If it has been rotated, this finishes off the old file before we move on
+            _rotated = self.rotated()
+            for _line, _offset in self.readnew(self.log):
+                _record = _parse(_line)
+                if _record:
+                    self.position = (self.inode, _offset)
+                    yield _record
+            # Any lines after the last record didn't parse, they are done with too
+            self.position = (self.inode, self.offset)
+            if not _rotated:
+                return
+            # Start on the new one from the beginning
+            self.log.close()
+            self.log = open(self.path, "rb")
+            self.inode = os.fstat(self.log.fileno()).st_ino
+            self.offset = 0
+            self.position = (self.inode, 0)
+            self.watch()
+
+    ##########
+    # FOLLOW #
+    ##########
+    def follow(self):
+        """
+        Generator; yield a parsed record for every new line in the log, forever or
+        until stop is called
+        """
+        self.start()
+        try:
+            while self.running:
+                for _record in self.poll():
+                    yield _record
+                self.savecheckpoint()
+                self.wait()
+        finally:
+            self.close()
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        self.savecheckpoint()
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
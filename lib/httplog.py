@@ -24,6 +24,36 @@ if not "os" in vars():
     import os
 if not "re" in vars():
     import re
+if not "mmap" in vars():
+    import mmap
+if not "itertools" in vars():
+    import itertools
+if not "glob" in vars():
+    import glob
+if not "gzip" in vars():
+    import gzip
+if not "bz2" in vars():
+    import bz2
+if not "subprocess" in vars():
+    import subprocess
+if "ColumnStore" not in vars():
+    from lib.columnar import ColumnStore
+if "LogFormat" not in vars():
+    from lib.logformat import LogFormat, LogFormatError
+if "ConfIndex" not in vars():
+    from lib.confindex import ConfIndex, ConfIndexError
+if "TimeSeeker" not in vars():
+    from lib.timeseek import TimeSeeker, TimeSeekError, firsttime, linetime
+
+# xz needs the lzma module, python 3.3 on or the backports.lzma package, without
+# it xz logs are piped through the xz command instead
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 class InitError(Exception):
@@ -38,6 +68,65 @@ class LogError(Exception):
     pass
 
 
+class XZPipe():
+    """
+    Reads an xz compressed file through the xz command, for when there is no
+    lzma module, it has the read and close methods the log readers need.
+    """
+    def __init__(self, path):
+        try:
+            self._process = subprocess.Popen(["xz", "-dc", path], stdout=subprocess.PIPE)
+        except OSError as err:
+            raise LogError("Unable to decompress %s; no lzma module or xz command (%s)" % (path, err))
+        self.read = self._process.stdout.read
+
+    def close(self):
+        self._process.stdout.close()
+        if self._process.wait() not in (0, -13):
+            raise LogError("xz failed to decompress the log")
+
+
+##################
+# LOGCOMPRESSION #
+##################
+def logcompression(path):
+    """
+    Return gzip, bz2 or xz if the file at path is compressed, going by its
+    magic number, otherwise None
+    """
+    _log = open(path, 'rb')
+    try:
+        _magic = _log.read(6)
+    finally:
+        _log.close()
+    if _magic.startswith("\x1f\x8b"):
+        return "gzip"
+    if _magic.startswith("BZh"):
+        return "bz2"
+    if _magic == "\xfd7zXZ\x00":
+        return "xz"
+    return None
+
+
+###############
+# OPENLOGFILE #
+###############
+def openlogfile(path):
+    """
+    Open a log for reading, decompressing it as a stream if it needs it
+    """
+    _compression = logcompression(path)
+    if _compression == "gzip":
+        return gzip.GzipFile(path, 'rb')
+    if _compression == "bz2":
+        return bz2.BZ2File(path, 'rb')
+    if _compression == "xz":
+        if lzma is not None:
+            return lzma.LZMAFile(path, 'rb')
+        return XZPipe(path)
+    return open(path, 'rb')
+
+
 class HTTPLog():
     """
     @Summary    This represents the HTTPLog in context, for an initializer it can take in
@@ -53,18 +142,41 @@ class HTTPLog():
                 to open.
                 If you have the LogFormat for this log set up as:
                 LogFormat "%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-Agent}i\"" combined
-                Then it will open the access_log using this format.
+                Then it will open the access_log using this format. The CustomLog and LogFormat
+                can be in any file the config includes, and the format can be given inline in the
+                CustomLog too, see ConfIndex.
                     If %h and %{User-Agent} aren't both defined, then httpoffender won't work.
 
     @Parameters
                 conf="httpd.conf file being used" i.e. conf="/etc/httpd/conf/httpd.conf"
                 log="log file to check as specified in conf" i.e. logs/access_log
-                fullpath="full path including log name" i.e. "/var/log/http/access_log"
+                fullpath="full path including log name" i.e. "/var/log/http/access_log", this can
+                also be a glob or a list of paths, i.e. "/var/log/http/access_log*", rotated logs
+                are read oldest first and gzip, bz2 and xz logs are decompressed as they are read
+                stream=True to skip loading logmatch; records are read lazily via iterlog,
+                with fullpath=None no log is opened at all, only the parser is set up
+                chunksize="bytes read from the log per chunk", defaults to 1MB
+                backend="chunked" or "mmap", mmap runs the log regex straight over the mapped file
+                fields="list of fields a run needs" i.e. ["agent", "host"], only these are
+                captured by the log regex, every other field in a record is None. Combined logs
+                read by the chunked backend are split on their quotes instead, see makeparser
+                store="tuples" or "columnar", columnar loads the log into logstore, a compact
+                ColumnStore, rather than a list of tuples in logmatch
+                stats="a Stats instance", the time of each phase and the lines parsed and
+                rejected are added to it
+                confcache="where to cache the index of the config", the config and the files
+                it includes are then only parsed again when one of them changes
+                since, until="epoch seconds", only the lines logged from since up to and
+                including until are read, see logranges
 
     @Example    log = HTTPLog(conf="/etc/httpd/conf/httpd.conf", log="logs/access_log", base="/var/log/http/access_log")
     """
-    # If it has a # at the beginning of any match, ignore it.
-    # It matches CustomLog logname logtype
+    # The combined LogFormat, logs in this format can be split rather than run through a regex
+    COMBINED = '%h %l %u %t \\"%r\\" %>s %b \\"%{Referer}i\\" \\"%{User-Agent}i\\"'
+    # Maps digits to 9 and letters to a, so a timestamp can be checked against the shape of %t
+    _shape = "".join("9" if chr(_idx).isdigit() else "a" if chr(_idx).isalpha() else chr(_idx)
+                     for _idx in range(256))
+    _timeshapes = ("[99/aaa/9999:99:99:99 +9999]", "[99/aaa/9999:99:99:99 -9999]")
 
     ########
     # INIT #
@@ -74,52 +186,86 @@ class HTTPLog():
         if "log" not in kwargs or "conf" not in kwargs or "fullpath" not in kwargs:
             raise InitError("You must give the following keyword arguments; log, conf and fullpath.")
 
-                #############
-        # CONSTANTS #
-        #############
-        self._mask = "([0-9]|[1-9][0-9]|1[0-9][0-9]|2[0-4][0-9]|25[0-5])"
-        #_netmatch = "(%s\.%s\.%s\.%s)" % (_mask, _mask, _mask, _mask)
-        self._netmatch = "(\d{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})"
-        #####################
-        # LOG FORMAT TUPLES #
-        #####################
-        # apache defined log format variables, and equivalent regular expressions
-        self._apachere = [
-            ('%h', self._netmatch, "host"),  # The IP associated with the user
-            ('%l', "(\-|.+\w)", "remotelog"),  # Usually shows up as - because this information is rarely available
-            ('%u', "(\-|.+\w)", "user"),  # This is the userid, often shows up as -
-            ('%t', '.*\[([0-9]{2}\/[A-Za-z]{3}\/[0-9]{1,4}:[0-9]{1,2}:[0-9]{1,2}:[0-9]{1,2}\s[+\-][0-9]{4})\].*',
-                "time"),  # Timestamp of http request
-            ('\\"%r\\"', '\"(.+?)\"', "request"),  # Request formed as "%m %U%q %H"
-            ('%>s', "([0-9]{3})", "status"),  # Status code returned to client
-            ('%b', '([0-9]{1,}|\-)', "size"),  # Size of response
-            ('\\"%{User-Agent}i\\"', '\"(.+?)\"', "agent"),
-            ('\\"%{Referer}i\\"', '\"(.+?)\"', "referer")
-        ]
-
         self.conf = kwargs["conf"]
         self.fullpath = kwargs["fullpath"]
         self.log = kwargs["log"]
         self.logtype = ""
         self.logformat = ""
         self.logpath = ""
+        self.logpaths = []  # Every log matched by fullpath, oldest first, logpath is the newest
         self.logmatch = []
+        self.logre = None
+        self.formatstring = ""  # The LogFormat string, logformat becomes its regex
+        self.compiledformat = None  # The LogFormat compiled by getmatchschema
+        self.parserpath = None  # How the log is parsed; split, projected or full, see makeparser
+        self._parser = None  # (fields, parse function) built by makeparser
+        self.projected = None  # The log regex capturing only our fields, if it differs from logre
+        self.stream = kwargs.get("stream", False)
+        self.chunksize = kwargs.get("chunksize", 1048576)
+        self.backend = kwargs.get("backend", "chunked")
+        self.fields = kwargs.get("fields", None)
+        if self.backend not in ("chunked", "mmap"):
+            raise InitError("Unknown backend %s; use chunked or mmap" % self.backend)
+        self.store = kwargs.get("store", "tuples")
+        self.logstore = None
+        self.stats = kwargs.get("stats", None)
+        # Where the index of the config is cached, see ConfIndex
+        self.confcache = kwargs.get("confcache", None)
+        self.confindex = None
+        self.logentry = None  # The CustomLog of our log in confindex
+        self.since = kwargs.get("since", None)
+        self.until = kwargs.get("until", None)
+        if self.store not in ("tuples", "columnar"):
+            raise InitError("Unknown store %s; use tuples or columnar" % self.store)
         self.logschema = []  # Match schema, this will give us the index of where
                                #  each of our matches will be found in matchschema
 
         # Open the log file and get the log type i.e. combined, referer etc
-        self.getlogtype()
+        self.timed("getlogtype", self.getlogtype)
         # Now get the log format string
-        self.getlogformat()
+        self.timed("getlogformat", self.getlogformat)
         # Get the matchschema
-        self.getmatchschema()
+        self.timed("getmatchschema", self.getmatchschema)
         # Create a regex for the log format
-        self.makelogre()
-        # Open the log and parse it
-        self.openlog()
+        self.timed("makelogre", self.makelogre)
+        # A time window is found by the %t timestamps of the lines, any other time can't be read
+        if (self.since is not None or self.until is not None) and not self.compiledformat.clftime:
+            raise LogError("Unable to read the lines between two times; the LogFormat for %s has no %%t "
+                           "time in the common log format, i.e. [13/Dec/2013:10:00:00 +0000]" % self.logtype)
+        # Open the log and parse it, when streaming we only check we can read it,
+        # the records are then pulled through iterlog as they are needed. Streaming
+        # with no fullpath leaves only the parser, i.e. for a Pipeline reading stdin
+        if self.stream:
+            if self.fullpath is not None:
+                self.checklog()
+        else:
+            self.timed("openlog", self.openlog)
 
         #Access the schema with -> logschema
-        #Access the log matches with -> logmatch
+        #Access the log matches with -> logmatch, or records() when streaming
+
+    #########
+    # TIMED #
+    #########
+    def timed(self, name, method):
+        """
+        Call method, timing it as the phase name if we have stats
+        """
+        if self.stats is None:
+            return method()
+        with self.stats.phase(name):
+            return method()
+
+    ##############
+    # COUNTLINES #
+    ##############
+    def countlines(self, lines, parsed):
+        """
+        Add to the lines parsed and the lines the log format regex rejected
+        """
+        if self.stats is not None:
+            self.stats.count("lines parsed", parsed)
+            self.stats.count("lines rejected", lines - parsed)
 
     ####################
     # GET MATCH SCHEMA #
@@ -130,82 +276,406 @@ class HTTPLog():
         of interest will be, for instance if the log has: host, referrer, and time. We
         need to know which index we can find these in the returned tuple.
         """
-        _tmp = []
-        _schema = []
-        _dictschema = {}
-        for _re in self._apachere:
-            # Find the index of our log variable and stash it in tmp
-            _tmp.append((_re[2], self.logformat.index(_re[0])))
-            _schema.append(self.logformat.index(_re[0]))
-        _schema = sorted(_schema)
-
-        # Now we loop through the tuple list and swap out the
-        # string index for the sorted _schema index to get a real
-        # index.
-        for _idx, _loc in enumerate(_schema):
-            for _jdx, _tup in enumerate(_tmp):
-                if _tmp[_jdx][1] == _loc:
-                    _dictschema[_tmp[_jdx][0]] = _idx
-
-        # Store this as our log schema dict, we'll use it as a map to find results in our
-        # log result tuple
-        self.logschema = _dictschema
+        # The LogFormat compiler names every directive, so this is its schema
+        try:
+            self.compiledformat = LogFormat(self.logformat)
+        except LogFormatError as err:
+            raise ConfigError("Unable to use the LogFormat for %s; %s" % (self.logtype, err))
+        self.logschema = self.compiledformat.schema
+
+    #############
+    # CHECK LOG #
+    #############
+    def checklog(self):
+        """
+        Find the logs for fullpath, making sure they exist and are readable
+        """
+        _paths = self.fullpath
+        if isinstance(_paths, basestring):
+            _paths = [_paths]
+        self.logpaths = []
+        for _path in _paths:
+            # Expand any globs, a plain path is kept as it is so it gets checked below
+            _matches = glob.glob(_path) if glob.has_magic(_path) else [_path]
+            for _match in self.rotationorder(_matches):
+                if _match not in self.logpaths:
+                    self.logpaths.append(_match)
+        if not self.logpaths:
+            raise LogError("Unable to open log; no logs match %s" % self.fullpath)
+        for _path in self.logpaths:
+            if not (os.path.isfile(_path) and os.access(_path, os.R_OK)):
+                raise LogError("Unable to open log %s; check permissions and path" % _path)
+        self.logpath = self.logpaths[-1]
+
+    #################
+    # ROTATIONORDER #
+    #################
+    def rotationorder(self, paths):
+        """
+        Sort paths oldest first, going by the logrotate generation number, so
+        access_log.2.gz comes before access_log.1 which comes before access_log,
+        dateext logs such as access_log-20131214.gz are sorted by their date
+        """
+        def _generation(path):
+            _match = re.search(r"\.(\d+)(\.gz|\.bz2|\.xz)?$", path)
+            if _match:
+                return (0, -int(_match.group(1)), path)
+            _match = re.search(r"-(\d{8,10})(\.gz|\.bz2|\.xz)?$", path)
+            if _match:
+                return (0, int(_match.group(1)), path)
+            # The live log is the newest of them all
+            return (1, 0, path)
+        return sorted(paths, key=_generation)
+
+    ###############
+    # COMPRESSION #
+    ###############
+    def compression(self, path):
+        """
+        Return gzip, bz2 or xz if the file at path is compressed, otherwise None
+        """
+        return logcompression(path)
+
+    ############
+    # OPENFILE #
+    ############
+    def openfile(self, path):
+        """
+        Open a log for reading, decompressing it as a stream if it needs it
+        """
+        return openlogfile(path)
 
     ############
     # OPEN LOG #
     ############
     def openlog(self):
         """
-        open the logfile and parse it, creating a dictionary out of each line
+        open the logfile and parse it, storing a tuple for each line in logmatch,
+        or each line in logstore for the columnar store
+        """
+        if self.store == "columnar":
+            self.logstore = ColumnStore(self.logschema, self.fields)
+            _append = self.logstore.append
+        else:
+            _append = self.logmatch.append
+        for _match in self.iterlog():
+            _append(_match)
+
+    ########
+    # LOAD #
+    ########
+    def load(self):
+        """
+        Load a streaming log into memory, i.e. once fields has been set for the
+        columnar store, records() then returns what was loaded
+        """
+        self.stream = False
+        self.logmatch = []
+        self.timed("openlog", self.openlog)
+
+    ############
+    # ITER LOG #
+    ############
+    def iterlog(self):
+        """
+        Return a generator over the parsed log, the log is read in chunks of
+        chunksize bytes so memory stays flat no matter how big the log is.
+        """
+        self.checklog()
+        return itertools.chain.from_iterable(self.readlog(*_range) for _range in self.logranges())
+
+    #############
+    # LOGRANGES #
+    #############
+    def logranges(self):
+        """
+        Return a (path, start, end) byte range for each log to read. With since or
+        until, a rotated log wholly outside of them is left out and the window of
+        each uncompressed log is found with a TimeSeeker, a compressed log can't be
+        seeked so the whole of it is read, see windowfilter.
+        """
+        if self.since is None and self.until is None:
+            return [(_path, 0, None) for _path in self.logpaths]
+        try:
+            # A rotated log holds the lines up to the first line of the log after it
+            _firsts = []
+            for _path in self.logpaths:
+                _log = self.openfile(_path)
+                try:
+                    _firsts.append(firsttime(_log))
+                finally:
+                    _log.close()
+            _ranges = []
+            for _idx, _path in enumerate(self.logpaths):
+                _next = _firsts[_idx + 1] if _idx + 1 < len(_firsts) else None
+                if self.since is not None and _next is not None and _next < self.since:
+                    continue
+                if self.until is not None and _firsts[_idx] is not None and _firsts[_idx] > self.until:
+                    continue
+                if self.compression(_path):
+                    _ranges.append((_path, 0, None))
+                    continue
+                _start, _end = TimeSeeker(_path).window(self.since, self.until)
+                if _end > _start:
+                    _ranges.append((_path, _start, _end))
+        except (TimeSeekError, IOError, OSError) as err:
+            raise LogError("Unable to find the time window in the log; %s" % err)
+        return _ranges
+
+    def windowfilter(self):
+        """
+        Return a function taking a log line and returning False if it was logged
+        before since or after until, None if neither is set. Lines without a
+        timestamp are kept, for the parser to reject.
         """
-        self.logpath = os.path.join(self.fullpath)
-        if os.path.exists(self.logpath) and os.access(self.logpath, os.R_OK):
-            _log = open(self.logpath, 'r').readlines()
-            for _line in _log:
-                for _match in re.findall(re.compile(self.logformat), _line):
+        if self.since is None and self.until is None:
+            return None
+        _since = self.since if self.since is not None else float("-inf")
+        _until = self.until if self.until is not None else float("inf")
+
+        def _keep(line):
+            _time = linetime(line)
+            return _time is None or _since <= _time <= _until
+        return _keep
+
+    def readlog(self, path, start=0, end=None):
+        """
+        Return a generator yielding a tuple for each line of path matching the
+        compiled log format regex, using our backend. A byte range can be given
+        with start and end, these should fall just after a newline, compressed
+        logs can only be read as a whole.
+        """
+        if self.compression(path):
+            if start or end is not None:
+                raise LogError("Compressed logs can't be read by byte range; %s" % path)
+            # There is no seeking in a compressed log, the lines outside the window are dropped instead
+            return self.chunklog(path, keep=self.windowfilter())
+        if self.backend == "mmap":
+            return self.mmaplog(path, start, end)
+        return self.chunklog(path, start, end)
+
+    def chunklog(self, path, start=0, end=None, keep=None):
+        """
+        Generator; read path in buffered chunks and parse each line, only the
+        lines keep returns True for if it is given
+        """
+        _parse = self.parser()
+        _log = self.openfile(path)
+        _lines = _parsed = 0
+        try:
+            _tail = ""
+            if start:
+                _log.seek(start)
+            _remaining = end - start if end is not None else None
+            while _remaining is None or _remaining > 0:
+                _size = self.chunksize if _remaining is None else min(self.chunksize, _remaining)
+                _chunk = _log.read(_size)
+                if not _chunk:
+                    break
+                if _remaining is not None:
+                    _remaining -= len(_chunk)
+                # Split the chunk into lines, the last piece is carried over as it
+                # may be a partial line that continues in the next chunk
+                _split = (_tail + _chunk).split("\n")
+                _tail = _split.pop()
+                if keep is not None:
+                    _split = [_line for _line in _split if keep(_line)]
+                _lines += len(_split)
+                for _line in _split:
+                    _record = _parse(_line)
+                    if _record:
+                        _parsed += 1
+                        yield _record
+            # The last line may not be terminated with a newline
+            if _tail and (keep is None or keep(_tail)):
+                _lines += 1
+                _record = _parse(_tail)
+                if _record:
+                    _parsed += 1
+                    yield _record
+        finally:
+            _log.close()
+            self.countlines(_lines, _parsed)
+
+    ###########
+    # MMAPLOG #
+    ###########
+    def mmaplog(self, path, start=0, end=None):
+        """
+        Generator; map path into memory and run the log regex directly over the
+        mapped bytes a line at a time, so the log is never read into the heap.
+        Only the groups for our fields are captured and sliced out of the map.
+        """
+        _log = open(path, 'rb')
+        try:
+            _size = os.fstat(_log.fileno()).st_size
+            if not _size:
+                return
+            _lines = _parsed = 0
+            _map = mmap.mmap(_log.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # Lines are never copied out of the map, so this is always a regex
+                _matchline = self.projectre().match
+                _find = _map.find
+                _end = _size if end is None else end
+                _pos = start
+                while _pos < _end:
+                    _eol = _find("\n", _pos, _end)
+                    if _eol < 0:
+                        _eol = _end
+                    _lines += 1
+                    _match = _matchline(_map, _pos, _eol)
                     if _match:
-                        self.logmatch.append(_match)
+                        _parsed += 1
+                        yield _match.groups()
+                    _pos = _eol + 1
+            finally:
+                _map.close()
+                self.countlines(_lines, _parsed)
+        finally:
+            _log.close()
 
-        else:
-            raise LogError("Unable to open log; check permissions and path")
+    #############
+    # PARSELINE #
+    #############
+    def parseline(self, line):
+        """
+        Parse a single log line, returning its tuple or None if it doesn't match
+        the log format
+        """
+        return self.parser()(line)
+
+    ##############
+    # MAKEPARSER #
+    ##############
+    def parser(self):
+        """
+        Return the function parsing a line into a record for the current fields,
+        building it again if fields has changed
+        """
+        _fields = tuple(self.fields) if self.fields else None
+        if self._parser is None or self._parser[0] != _fields:
+            self._parser = (_fields, self.makeparser())
+        return self._parser[1]
+
+    def makeparser(self):
+        """
+        Build the line parser for the fields this run needs, setting parserpath to the
+        one chosen. A combined log read in chunks is split on its quotes and spaces
+        rather than run through a regex, lines that aren't laid out exactly as apache
+        writes them fall back on the regex. Otherwise the regex only captures the
+        fields we need, or every field when fields isn't set.
+        """
+        _matchline = self.projectre().match
+
+        def _regexparse(line):
+            _match = _matchline(line)
+            if _match:
+                return _match.groups()
+            return None
+
+        if self.formatstring == self.COMBINED and self.backend == "chunked":
+            self.parserpath = "split"
+            _split = self.splitcombined
+
+            def _splitparse(line):
+                return _split(line) or _regexparse(line)
+            return _splitparse
+        self.parserpath = "full" if self.projected is None else "projected"
+        return _regexparse
+
+    def projectre(self):
+        """
+        Return the log regex capturing only our fields, the groups of every other
+        field are left out but an empty group that never matches keeps its place,
+        so records have the same layout as with logre
+        """
+        _fields = set(self.fields or [])
+        self.projected = None
+        if not _fields or not [_field for _field in self.logschema if _field not in _fields]:
+            return self.logre
+        try:
+            self.projected = self.compiledformat.compile(_fields)
+        except LogFormatError as err:
+            raise ConfigError(err)
+        return self.projected
+
+    #################
+    # SPLITCOMBINED #
+    #################
+    def splitcombined(self, line):
+        """
+        Return the record of a combined format line by splitting it on its quotes
+        and spaces, or None if the line isn't laid out exactly as apache writes it,
+        i.e. it has escaped quotes, so the regex has to decide
+        """
+        _parts = line.split('"')
+        if len(_parts) != 7 or _parts[6] or _parts[4] != " " or "\\" in line:
+            return None
+        _head = _parts[0].split(" ")
+        _middle = _parts[2].split(" ")
+        if len(_head) != 6 or _head[5] or len(_middle) != 4 or _middle[0] or _middle[3]:
+            return None
+        _host, _remotelog, _user, _time, _zone = _head[:5]
+        _status, _size = _middle[1:3]
+        _time = "%s %s" % (_time, _zone)
+        if _time.translate(self._shape) not in self._timeshapes:
+            return None
+        if not (len(_status) == 3 and _status.isdigit() or _status == "-") or not (_size.isdigit() or _size == "-"):
+            return None
+        return (_host, _remotelog, _user, _time[1:-1], _parts[1], _status, _size,
+                _parts[3], _parts[5])
+
+    ###########
+    # RECORDS #
+    ###########
+    def records(self):
+        """
+        Return an iterable of the parsed log records, logmatch if the log has been
+        loaded, otherwise a fresh generator over the log.
+        """
+        if self.stream:
+            if self.stats is not None:
+                # Time the parsing apart from whatever is consuming the records
+                return self.stats.timeiter("openlog", self.iterlog())
+            return self.iterlog()
+        if self.logstore is not None:
+            return self.logstore
+        return self.logmatch
 
     ###############
     # MAKE LOG RE #
     ###############
     def makelogre(self):
         """
-        Apply the regex's to the logformat variable to create a regular expression
+        Compile the logformat into the regex for a whole log line, see LogFormat
         """
-        # Replace any spaces with \s for regex
-        self.logformat = self.logformat.replace(" ", "\s")
-        # Replace the apache formatting with regex
-        for _re in self._apachere:
-            self.logformat = self.logformat.replace(_re[0], _re[1])
+        self.formatstring = self.logformat
+        # Compile it once here rather than for every line in the log
+        try:
+            self.logre = self.compiledformat.compile()
+        except LogFormatError as err:
+            raise ConfigError(err)
+        self.logformat = self.logre.pattern
 
     ################
     # GET LOG TYPE #
     ################
     def getlogtype(self):
         """
-        Open the config file, find the log format type we are using
-        """
-        if os.path.exists(self.conf) and os.access(self.conf, os.R_OK):
-            _conf = open(self.conf, 'r').readlines()
-            # Read the lines, match self.log only if there is no preceding comment
-            _match = "^(?!\#)CustomLog.*%s.*" % self.log
-            _match = re.compile(_match)
-            for _line in _conf:
-                if re.match(_match, _line):
-                    # Get the match and store it in a global variable
-                    _line = _line.split(' ')[-1]
-                    self.logtype = _line
-                    return
-
-            raise ConfigError("Unable to find log; Format must follow CustomLog variable \
-                              in config i.e. logs/access_log")
-        # Raise an exception if we can't open the file
-        else:
-            raise ConfigError("Error opening config file; check permissions and path")
+        Find the CustomLog for our log in the config, and with it the log format
+        type we are using, its LogFormat nickname
+        """
+        try:
+            self.confindex = ConfIndex.load(self.conf, self.confcache)
+        except ConfIndexError as err:
+            raise ConfigError(str(err))
+        self.logentry = self.confindex.findlog(self.log)
+        if self.logentry is None:
+            raise ConfigError("Unable to find log; Format must follow CustomLog variable "
+                              "in config i.e. logs/access_log")
+        # An inline format has no nickname
+        self.logtype = self.logentry["nickname"] or "%s (inline)" % self.logentry["target"]
 
     ##################
     # GET LOG FORMAT #
@@ -214,39 +684,9 @@ class HTTPLog():
         """
         Using the logtype variable that we extracted
         """
-        if os.path.exists(self.conf) and os.access(self.conf, os.R_OK):
-            _conf = open(self.conf, 'r').readlines()
-            # Find the log format
-            _match = "^(?!\#)LogFormat.*%s$" % self.logtype
-            _match = re.compile(_match)
-            for _line in _conf:
-                if re.match(_match, _line):
-                    # Once we get the line we need to take the format only
-                    # We use _incontent to signify if we are within the format string, if we hit the opening "
-                    # then we flag this as True if we hit the end " then we flag it as false
-                    _incontent = False
-                    _formatstring = ""
-                    for _idx, _char in enumerate(_line):
-                        if _idx != 0 and _char == '"' and _line[_idx - 1] != "\\":
-                            # If we hit the closing quote, set _incontent to false
-                            if _incontent:
-                                _incontent = False
-                                continue
-                            # If we hit the opening quote, set _incontent to true
-                            _incontent = True
-                            continue
-                        # If we are within the format string, append the character to _formatstring
-                        if _incontent:
-                            _formatstring += _char
-
-                    if _formatstring:
-                        self.logformat = _formatstring
-                        return
-                    else:
-                        raise ConfigError("Verify LogFormat for %s exists in conf file" % self.logtype)
-        # Raise an exception if we can't open the file
-        else:
-            raise ConfigError("Error opening config file; check permissions and path")
+        if not self.logentry["format"]:
+            raise ConfigError("Verify LogFormat for %s exists in conf file" % self.logtype)
+        self.logformat = self.logentry["format"]
 
 
 ########
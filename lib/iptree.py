@@ -0,0 +1,313 @@
+#!/bin/env python
+#
+#   iptree.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   IP address matching for host signatures and the allow
+#   list. Addresses and CIDR prefixes, IPv4 or IPv6, are
+#   parsed to integers and held in a radix tree, so looking
+#   up a host costs the same for ten prefixes as it does
+#   for the tens of thousands in a cloud provider's ranges.
+#
+############################
+if not "socket" in vars():
+    import socket
+
+if not "binascii" in vars():
+    import binascii
+
+if "Matcher" not in vars():
+    from lib.matcher import Matcher
+
+
+class IPTreeError(Exception):
+    pass
+
+
+# The bits in an address of each IP version
+BITS = {4: 32, 6: 128}
+
+
+###########
+# PARSEIP #
+###########
+def parseip(value):
+    """
+    Return (version, integer) for an IPv4 or IPv6 address, None if value isn't
+    one. An IPv4 address written as IPv6 is taken as the IPv4 address.
+    """
+    _parts = value.split(".")
+    if len(_parts) == 4 and ":" not in value:
+        _ip = 0
+        for _part in _parts:
+            if not _part.isdigit() or len(_part) > 3:
+                return None
+            _octet = int(_part)
+            if _octet > 255:
+                return None
+            _ip = _ip << 8 | _octet
+        return 4, _ip
+    if ":" not in value:
+        return None
+    # A zone, i.e. fe80::1%eth0, doesn't change which prefixes hold the address
+    _address = value.strip("[]").split("%", 1)[0]
+    try:
+        _ip = int(binascii.hexlify(socket.inet_pton(socket.AF_INET6, _address)), 16)
+    except (socket.error, ValueError, TypeError):
+        return None
+    if _ip >> 32 == 0xffff:
+        return 4, _ip & 0xffffffff
+    return 6, _ip
+
+
+############
+# FORMATIP #
+############
+def formatip(version, ip):
+    """
+    Return the text of an address as parseip returns it, a dotted quad for IPv4,
+    including IPv4 written as IPv6, and the shortest form for IPv6
+    """
+    if version == 4:
+        return "%d.%d.%d.%d" % (ip >> 24, ip >> 16 & 255, ip >> 8 & 255, ip & 255)
+    return socket.inet_ntop(socket.AF_INET6, binascii.unhexlify("%032x" % ip))
+
+
+def parseprefix(value):
+    """
+    Return (version, network, length) for an address or CIDR prefix, i.e. "10.0.0.0/8"
+    or "2001:db8::/32", None if value isn't one. Bits past the prefix length are dropped.
+    """
+    _address, _sep, _length = value.strip().partition("/")
+    _ip = parseip(_address)
+    if _ip is None:
+        return None
+    _version, _network = _ip
+    _bits = BITS[_version]
+    if not _sep:
+        return _version, _network, _bits
+    if not _length.isdigit():
+        return None
+    _length = int(_length)
+    if ":" in _address and _version == 4:
+        # A mapped prefix counts its length over the whole IPv6 address
+        _length -= 96
+    if not 0 <= _length <= _bits:
+        return None
+    return _version, _network >> (_bits - _length) << (_bits - _length), _length
+
+
+class IPTree():
+    """
+    @Summary    A radix tree of IPv4 and IPv6 prefixes, looking up which prefix holds an address.
+
+    @Guide      Each level of the tree takes the next STRIDE bits of the address, 8 bits so a byte,
+                a node is a dictionary of those bits to either the node below or, where a prefix
+                covers everything from there down, the value of that prefix. A prefix whose length
+                isn't a whole number of strides is put in every slot it covers on its last level.
+                A lookup is then at most 4 dictionary lookups for IPv4 and 16 for IPv6, however many
+                prefixes there are.
+                    Where prefixes overlap the shorter one is kept, it holds every address the
+                longer ones do, so lookup returns the value of a prefix holding the address, not
+                necessarily the longest one. The nodes are plain dictionaries and ints so the whole
+                tree can be saved with marshal, see plan and loadplan.
+
+    @Example    tree = IPTree()
+                tree.add("10.0.0.0/8", 0)
+                tree.add("2001:db8::/32", 1)
+                tree.lookup(4, parseip("10.1.2.3")[1]) -> 0
+    """
+    STRIDE = 8
+
+    ########
+    # INIT #
+    ########
+    def __init__(self):
+        self.roots = {4: {}, 6: {}}
+        self.everything = {4: None, 6: None}  # The value of a /0, covering every address
+        self.size = 0
+
+    #######
+    # ADD #
+    #######
+    def add(self, prefix, value):
+        """
+        Add an address or CIDR prefix with its value, an int
+        """
+        _parsed = parseprefix(prefix)
+        if _parsed is None:
+            raise IPTreeError("'%s' is not an IP address or CIDR prefix" % prefix)
+        self.insert(_parsed[0], _parsed[1], _parsed[2], value)
+
+    def insert(self, version, network, length, value):
+        self.size += 1
+        if self.everything[version] is not None:
+            return
+        if length == 0:
+            self.everything[version] = value
+            self.roots[version] = {}
+            return
+        _bits = BITS[version]
+        _stride = self.STRIDE
+        _mask = (1 << _stride) - 1
+        _node = self.roots[version]
+        _depth = 0
+        while length - _depth > _stride:
+            _key = network >> (_bits - _depth - _stride) & _mask
+            _child = _node.get(_key)
+            if _child is None:
+                _child = _node[_key] = {}
+            elif _child.__class__ is not dict:
+                # A shorter prefix already holds all of this one
+                return
+            _node = _child
+            _depth += _stride
+        # The last level, fill every slot the remaining bits cover
+        _span = 1 << (_stride - (length - _depth))
+        _first = network >> (_bits - _depth - _stride) & _mask & ~(_span - 1)
+        for _key in xrange(_first, _first + _span):
+            if _node.get(_key).__class__ is not int:
+                _node[_key] = value
+
+    ##########
+    # LOOKUP #
+    ##########
+    def lookup(self, version, address):
+        """
+        Return the value of a prefix holding the integer address, or None
+        """
+        _value = self.everything[version]
+        if _value is not None:
+            return _value
+        _stride = self.STRIDE
+        _mask = (1 << _stride) - 1
+        _node = self.roots[version]
+        _shift = BITS[version] - _stride
+        while _shift >= 0:
+            _node = _node.get(address >> _shift & _mask)
+            if _node is None:
+                return None
+            if _node.__class__ is not dict:
+                return _node
+            _shift -= _stride
+        return None
+
+    def __contains__(self, value):
+        _ip = parseip(value)
+        return _ip is not None and self.lookup(*_ip) is not None
+
+    ########
+    # PLAN #
+    ########
+    def plan(self):
+        """
+        Return the tree as plain data for marshal
+        """
+        return {"roots": self.roots, "everything": self.everything, "size": self.size}
+
+    def loadplan(self, plan):
+        self.roots = plan["roots"]
+        self.everything = plan["everything"]
+        self.size = plan["size"]
+
+
+class CIDRMatcher():
+    """
+    @Summary    The Matcher for host signatures, addresses and CIDR prefixes are looked up in an
+                IPTree and anything else is taken as a regex.
+
+    @Guide      It has the same match, matchall and signatures as a Matcher, so the Filter can use
+                either. The host of a record is parsed to an integer once and looked up in the tree,
+                the signatures that aren't addresses, i.e. "^192\.168\.", are matched as regexes
+                with a Matcher of their own. A strict CIDRMatcher, for the allow list, only takes
+                addresses and prefixes.
+                    matchall only gives the one prefix the tree holds for an address, see IPTree,
+                plus every regex matching it.
+
+    @Parameters
+                signatures="list of addresses, CIDR prefixes or regexes"
+                plan="a plan from CIDRMatcher.plan, to skip building the tree"
+                strict="True to only allow addresses and prefixes"
+
+    @Example    matcher = CIDRMatcher(["10.0.0.0/8", "2001:db8::/32", "^192\.168\."])
+                matcher.match("10.1.2.3") -> 0
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, signatures, plan=None, strict=False):
+        self.signatures = list(signatures)
+        self.strict = strict
+        self.tree = IPTree()
+        self.others = []  # The indexes of the signatures that are regexes
+        self.regexes = None  # A Matcher for those signatures
+        if plan is None:
+            self.compile()
+        else:
+            self.loadplan(plan)
+
+    def compile(self):
+        for _sigidx, _signature in enumerate(self.signatures):
+            _prefix = parseprefix(_signature)
+            if _prefix is not None:
+                self.tree.insert(_prefix[0], _prefix[1], _prefix[2], _sigidx)
+            elif self.strict:
+                raise IPTreeError("'%s' is not an IP address or CIDR prefix" % _signature)
+            else:
+                self.others.append(_sigidx)
+        if self.others:
+            self.regexes = Matcher([self.signatures[_sigidx] for _sigidx in self.others])
+
+    ########
+    # PLAN #
+    ########
+    def plan(self):
+        return {"tree": self.tree.plan(), "others": self.others,
+                "regexes": self.regexes.plan() if self.regexes is not None else None}
+
+    def loadplan(self, plan):
+        self.tree.loadplan(plan["tree"])
+        self.others = plan["others"]
+        if self.others:
+            self.regexes = Matcher([self.signatures[_sigidx] for _sigidx in self.others], plan=plan["regexes"])
+
+    #########
+    # MATCH #
+    #########
+    def match(self, value):
+        """
+        Return the index of a signature matching value, or None if nothing matches
+        """
+        _ip = parseip(value)
+        if _ip is not None:
+            _sigidx = self.tree.lookup(_ip[0], _ip[1])
+            if _sigidx is not None:
+                return _sigidx
+        if self.regexes is not None:
+            _sigidx = self.regexes.match(value)
+            if _sigidx is not None:
+                return self.others[_sigidx]
+        return None
+
+    ############
+    # MATCHALL #
+    ############
+    def matchall(self, value):
+        _sigidxs = []
+        _ip = parseip(value)
+        if _ip is not None:
+            _sigidx = self.tree.lookup(_ip[0], _ip[1])
+            if _sigidx is not None:
+                _sigidxs.append(_sigidx)
+        if self.regexes is not None:
+            _sigidxs.extend(self.others[_sigidx] for _sigidx in self.regexes.matchall(value))
+        return sorted(_sigidxs)
+
+    def __len__(self):
+        return len(self.signatures)
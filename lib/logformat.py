@@ -0,0 +1,381 @@
+#!/bin/env python
+#
+#   logformat.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The LogFormat class tokenizes an apache LogFormat
+#   string, i.e. %h %l %u %t \"%r\" %>s %b, and compiles
+#   it into an anchored regex with a group for each field.
+#   Every field regex stops at the character that follows
+#   it in the format, or is a fixed shape such as digits,
+#   so the regex never backtracks more than a character at
+#   a time and a hostile line costs about the same as any
+#   other line of its length.
+#
+############################
+if not "re" in vars():
+    import re
+
+if not "time" in vars():
+    import time
+
+
+class LogFormatError(Exception):
+    pass
+
+
+# Field regexes for directives with a fixed shape, anything else runs up to the
+# character that follows it
+NUMBER = r"\d+|-"
+STATUS = r"\d{3}|-"
+CLF_TIME = r"\d{1,2}/[A-Za-z]{3}/\d{1,4}:\d{1,2}:\d{1,2}:\d{1,2} [+\-]\d{4}"
+# Inside quotes apache escapes " and \ with a backslash, this is the unrolled form
+# of (?:[^"\\]|\\.)* so it matches in a single pass
+QUOTED = r'[^"\\]*(?:\\.[^"\\]*)*'
+
+# The directives of mod_log_config; letter -> (field name, field regex or None)
+DIRECTIVES = {
+    "a": ("remoteip", None),  # Client IP, %{c}a is the peer IP of the connection
+    "A": ("localip", None),  # Local IP
+    "B": ("size", NUMBER),  # Size of response in bytes, excluding headers
+    "b": ("size", NUMBER),  # The same in CLF format, - rather than 0
+    "C": ("cookie", None),  # %{Foobar}C, the contents of cookie Foobar
+    "D": ("duration", NUMBER),  # Time taken to serve the request, in microseconds
+    "e": ("env", None),  # %{FOOBAR}e, an environment variable
+    "f": ("filename", None),  # Filename
+    "h": ("host", None),  # Remote hostname, %{c}h is the underlying connection
+    "H": ("protocol", None),  # Request protocol
+    "i": ("header", None),  # %{Foobar}i, a request header
+    "k": ("keepalives", NUMBER),  # Keepalive requests handled on this connection
+    "l": ("remotelog", None),  # Remote logname from identd, usually -
+    "L": ("logid", None),  # Request log ID from the error log
+    "m": ("method", None),  # Request method
+    "n": ("note", None),  # %{Foobar}n, a note from another module
+    "o": ("response", None),  # %{Foobar}o, a response header
+    "p": ("port", NUMBER),  # Canonical port of the server, or %{local}p and %{remote}p
+    "P": ("pid", NUMBER),  # Process ID of the child, or %{tid}P and %{hextid}P
+    "q": ("query", None),  # Query string, starting with ?
+    "r": ("request", None),  # First line of request
+    "R": ("handler", None),  # Handler generating the response
+    "s": ("status", STATUS),  # Status, %>s is the final status
+    "t": ("time", None),  # Time the request was received, %{format}t for strftime formats
+    "T": ("seconds", NUMBER),  # Time taken to serve the request, %{ms}T and %{us}T for other units
+    "u": ("user", None),  # Remote user from auth
+    "U": ("path", None),  # URL path requested, without the query string
+    "v": ("vhost", None),  # Canonical ServerName of the virtual host
+    "V": ("servername", None),  # Server name according to UseCanonicalName
+    "X": ("connstatus", None),  # Connection status when the response completed, X, + or -
+    "I": ("bytesin", NUMBER),  # Bytes received, from mod_logio
+    "O": ("bytesout", NUMBER),  # Bytes sent, from mod_logio
+    "S": ("bytestransferred", NUMBER),  # Bytes transferred, from mod_logio
+    "^ti": ("trailerin", None),  # %{Foobar}^ti, a request trailer line
+    "^to": ("trailerout", None),  # %{Foobar}^to, a response trailer line
+}
+
+# Request headers that already had field names of their own
+HEADERS = {"user-agent": "agent", "referer": "referrer"}
+
+# strftime conversions for %{format}t, anything not here matches up to the next character
+STRFTIME = {
+    "a": "[A-Za-z]{3}", "A": "[A-Za-z]+", "b": "[A-Za-z]{3}", "B": "[A-Za-z]+", "h": "[A-Za-z]{3}",
+    "d": r"\d{2}", "e": r"[ \d]\d", "H": r"\d{2}", "I": r"\d{2}", "j": r"\d{3}", "m": r"\d{2}",
+    "M": r"\d{2}", "p": "[AP]M", "S": r"\d{2}", "y": r"\d{2}", "Y": r"\d{4}", "z": r"[+\-]\d{4}",
+    "Z": "[A-Za-z]+", "s": r"\d+", "u": r"\d", "w": r"\d", "C": r"\d{2}", "G": r"\d{4}", "g": r"\d{2}",
+    "D": r"\d{2}/\d{2}/\d{2}", "F": r"\d{4}-\d{2}-\d{2}", "T": r"\d{2}:\d{2}:\d{2}", "R": r"\d{2}:\d{2}",
+    "%": "%", "n": r"\n", "t": r"\t",
+}
+
+# The tokenizer; a %% escape or a directive with its conditions, < or > and {argument}
+_directive = re.compile(r"%(%|!?[0-9,]*[<>]?(?:\{([^}]*)\})?[<>]?(\^t[io]|[a-zA-Z]))")
+# The backslash escapes apache understands in a format string
+_escapes = {"n": "\n", "t": "\t", '"': '"', "\\": "\\"}
+
+
+class LogFormat():
+    """
+    @Summary    An apache LogFormat string compiled into an anchored regex, with a field name
+                for each directive.
+
+    @Guide      Every mod_log_config directive is understood, the fields are named after what
+                they hold, i.e. host for %h, remoteip for %a, vhost for %v, duration for %D and
+                seconds for %T. A request header %{X-Forwarded-For}i is named after the header
+                in lower case, x-forwarded-for, apart from User-Agent and Referer which are
+                agent and referrer. Other %{name} directives are the field name and the name,
+                i.e. env:HTTPS for %{HTTPS}e. If a field appears twice only the first is kept.
+                    Each field only matches up to the character after it in the format, or a
+                fixed shape such as the digits of a status, and quoted fields understand apache's
+                \\" escapes. So there is only ever one way for a line to match, and worstcase can
+                be used to measure the slowest lines for a format. Directives that run together
+                with nothing between them, i.e. %h%l, could split a value either way and are
+                refused with a LogFormatError, only a %t has brackets to split on.
+
+    @Parameters
+                formatstring="the LogFormat string, as it is in httpd.conf between the quotes"
+                    i.e. '%h %l %u %t \\"%r\\" %>s %b'
+
+    @Example    logformat = LogFormat('%h %l %u %t \\"%r\\" %>s %b')
+                logformat.schema -> {"host": 0, "remotelog": 1, ...}
+                logformat.compile(["host", "request"]).match(line).groups()
+    """
+    # An empty group that never matches, it stands in for the group of a field that isn't needed
+    SKIP = "(?:(?!)())?"
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, formatstring):
+        self.formatstring = formatstring
+        self.tokens = self.tokenize(formatstring)
+        self.fields = []  # Field name of each group, in order
+        self.schema = {}  # Field name -> group index
+        # True when there is a plain %t, the [13/Dec/2013:10:00:00 +0000] time a log is seeked by
+        self.clftime = False
+        for _token in self.tokens:
+            if _token[0] == "field" and _token[2] == CLF_TIME:
+                self.clftime = True
+            if _token[0] == "field" and _token[1] is not None:
+                self.schema[_token[1]] = len(self.fields)
+                self.fields.append(_token[1])
+
+    ############
+    # TOKENIZE #
+    ############
+    def tokenize(self, formatstring):
+        """
+        Split the format string into a list of tokens, ("literal", text) for the
+        text between directives and ("field", name, regex, wrap) for each directive,
+        regex is None for a field that runs up to the next character and wrap is
+        anything around its group, i.e. the brackets of %t. The name is None for a
+        repeat of a field we already have.
+        """
+        _tokens = []
+        _seen = set()
+        _pos = 0
+        _previous = 0
+        _literal = ""
+        while _pos < len(formatstring):
+            _char = formatstring[_pos]
+            if _char == "\\" and _pos + 1 < len(formatstring):
+                _literal += _escapes.get(formatstring[_pos + 1], formatstring[_pos:_pos + 2])
+                _pos += 2
+                continue
+            if _char != "%":
+                _literal += _char
+                _pos += 1
+                continue
+            _match = _directive.match(formatstring, _pos)
+            if not _match:
+                raise LogFormatError("Invalid LogFormat directive at '%s'" % formatstring[_pos:])
+            _pos = _match.end()
+            if _match.group(1) == "%":
+                _literal += "%"
+                continue
+            _wrap = "%s"
+            if _match.group(3) == "t" and _match.group(2) is None:
+                _wrap = r"\[%s\]"
+            if not _literal and _tokens and _tokens[-1][0] == "field" and _tokens[-1][3] == _wrap == "%s":
+                # Two directives together, i.e. %h%l, have more than one way to split a value
+                # between them and a line that doesn't match tries every one of them
+                raise LogFormatError("Directives '%s' run together with nothing between them to split on"
+                                     % formatstring[_previous:_pos])
+            _previous = _match.start()
+            if _literal:
+                _tokens.append(("literal", _literal))
+                _literal = ""
+            _name, _regex = self.directive(_match.group(3), _match.group(2))
+            if _name in _seen:
+                _name = None
+            _seen.add(_name)
+            _tokens.append(("field", _name, _regex, _wrap))
+        if _literal:
+            _tokens.append(("literal", _literal))
+        return _tokens
+
+    def directive(self, letter, argument):
+        """
+        Return the (field name, field regex or None) of a directive
+        """
+        if letter not in DIRECTIVES:
+            raise LogFormatError("Unknown LogFormat directive %%%s" % letter)
+        _name, _regex = DIRECTIVES[letter]
+        if letter == "t":
+            if argument is None:
+                return _name, CLF_TIME
+            return _name, self.strftime(argument)
+        if argument is None:
+            return _name, _regex
+        if letter == "i":
+            _header = argument.lower()
+            return HEADERS.get(_header, _header), _regex
+        if letter in "ah" and argument == "c":
+            return {"a": "peerip", "h": "peerhost"}[letter], _regex
+        if letter == "T":
+            return {"s": "seconds", "ms": "milliseconds", "us": "duration"}.get(argument, _name), _regex
+        if letter == "p":
+            return {"canonical": "port", "local": "localport", "remote": "remoteport"}.get(argument, _name), _regex
+        if letter == "P":
+            if argument == "hextid":
+                return "tid", r"[0-9a-fA-F]+|-"
+            return {"pid": "pid", "tid": "tid"}.get(argument, _name), _regex
+        return "%s:%s" % (_name, argument), _regex
+
+    def strftime(self, argument):
+        """
+        Return a regex for the time of a %{format}t directive
+        """
+        for _prefix in ("begin:", "end:"):
+            if argument.startswith(_prefix):
+                argument = argument[len(_prefix):]
+        if argument in ("sec", "msec", "usec", "msec_frac", "usec_frac"):
+            return r"\d+"
+        _regex = ""
+        _pos = 0
+        while _pos < len(argument):
+            if argument[_pos] == "%" and _pos + 1 < len(argument) and argument[_pos + 1] in STRFTIME:
+                _regex += STRFTIME[argument[_pos + 1]]
+                _pos += 2
+            elif argument[_pos] == "%":
+                # An unknown conversion, anything but a space
+                _regex += r"\S+"
+                _pos += 2
+            else:
+                _regex += re.escape(argument[_pos])
+                _pos += 1
+        return _regex
+
+    ###########
+    # PATTERN #
+    ###########
+    def pattern(self, fields=None):
+        """
+        Return the regex string for the format, with a group for every field, or
+        only for those in fields; the other fields keep their place in the groups
+        with an empty group that never matches, so they come back as None.
+        """
+        # Multiline so ^ also anchors a search from the start of any line, i.e. in a memory map
+        _parts = ["(?m)^"]
+        for _idx, _token in enumerate(self.tokens):
+            if _token[0] == "literal":
+                _parts.append(re.escape(_token[1]))
+                continue
+            _name, _regex, _wrap = _token[1:]
+            _before = self.tokens[_idx - 1] if _idx else None
+            _after = self.tokens[_idx + 1] if _idx + 1 < len(self.tokens) else None
+            if _regex is None:
+                if (_before and _before[0] == "literal" and _before[1].endswith('"')
+                        and _after and _after[0] == "literal" and _after[1].startswith('"')):
+                    _regex = QUOTED
+                elif _after and _after[0] == "literal":
+                    # Up to the next character of the format, which the value can't contain
+                    _regex = "[^%s]*" % re.escape(_after[1][0])
+                elif _after:
+                    # Up to the bracket of a %t right after it, i.e. %h%t
+                    _regex = r"\S*"
+                else:
+                    _regex = r"[^\r\n]*"
+            if _name is None:
+                _group = "(?:%s)" % _regex
+            elif fields is not None and _name not in fields:
+                # Not needed, so the field isn't captured
+                _group = "(?:%s)%s" % (_regex, self.SKIP)
+            else:
+                _group = "(%s)" % _regex
+            _parts.append(_wrap % _group)
+        _parts.append(r"\r?$")
+        return "".join(_parts)
+
+    ###########
+    # COMPILE #
+    ###########
+    def compile(self, fields=None):
+        """
+        Return the compiled regex for the format, see pattern
+        """
+        try:
+            return re.compile(self.pattern(fields))
+        except (re.error, AssertionError, OverflowError) as err:
+            raise LogFormatError("Unable to compile LogFormat '%s'; %s" % (self.formatstring, err))
+
+    #############
+    # WORSTCASE #
+    #############
+    def hostile(self, length=4096):
+        """
+        Return a list of (description, line) of lines built to be slow to match;
+        long fields, long runs of the characters the format splits on, and near
+        misses that only fail at the very end
+        """
+        _lines = []
+        # A valid value for each token
+        _valid = []
+        for _token in self.tokens:
+            if _token[0] == "literal":
+                _valid.append(_token[1])
+            elif _token[2] == CLF_TIME:
+                _valid.append("[13/Dec/2013:10:00:00 +0000]")
+            elif _token[2] == STATUS:
+                _valid.append("200")
+            elif _token[2] == NUMBER:
+                _valid.append("1")
+            elif _token[1] in ("host", "remoteip", "localip", "peerip", "peerhost"):
+                _valid.append("10.0.0.1")
+            else:
+                _valid.append("a")
+        _line = "".join(_valid)
+        # Runs of the characters the format splits on, alone and between words, which
+        # is what makes a field regex such as .+\w backtrack
+        _separators = sorted(set("".join(_token[1] for _token in self.tokens if _token[0] == "literal")))
+        _runs = [(_text * (length // len(_text) + 1))[:length]
+                 for _text in _separators + ["a" + _char for _char in _separators] + ["\\", '\\"', "a"]]
+        for _idx, _token in enumerate(self.tokens):
+            if _token[0] != "field":
+                continue
+            for _run in [_valid[_idx] * (length // len(_valid[_idx]))] + _runs:
+                _lines.append(("%s filled with %r" % (_token[1] or "field", _run[:4]),
+                               "".join(_valid[:_idx] + [_run] + _valid[_idx + 1:])))
+        for _idx in range(len(self.tokens) - 1):
+            if self.tokens[_idx][0] == "field" and self.tokens[_idx + 1][0] == "field":
+                # Directives together, one run across both of them then junk, so every way of
+                # splitting the run between them is tried before the line fails
+                for _run in _runs:
+                    _lines.append(("%s and %s filled with %r then junk" % (self.tokens[_idx][1] or "field",
+                                   self.tokens[_idx + 1][1] or "field", _run[:4]),
+                                   "".join(_valid[:_idx] + [_run, " x"])))
+        for _run in _runs:
+            _lines.append(("only %r" % _run[:4], _run))
+            _lines.append(("%r then junk" % _run[:4], _run + " x"))
+            _lines.append(("%r then a valid line" % _run[:4], _run + _line))
+        for _idx in range(1, len(_valid)):
+            # A valid line cut short before each token, then a long tail that can't match
+            _cut = "".join(_valid[:_idx])
+            for _run in _runs + ["\x00" * length]:
+                _lines.append(("cut at %s then %r" % (len(_cut), _run[:4]), _cut + _run))
+        _lines.append(("valid", _line))
+        _lines.append(("valid with junk after it", _line + " x" * length))
+        return _lines
+
+    def worstcase(self, length=4096, regex=None, repeat=3):
+        """
+        Time regex, by default our own, over the hostile lines, returning a dictionary
+        with the number of lines, the total seconds, and the slowest line's description
+        and seconds per match
+        """
+        _search = (regex or self.compile()).search
+        _total = 0.0
+        _worst = (0.0, None)
+        _lines = self.hostile(length)
+        for _description, _line in _lines:
+            _start = time.time()
+            for _idx in range(repeat):
+                _search(_line)
+            _seconds = (time.time() - _start) / repeat
+            _total += _seconds
+            if _seconds > _worst[0]:
+                _worst = (_seconds, _description)
+        return {"lines": len(_lines), "length": length, "seconds": _total, "worst": _worst[1],
+                "worstseconds": _worst[0]}
@@ -0,0 +1,254 @@
+#!/bin/env python
+#
+#   matcher.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The Matcher class takes a list of signature regexes
+#   for a single log field and compiles them into as few
+#   alternations as possible, so a field value is checked
+#   against every signature in one pass rather than one
+#   regex call per signature.
+#
+############################
+if not "re" in vars():
+    import re
+
+if not "sre_compile" in vars():
+    import sre_compile
+    import sre_parse
+    import _sre
+
+
+class MatchError(Exception):
+    pass
+
+
+##############
+# SREPROGRAM #
+##############
+def sreprogram(pattern):
+    """
+    Return the program the re module compiles pattern into as plain data, so it can
+    be saved and turned back into a pattern by sreload without parsing it again.
+    This is tied to the python version that made it, None if it can't be made here.
+    """
+    try:
+        _parsed = sre_parse.parse(pattern, 0)
+        return (_parsed.pattern.flags, sre_compile._code(_parsed, 0), _parsed.pattern.groups,
+                dict(_parsed.pattern.groupdict))
+    except (AttributeError, TypeError):
+        return None
+
+
+def sreload(pattern, program):
+    """
+    Return the compiled pattern for a program from sreprogram, falling back on
+    compiling the pattern if the program can't be used
+    """
+    if program is not None:
+        try:
+            _flags, _code, _groups, _groupindex = program
+            _indexgroup = [None] * _groups
+            for _name, _idx in _groupindex.items():
+                _indexgroup[_idx] = _name
+            return _sre.compile(pattern, _flags, _code, _groups - 1, _groupindex, _indexgroup)
+        except (AttributeError, TypeError, ValueError, RuntimeError):
+            pass
+    return re.compile(pattern)
+
+
+class Matcher():
+    """
+    @Summary    Compiles a list of signatures into combined alternations, each signature is
+                wrapped in its own capturing group so a match tells us which signature hit.
+
+    @Guide      Python's re module only supports 100 groups per pattern, so the signatures are
+                split into chunks that stay under this. Signatures that can't safely share an
+                alternation, i.e. inline flags such as (?i) which apply to the whole pattern,
+                backreferences or named groups, are kept as standalone regexes.
+                    Most signatures are anchored literals such as ^Siege, these are bucketed on
+                the first two characters of the literal, so a value only runs against the
+                buckets for its own first characters plus the signatures that can't be bucketed.
+                Adding more bot signatures then barely changes the cost of a non matching value.
+
+    @Parameters
+                signatures="list of regex strings" i.e. ["^Siege", "^Arachni"]
+                plan="optional, the plan() of an earlier Matcher with the same signatures",
+                only the combined alternations are then compiled, each signature is compiled
+                on its own the first time matchall needs it
+
+    @Example    matcher = Matcher(["^Siege", "^Arachni"])
+                matcher.match("Siege 2.70") -> 0
+                Matcher(["^Siege", "^Arachni"], plan=matcher.plan())
+    """
+    # Maximum number of groups we allow in a single combined pattern
+    MAXGROUPS = 99
+    # Anything that changes the meaning of a pattern once it shares an alternation
+    _standalone = re.compile(r"\(\?[iLmsux]+\)|\\[1-9]|\(\?P[<=]")
+    # Characters that end the literal prefix of a signature
+    _special = ".^$*+?{}[]\\|()"
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, signatures, plan=None):
+        self.signatures = list(signatures)
+        self.regexes = []  # Each signature compiled on its own, used by matchall
+        self.buckets = {}  # Literal prefix -> list of (compiled alternation, {group index: signature index})
+        self.generic = []  # Alternations for signatures without a usable literal prefix
+        if plan is None:
+            self.compile()
+        else:
+            self.loadplan(plan)
+
+    #################
+    # LITERALPREFIX #
+    #################
+    def literalprefix(self, signature):
+        """
+        Return the literal text a signature is anchored on, i.e. Siege for ^Siege.*,
+        or an empty string if it could match anywhere
+        """
+        if not signature.startswith("^") or "|" in signature:
+            return ""
+        _prefix = ""
+        for _char in signature[1:]:
+            if _char in self._special:
+                # A quantifier makes the character before it optional
+                if _char in "*?{" and _prefix:
+                    _prefix = _prefix[:-1]
+                break
+            _prefix += _char
+        return _prefix
+
+    ###########
+    # COMPILE #
+    ###########
+    def compile(self):
+        """
+        Validate every signature, bucket it and build the combined alternations
+        """
+        _groups = {}
+        for _sigidx, _signature in enumerate(self.signatures):
+            try:
+                _regex = re.compile(_signature)
+            except (re.error, OverflowError) as err:
+                raise MatchError("Invalid signature '%s'; %s" % (_signature, err))
+            self.regexes.append(_regex)
+            # Bucket on at most the first two characters, see match
+            _groups.setdefault(self.literalprefix(_signature)[:2], []).append(_sigidx)
+
+        for _prefix, _sigidxs in _groups.items():
+            if _prefix:
+                self.buckets[_prefix] = self.combine(_sigidxs)
+            else:
+                self.generic = self.combine(_sigidxs)
+
+    def combine(self, sigidxs):
+        """
+        Combine the given signatures into a list of (compiled alternation, group map)
+        """
+        _combined = []
+        _chunk = []
+        _groupmap = {}
+        _groups = 0
+        for _sigidx in sigidxs:
+            _signature = self.signatures[_sigidx]
+            _regex = self.regexes[_sigidx]
+
+            if self._standalone.search(_signature) or _regex.groups + 1 > self.MAXGROUPS:
+                # A standalone regex has no wrapping group, map lastindex None to it as well
+                # as each of its own groups
+                _standalone = dict((_idx, _sigidx) for _idx in range(_regex.groups + 1))
+                _standalone[None] = _sigidx
+                _combined.append((_regex, _standalone))
+                continue
+
+            # Start a new chunk if this signature would take us over the group limit
+            if _groups + _regex.groups + 1 > self.MAXGROUPS:
+                _combined.append((re.compile("|".join(_chunk)), _groupmap))
+                _chunk, _groupmap, _groups = [], {}, 0
+            # The wrapping group is the outermost one, so it is always the lastindex
+            # reported for a match on this signature
+            _groupmap[_groups + 1] = _sigidx
+            _groups += _regex.groups + 1
+            _chunk.append("(%s)" % _signature)
+
+        if _chunk:
+            _combined.append((re.compile("|".join(_chunk)), _groupmap))
+        return _combined
+
+    ########
+    # PLAN #
+    ########
+    def plan(self):
+        """
+        Return the buckets and alternations as plain data, each alternation as its
+        pattern, its sre program and its group map, so they can be marshalled and
+        given back to a new Matcher without validating, bucketing or compiling every
+        signature again
+        """
+        def _plan(combined):
+            return [(_regex.pattern, sreprogram(_regex.pattern), _groupmap) for _regex, _groupmap in combined]
+        return {"buckets": dict((_prefix, _plan(_combined)) for _prefix, _combined in self.buckets.items()),
+                "generic": _plan(self.generic)}
+
+    def loadplan(self, plan):
+        def _load(combined):
+            return [(sreload(_pattern, _program), _groupmap) for _pattern, _program, _groupmap in combined]
+        try:
+            self.buckets = dict((_prefix, _load(_combined)) for _prefix, _combined in plan["buckets"].items())
+            self.generic = _load(plan["generic"])
+        except (re.error, KeyError, TypeError, ValueError) as err:
+            raise MatchError("Invalid matcher plan; %s" % err)
+        # Compiled on first use by getregexes
+        self.regexes = None
+
+    def getregexes(self):
+        """
+        Return each signature compiled on its own
+        """
+        if self.regexes is None:
+            self.regexes = [re.compile(_signature) for _signature in self.signatures]
+        return self.regexes
+
+    #########
+    # MATCH #
+    #########
+    def match(self, value):
+        """
+        Return the index of the first signature matching the start of value, or
+        None if nothing matches
+        """
+        _best = None
+        _buckets = self.buckets
+        for _combined in (_buckets.get(value[:2]), _buckets.get(value[:1]), self.generic):
+            if not _combined:
+                continue
+            for _regex, _groupmap in _combined:
+                _match = _regex.match(value)
+                if _match:
+                    _sigidx = _groupmap[_match.lastindex]
+                    if _best is None or _sigidx < _best:
+                        _best = _sigidx
+        return _best
+
+    ############
+    # MATCHALL #
+    ############
+    def matchall(self, value):
+        """
+        Return the indexes of all signatures matching value, the combined alternation
+        is used to reject the (common) non matching case in one pass
+        """
+        if self.match(value) is None:
+            return []
+        return [_sigidx for _sigidx, _regex in enumerate(self.getregexes()) if _regex.match(value)]
+
+    def __len__(self):
+        return len(self.signatures)
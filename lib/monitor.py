@@ -0,0 +1,243 @@
+#!/bin/env python
+#
+#   monitor.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The Monitor class follows many logs, i.e. the
+#   CustomLog of every vhost, in a single process. The
+#   signatures are loaded and compiled once for all of
+#   them, every log is tailed from one event loop and the
+#   offenders of all of them come out as one stream.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "time" in vars():
+    import time
+
+if not "glob" in vars():
+    import glob
+
+if not "hashlib" in vars():
+    import hashlib
+
+if "HTTPLog" not in vars():
+    from lib.httplog import HTTPLog, LogError, InitError, ConfigError
+
+if "Filter" not in vars():
+    from lib.filter import Filter, ConfErr, InitErr
+
+if "Follower" not in vars():
+    from lib.follow import Follower, Inotify, FollowError
+
+if "SignatureDB" not in vars():
+    from lib.sigdb import SignatureDB
+
+if "RateDetector" not in vars():
+    from lib.ratelimit import RateDetector, RateError
+
+if "ConfIndex" not in vars():
+    from lib.confindex import ConfIndex, ConfIndexError
+
+
+class MonitorError(Exception):
+    pass
+
+
+class Target():
+    """
+    A single followed log, with the HTTPLog, Filter and Follower for it
+    """
+    def __init__(self, conf, log, path, httplog, logfilter, follower):
+        self.conf = conf
+        self.log = log
+        self.path = path
+        self.httplog = httplog
+        self.filter = logfilter
+        self.follower = follower
+
+
+class Monitor():
+    """
+    @Summary    Follows many logs at once, yielding the new offenders of all of them.
+
+    @Guide      Add each log with addtarget, giving the apache config and log name its format is
+                found from and the path of the log, a glob adds every log it matches, or discover
+                adds every log an apache config writes. Each log has its own HTTPLog, Filter and
+                Follower, but the HTTPLogs share the index of each config and the Filters share one
+                SignatureDB, so the config and the signatures are only read once, and each Filter
+                keeps its own rate windows.
+                    run is a single loop; every Follower is started on one shared inotify, each
+                wake up polls every log for its new lines and runs them through its Filter, then
+                the loop waits on inotify again, or for interval seconds when inotify isn't
+                available. An offender is only yielded the first time it is seen in any of the logs.
+                With a checkpoint, each log keeps its offset in a checkpoint file of its own named
+                after it, so a restart carries on for every log where it left off.
+
+    @Parameters
+                sigconf="the signature python config file" i.e. "signatures_conf.py"
+                lists="optional list of extra signature files" i.e. ["bad_bots.txt"]
+                cachedir="where to cache the compiled signatures" i.e. "~/.cache/httpdefender"
+                cachesize="verdicts each Filter caches" i.e. 10000
+                req="the field to return for an offender" i.e. "host"
+                checkpoint="the prefix of the checkpoint files" i.e. "httpdefender.offset"
+                interval="seconds between polls, or the longest we wait on inotify" i.e. 1.0
+                backend="the HTTPLog backend" i.e. "chunked"
+                rate, rate4xx="(count, seconds) limits for a RateDetector on each log"
+                seen="a BloomFilter to remember the offenders in, rather than keeping them in matches"
+
+    @Example    monitor = Monitor("signatures_conf.py", req="host")
+                monitor.addtarget("/etc/httpd/conf/httpd.conf", "logs/access_log", "/var/log/httpd/*access_log")
+                for target, value in monitor.run(): ...
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, sigconf="signatures_conf.py", lists=None, cachedir=None, cachesize=10000, req="host",
+                 checkpoint=None, interval=1.0, backend="chunked", rate=None, rate4xx=None, seen=None):
+        self.sigconf = sigconf
+        self.sigdb = SignatureDB(sigconf, lists, cachedir)
+        self.cachesize = cachesize
+        self.req = req
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.backend = backend
+        self.rate = rate
+        self.rate4xx = rate4xx
+        self.targets = []
+        self.matches = []  # Every offender found, in the order they were found
+        self.seen = seen  # A BloomFilter to remember them in instead, not keeping them in matches
+        self.inotify = None
+        self.running = False
+
+    #############
+    # ADDTARGET #
+    #############
+    def addtarget(self, conf, log, path):
+        """
+        Add the log at path, or every log matching it if it is a glob, in the format
+        of log in the apache config conf. Returns the Targets added.
+        """
+        if glob.has_magic(path):
+            _paths = sorted(glob.glob(path))
+            if not _paths:
+                raise MonitorError("No logs match %s" % path)
+        else:
+            _paths = [path]
+        _added = []
+        _following = set(os.path.abspath(_target.path) for _target in self.targets)
+        for _path in _paths:
+            if os.path.abspath(_path) in _following:
+                continue
+            try:
+                _log = HTTPLog(conf=conf, log=log, fullpath=[_path], stream=True, backend=self.backend,
+                               confcache=self.sigdb.cachedir)
+                _filter = Filter(_log, self.sigconf, self.cachesize, sigdb=self.sigdb)
+                if self.rate or self.rate4xx:
+                    _filter.adddetector(RateDetector(_log.logschema, requests=self.rate, errors=self.rate4xx,
+                                                     clftime=_log.compiledformat.clftime))
+                _log.fields = _filter.fieldsused(self.req)
+                _log.parser()
+                _filter.compiled = _filter.compilesignatures()
+                # A log whose format has none of the signature fields would never flag anything
+                _filter.checkfields()
+                _follower = Follower(_log, checkpoint=self.checkpointfor(_path), interval=self.interval)
+            except (LogError, InitError, ConfigError, InitErr, ConfErr, RateError, FollowError, OSError) as err:
+                raise MonitorError("%s; %s" % (_path, err))
+            _target = Target(conf, log, _path, _log, _filter, _follower)
+            self.targets.append(_target)
+            _added.append(_target)
+        return _added
+
+    ############
+    # DISCOVER #
+    ############
+    def discover(self, conf):
+        """
+        Add the log of every CustomLog and TransferLog in the apache config conf, and
+        the files it includes, returning the Targets added. Piped logs and logs that
+        don't exist or can't be read are skipped.
+        """
+        try:
+            _index = ConfIndex.load(conf, self.sigdb.cachedir)
+        except ConfIndexError as err:
+            raise MonitorError(str(err))
+        _added = []
+        for _log in _index.logs:
+            _path = _log["path"]
+            if _path and os.path.isfile(_path) and os.access(_path, os.R_OK):
+                _added.extend(self.addtarget(conf, _log["target"], _path))
+        return _added
+
+    def checkpointfor(self, path):
+        """
+        Return the checkpoint file of the log at path, or None without checkpoints
+        """
+        if not self.checkpoint:
+            return None
+        return "%s-%s" % (self.checkpoint, hashlib.sha1(os.path.abspath(path)).hexdigest()[:12])
+
+    #######
+    # RUN #
+    #######
+    def run(self):
+        """
+        Generator; yield (Target, value) for every new offender in any of the logs,
+        forever or until stop is called
+        """
+        if not self.targets:
+            raise MonitorError("There are no logs to monitor")
+        try:
+            self.inotify = Inotify()
+        except FollowError:
+            self.inotify = None
+        _req = self.req
+        _seen = set(self.matches) if self.seen is None else self.seen
+        _keep = self.seen is None
+        self.running = True
+        try:
+            for _target in self.targets:
+                _target.follower.start(self.inotify)
+            while self.running:
+                for _target in self.targets:
+                    # The records are read and handed out one at a time, so if we are stopped
+                    # part way only those already filtered are covered by the checkpoint
+                    _filter = _target.filter
+                    # Each Filter only keeps the uniques of this batch, they are unique
+                    # across every log here
+                    _filter.matches = []
+                    # filterrecords reads every record polled, there is never one left over
+                    # that the checkpoint has moved past without it being filtered
+                    for _value in _filter.filterrecords(_target.follower.poll(), _req):
+                        if _value not in _seen:
+                            _seen.add(_value)
+                            if _keep:
+                                self.matches.append(_value)
+                            yield _target, _value
+                    _target.follower.savecheckpoint()
+                self.wait()
+        finally:
+            for _target in self.targets:
+                _target.follower.close()
+            if self.inotify:
+                self.inotify.close()
+                self.inotify = None
+
+    def wait(self):
+        """
+        Wait for any of the logs to change, or for interval seconds when polling
+        """
+        if self.inotify:
+            self.inotify.wait(self.interval)
+        else:
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,156 @@
+#!/bin/env python
+#
+#   parallel.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Splits a log into newline aligned byte ranges and
+#   runs a Filter over each range in its own worker
+#   process, compressed logs are a shard each. The
+#   unique results of each shard are then merged in
+#   log order, so the output is the same as running
+#   the Filter over the logs serially.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "multiprocessing" in vars():
+    import multiprocessing
+
+if "Filter" not in vars():
+    from lib.filter import Filter
+
+
+class ParallelError(Exception):
+    pass
+
+
+# The Filter of each worker process, set up once by initworker
+_worker = {}
+
+
+############
+# SHARDLOG #
+############
+def shardlog(path, shards, start=0, end=None):
+    """
+    Split the file at path, or the bytes of it from start to end, into at most
+    shards (start, end) byte ranges, each range starts on the line after a
+    newline, so no line is ever split between two shards.
+    """
+    _size = os.path.getsize(path) if end is None else end
+    if _size <= start:
+        return []
+    shards = max(1, min(shards, _size - start))
+    _bounds = [start]
+    _log = open(path, "rb")
+    try:
+        for _idx in range(1, shards):
+            _offset = max(start + (_size - start) * _idx // shards, _bounds[-1])
+            if _offset >= _size:
+                break
+            # Move to the start of the next line
+            _log.seek(_offset)
+            _log.readline()
+            _offset = _log.tell()
+            if _offset >= _size:
+                break
+            if _offset > _bounds[-1]:
+                _bounds.append(_offset)
+    finally:
+        _log.close()
+    _bounds.append(_size)
+    return zip(_bounds[:-1], _bounds[1:])
+
+
+##############
+# INITWORKER #
+##############
+def initworker(httplog, sigconf, cachesize, req, lists=None, cachedir=None):
+    """
+    Build the Filter for this worker process, the signatures are compiled on
+    the first shard and then reused for every shard after it, from the signature
+    cache when there is one
+    """
+    _worker["filter"] = Filter(httplog, sigconf, cachesize, lists=lists, cachedir=cachedir)
+    _worker["req"] = req
+
+
+###############
+# FILTERSHARD #
+###############
+def filtershard(shard):
+    """
+    Run the worker Filter over a single (path, start, end) shard, returning the
+    unique values it found in log order
+    """
+    _filter = _worker["filter"]
+    _path, _start, _end = shard
+    # Each shard has its own uniques, they are merged again by the parent
+    _filter.matches = []
+    return list(_filter.filterrecords(_filter.httplog.readlog(_path, _start, _end), _worker["req"]))
+
+
+##################
+# PARALLELFILTER #
+##################
+def parallelfilter(logfilter, req="host", jobs=None):
+    """
+    Run logfilter over its log using jobs worker processes, by default one per core.
+    The new matches are added to logfilter.matches, in the same order they would be
+    found by logfilter.runfilter.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    if jobs < 1:
+        raise ParallelError("The number of jobs must be at least 1")
+    if logfilter.detectors:
+        # A sliding window can't be split across shards
+        raise ParallelError("Detectors such as rate limits can't be run in parallel, use one job")
+    if logfilter.observers:
+        # Nor can the counts of a report, each worker would only count its own shards
+        raise ParallelError("Observers such as reports can't be run in parallel, use one job")
+    if logfilter.seen is not None:
+        # The matches of the shards are merged into logfilter.matches, which it doesn't keep
+        raise ParallelError("A probabilistic filter doesn't keep its matches to merge, use one job")
+    _httplog = logfilter.httplog
+    _httplog.checklog()
+    # Several shards per worker keeps them all busy if some ranges are slower than others,
+    # a compressed log can't be split so it is one shard of its own
+    _shards = []
+    for _path, _first, _last in _httplog.logranges():
+        if _httplog.compression(_path):
+            _shards.append((_path, 0, None))
+        else:
+            _shards.extend((_path, _start, _end) for _start, _end in shardlog(_path, jobs * 4, _first, _last))
+
+    # Make sure the signatures load before we start any processes, errors
+    # are then raised here rather than in a worker
+    logfilter.openconf()
+    if logfilter.compiled is None:
+        logfilter.compiled = logfilter.compilesignatures()
+    logfilter.checkfields()
+
+    _seen = set(logfilter.matches)
+    _cachesize = logfilter.cache.size if logfilter.cache is not None else 0
+    _sigdb = logfilter.sigdb
+    _pool = multiprocessing.Pool(jobs, initworker, (_httplog, logfilter.sigconf, _cachesize, req,
+                                                    _sigdb.lists, _sigdb.cachedir))
+    try:
+        # imap hands back the shards in order, so merging them keeps the first seen order
+        for _values in _pool.imap(filtershard, _shards):
+            for _value in _values:
+                if _value not in _seen:
+                    _seen.add(_value)
+                    logfilter.matches.append(_value)
+        _pool.close()
+    except (Exception, KeyboardInterrupt):
+        # Errors from a worker are raised again here, i.e. ConfErr
+        _pool.terminate()
+        raise
+    finally:
+        _pool.join()
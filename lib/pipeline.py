@@ -0,0 +1,319 @@
+#!/bin/env python
+#
+#   pipeline.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Composable generator stages for building your own
+#   flows out of the existing pieces; read log lines from
+#   files or stdin, parse them with an HTTPLog, keep the
+#   ones a Filter matches, count them and write them out.
+#   Everything moves through in batches of a bounded size,
+#   so memory stays flat however big the log is.
+#
+############################
+if not "sys" in vars():
+    import sys
+
+if "openlogfile" not in vars():
+    from lib.httplog import openlogfile
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Pipeline():
+    """
+    @Summary    A source of batches followed by stages, each a generator over the batches before it.
+
+    @Guide      A batch is a list of at most batchsize items, lines, records or values. A source is
+                an iterable of batches, i.e. readlines, and a stage is a callable taking an iterable of
+                batches and returning one, i.e. the functions below, so any generator function over
+                batches can be a stage of its own. Nothing runs until the pipeline is iterated, and
+                as every stage pulls one batch at a time from the one before, only a batch or so per
+                stage is ever held.
+                    then returns a new pipeline with more stages, so a common start can be shared.
+                Iterate it for the batches, call items for one item at a time, or run to drain it
+                when the last stage does the work, i.e. write.
+
+    @Parameters
+                source="an iterable of batches" i.e. readlines(["/var/log/httpd/access_log"])
+                stages="stages to run the batches through, in order"
+
+    @Example    log = HTTPLog(conf="/etc/httpd/conf/httpd.conf", log="logs/access_log", fullpath=None, stream=True)
+                logfilter = Filter(log, "signatures_conf.py")
+                log.fields = logfilter.fieldsused("host")
+                hosts = Counts(log, "host")
+                Pipeline(readlines(["-"]), parse(log), select(logfilter), aggregate(hosts),
+                         project(log, "host"), unique(), write("blacklist.off")).run()
+                hosts.top(10)
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, source, *stages):
+        self.source = source
+        self.stages = list(stages)
+
+    def then(self, *stages):
+        """
+        Return a new Pipeline running these stages after ours
+        """
+        return Pipeline(self.source, *(self.stages + list(stages)))
+
+    def __iter__(self):
+        _batches = iter(self.source)
+        for _stage in self.stages:
+            _batches = _stage(_batches)
+        return iter(_batches)
+
+    def items(self):
+        """
+        Generator; yield each item of each batch
+        """
+        for _batch in self:
+            for _item in _batch:
+                yield _item
+
+    #######
+    # RUN #
+    #######
+    def run(self):
+        """
+        Drain the pipeline, returning the number of items that came out of the end
+        """
+        _count = 0
+        for _batch in self:
+            _count += len(_batch)
+        return _count
+
+
+###########
+# SOURCES #
+###########
+def readlines(paths, batchsize=1000, chunksize=1048576):
+    """
+    Generator; yield batches of the lines of each path in turn, without their
+    newlines, "-" reads stdin. The files are read chunksize bytes at a time and
+    compressed logs are decompressed as they are read.
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    _batch = []
+    for _path in paths:
+        try:
+            _log = sys.stdin if _path == "-" else openlogfile(_path)
+        except (IOError, OSError) as err:
+            raise PipelineError("Unable to open log %s; %s" % (_path, err))
+        try:
+            _tail = ""
+            while True:
+                _chunk = _log.read(chunksize)
+                if not _chunk:
+                    break
+                # The last piece may be a partial line, it is carried over to the next chunk
+                _split = (_tail + _chunk).split("\n")
+                _tail = _split.pop()
+                for _line in _split:
+                    _batch.append(_line)
+                    if len(_batch) >= batchsize:
+                        yield _batch
+                        _batch = []
+            if _tail:
+                _batch.append(_tail)
+        finally:
+            if _log is not sys.stdin:
+                _log.close()
+    if _batch:
+        yield _batch
+
+
+def records(iterable, batchsize=1000):
+    """
+    Generator; batch up an iterable of items, i.e. httplog.records(), so it can
+    be the source of a Pipeline
+    """
+    _batch = []
+    for _item in iterable:
+        _batch.append(_item)
+        if len(_batch) >= batchsize:
+            yield _batch
+            _batch = []
+    if _batch:
+        yield _batch
+
+
+##########
+# STAGES #
+##########
+def parse(httplog):
+    """
+    Stage; parse batches of lines into batches of records with the parser of
+    httplog, lines that don't match the log format are dropped
+    """
+    def _stage(batches):
+        _parse = httplog.parser()
+        for _batch in batches:
+            _records = [_record for _record in map(_parse, _batch) if _record]
+            httplog.countlines(len(_batch), len(_records))
+            if _records:
+                yield _records
+    return _stage
+
+
+def select(logfilter):
+    """
+    Stage; keep only the records logfilter matches, its allow list, signatures
+    and detectors are all used, but its matches aren't touched
+    """
+    def _stage(batches):
+        logfilter.openconf()
+        _match = logfilter.recordmatcher()
+        for _batch in batches:
+            _batch = [_record for _record in _batch if _match(_record)]
+            if _batch:
+                yield _batch
+    return _stage
+
+
+def project(httplog, *fields):
+    """
+    Stage; turn batches of records into batches of the value of one field, or
+    of tuples of the values of several
+    """
+    _schema = httplog.logschema
+    for _field in fields:
+        if _field not in _schema:
+            raise PipelineError("Unknown field '%s'; choose one of %s" % (_field, ", ".join(sorted(_schema))))
+    _idxs = [_schema[_field] for _field in fields]
+
+    def _stage(batches):
+        if len(_idxs) == 1:
+            _idx = _idxs[0]
+            for _batch in batches:
+                yield [_record[_idx] for _record in _batch]
+        else:
+            for _batch in batches:
+                yield [tuple(_record[_idx] for _idx in _idxs) for _record in _batch]
+    return _stage
+
+
+def unique(seen=None):
+    """
+    Stage; drop values seen in an earlier batch or earlier in this one, the values
+    seen are kept, so this holds one entry per distinct value, or with seen, i.e. a
+    BloomFilter, they are kept in that in a fixed space
+    """
+    def _stage(batches):
+        _seen = set() if seen is None else seen
+        for _batch in batches:
+            _new = []
+            for _value in _batch:
+                if _value not in _seen:
+                    _seen.add(_value)
+                    _new.append(_value)
+            if _new:
+                yield _new
+    return _stage
+
+
+def rebatch(batchsize=1000):
+    """
+    Stage; regroup batches into batches of batchsize, i.e. after select has left
+    a lot of small ones
+    """
+    def _stage(batches):
+        _batch = []
+        for _items in batches:
+            _batch.extend(_items)
+            while len(_batch) >= batchsize:
+                yield _batch[:batchsize]
+                _batch = _batch[batchsize:]
+        if _batch:
+            yield _batch
+    return _stage
+
+
+def aggregate(*aggregators):
+    """
+    Stage; give every batch to each aggregator's add method and pass it on as it is
+    """
+    def _stage(batches):
+        for _batch in batches:
+            for _aggregator in aggregators:
+                _aggregator.add(_batch)
+            yield _batch
+    return _stage
+
+
+def write(output):
+    """
+    Stage; write each value on a line of its own to output, a path, "-" for stdout,
+    or anything with a write method, one write per batch, passing the batches on
+    """
+    def _stage(batches):
+        if hasattr(output, "write"):
+            _file, _close = output, False
+        elif output == "-":
+            _file, _close = sys.stdout, False
+        else:
+            try:
+                _file, _close = open(output, "w"), True
+            except IOError as err:
+                raise PipelineError("Unable to write %s; %s" % (output, err))
+        try:
+            for _batch in batches:
+                _file.write("".join("%s\n" % (_value,) for _value in _batch))
+                yield _batch
+        finally:
+            if _close:
+                _file.close()
+    return _stage
+
+
+###############
+# AGGREGATORS #
+###############
+class Counts():
+    """
+    @Summary    Counts the records of each value of a field, an aggregator for the aggregate stage.
+
+    @Guide      Every distinct value is kept with its count, for a field with a great many
+                values, i.e. the request, a fixed size counter is a better fit.
+
+    @Example    hosts = Counts(log, "host")
+                Pipeline(readlines(paths), parse(log), aggregate(hosts)).run()
+                hosts.top(10) -> [("10.0.0.1", 1200), ...]
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, httplog, field):
+        if field not in httplog.logschema:
+            raise PipelineError("Unknown field '%s'; choose one of %s" % (
+                field, ", ".join(sorted(httplog.logschema))))
+        self.field = field
+        self.idx = httplog.logschema[field]
+        self.counts = {}
+        self.total = 0
+
+    def add(self, batch):
+        _counts = self.counts
+        _idx = self.idx
+        for _record in batch:
+            _value = _record[_idx]
+            _counts[_value] = _counts.get(_value, 0) + 1
+        self.total += len(batch)
+
+    def top(self, count=10):
+        """
+        Return the count most common values with their counts, most common first
+        """
+        return sorted(self.counts.items(), key=lambda _item: (-_item[1], _item[0]))[:count]
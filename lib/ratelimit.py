@@ -0,0 +1,165 @@
+#!/bin/env python
+#
+#   ratelimit.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The RateDetector class flags hosts making too many
+#   requests, or getting too many 4xx responses, within
+#   a sliding window of time. Counts are kept in count
+#   min sketches so memory stays the same size however
+#   many distinct hosts there are.
+#
+############################
+if "CountMinSketch" not in vars():
+    from lib.sketch import CountMinSketch, SketchError
+
+if "TimeDecoder" not in vars():
+    from lib.timestamp import TimeDecoder, TimeError
+
+
+class RateError(Exception):
+    pass
+
+
+#############
+# PARSERATE #
+#############
+def parserate(rate):
+    """
+    Turn a rate given as COUNT/SECONDS, i.e. 600/60, into a (count, seconds) tuple
+    """
+    try:
+        _count, _seconds = rate.split("/")
+        _count, _seconds = int(_count), float(_seconds)
+    except (ValueError, AttributeError):
+        raise RateError("Invalid rate '%s'; use COUNT/SECONDS i.e. 600/60" % rate)
+    if _count < 1 or _seconds <= 0:
+        raise RateError("Invalid rate '%s'; the count and seconds must be above 0" % rate)
+    return _count, _seconds
+
+
+class SlidingCounter():
+    """
+    @Summary    Counts how often each key was seen within the last window seconds.
+
+    @Guide      The window is split into buckets, each with its own count-min sketch covering
+                window / buckets seconds, the count for a key is the sum of its estimates in
+                the live buckets. As time moves on the oldest bucket is cleared and reused, so
+                the window slides a bucket at a time. Times should arrive roughly in order,
+                anything older than the window is ignored.
+
+    @Parameters
+                window="seconds in the window" i.e. 60
+                buckets="number of sketches the window is split into" i.e. 6
+                width, depth="size of each CountMinSketch"
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, window, buckets=6, width=16384, depth=4):
+        self.span = float(window) / buckets
+        self.sketches = [CountMinSketch(width, depth) for _idx in range(buckets)]
+        self.slots = [None] * buckets  # The time slot each sketch currently holds
+        self.latest = None
+
+    def add(self, key, when):
+        """
+        Count key at time when (epoch seconds), returning its count over the window
+        """
+        _slot = int(when // self.span)
+        _buckets = len(self.sketches)
+        if self.latest is None or _slot > self.latest:
+            self.latest = _slot
+        elif _slot <= self.latest - _buckets:
+            # Older than the window, it can't make a difference now
+            return 0
+        _bucket = _slot % _buckets
+        if self.slots[_bucket] != _slot:
+            self.sketches[_bucket].clear()
+            self.slots[_bucket] = _slot
+
+        # Every sketch is the same size, so the indexes only have to be worked out once
+        _indexes = self.sketches[_bucket].indexes(key)
+        _count = self.sketches[_bucket].add(key, 1, _indexes)
+        for _idx, _sketch in enumerate(self.sketches):
+            if _idx != _bucket and self.slots[_idx] is not None and self.slots[_idx] > self.latest - _buckets:
+                _count += _sketch.estimate(key, _indexes)
+        return _count
+
+
+class RateDetector():
+    """
+    @Summary    Flags the hosts of log records going over a request rate, a 4xx rate or both.
+
+    @Guide      Give the logschema of the HTTPLog and the rates as (count, seconds), a host is
+                flagged once it makes more than count requests (or gets more than count 4xx
+                responses) within seconds. The time of each record comes from its time field,
+                so the detector works the same on a whole log as it does when following one.
+                    Add it to a Filter with adddetector, the Filter then returns flagged hosts
+                alongside its signature matches. Because counts come from count-min sketches
+                they can be over but never under, see CountMinSketch for the bounds.
+
+    @Parameters
+                schema="logschema of the HTTPLog"
+                requests="(count, seconds) request rate" i.e. (600, 60)
+                errors="(count, seconds) 4xx rate" i.e. (100, 60)
+                clftime="False if the time field isn't a plain %t" i.e. log.compiledformat.clftime
+                buckets, width, depth="size of each SlidingCounter"
+
+    @Example    detector = RateDetector(log.logschema, requests=(600, 60), clftime=log.compiledformat.clftime)
+                filter.adddetector(detector)
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, schema, requests=None, errors=None, clftime=True, buckets=6, width=16384, depth=4):
+        if not requests and not errors:
+            raise RateError("A RateDetector needs a request rate, an error rate or both")
+        self.fields = ["host", "time"]
+        if errors:
+            self.fields.append("status")
+        for _field in self.fields:
+            if _field not in schema:
+                raise RateError("Rate detection needs %s in the log format" % _field)
+        if not clftime:
+            # Only the [13/Dec/2013:10:00:00 +0000] time of a %t can be decoded, any other would
+            # fail on every record and nothing would ever be flagged
+            raise RateError("Rate detection needs the time as a plain %t in the log format")
+        self._hostidx = schema["host"]
+        self._timeidx = schema["time"]
+        self._statusidx = schema.get("status")
+        self.requests = requests
+        self.errors = errors
+        self.decoder = TimeDecoder()
+        try:
+            self.requestcounter = requests and SlidingCounter(requests[1], buckets, width, depth)
+            self.errorcounter = errors and SlidingCounter(errors[1], buckets, width, depth)
+        except SketchError as err:
+            raise RateError(err)
+
+    #########
+    # CHECK #
+    #########
+    def check(self, record):
+        """
+        Count the record and return True if its host is over one of our rates
+        """
+        try:
+            _when = self.decoder.decode(record[self._timeidx])
+        except TimeError:
+            return False
+        _host = record[self._hostidx]
+        _over = False
+        if self.requests and self.requestcounter.add(_host, _when) > self.requests[0]:
+            _over = True
+        if self.errors and record[self._statusidx][:1] == "4":
+            if self.errorcounter.add(_host, _when) > self.errors[0]:
+                _over = True
+        return _over
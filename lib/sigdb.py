@@ -0,0 +1,328 @@
+#!/bin/env python
+#
+#   sigdb.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The SignatureDB class turns the signatures dictionary
+#   of a signatures_conf.py file, plus any plain text or
+#   JSON signature lists, into a validated set of compiled
+#   Matchers, one per field. The result is kept on disk
+#   under a hash of the sources, so a run from cron loads
+#   it straight back and only rebuilds it when a source
+#   has changed.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "sys" in vars():
+    import sys
+
+if not "imp" in vars():
+    import imp
+
+if not "json" in vars():
+    import json
+
+if not "marshal" in vars():
+    import marshal
+
+if not "hashlib" in vars():
+    import hashlib
+
+if not "tempfile" in vars():
+    import tempfile
+
+if "Matcher" not in vars():
+    from lib.matcher import Matcher, MatchError
+
+if "CIDRMatcher" not in vars():
+    from lib.iptree import CIDRMatcher, IPTreeError
+
+if "TimeMatcher" not in vars():
+    from lib.timerange import TimeMatcher, TimeRangeError
+
+if not "time" in vars():
+    import time
+
+
+class SignatureError(Exception):
+    pass
+
+
+# The fields signatures can be given for, the same as Filter.signature_types
+FIELDS = ["agent", "host", "remotelog", "user", "request", "status", "size", "referrer", "time"]
+# The addresses and CIDR prefixes of hosts that are never matched, given like a field
+ALLOW = "allow"
+
+
+def matcherfor(field, signatures, plan=None):
+    """
+    Return the matcher for the signatures of field, host signatures and the allow list
+    are looked up as IP addresses and time signatures can be ranges
+    """
+    if field == "time":
+        return TimeMatcher(signatures, plan)
+    if field == "host":
+        return CIDRMatcher(signatures, plan)
+    if field == ALLOW:
+        return CIDRMatcher(signatures, plan, strict=True)
+    return Matcher(signatures, plan)
+
+
+class SignatureDB():
+    """
+    @Summary    The compiled signatures of a signatures_conf.py and any extra signature lists,
+                cached on disk.
+
+    @Guide      The signature conf is loaded from its path, so it doesn't have to be in the current
+                directory. Each list is either JSON, a dictionary of field to signatures like the
+                conf or just a list of agent signatures, or plain text with one signature per line,
+                blank lines and lines starting with # are skipped. A text list is for agents unless
+                it is given as field:path, i.e. referrer:/etc/httpdefender/spam_referrers.txt or
+                allow:/etc/httpdefender/our_networks.txt for the allow list.
+                    Every signature is validated and duplicates dropped, then each field is built
+                into a Matcher, a CIDRMatcher for hosts and the allow list and a TimeMatcher for
+                times. What is kept in the cache is the plan of each Matcher, the merged signatures
+                and their bucketed alternations or IP tree, keyed by a hash of the contents of every
+                source. Python can't save compiled regexes, so a cached load still compiles the
+                alternations, but nothing is imported, validated or bucketed again.
+
+    @Parameters
+                sigconf="the signature python config file" i.e. "signatures_conf.py"
+                lists="optional list of extra signature files" i.e. ["bad_bots.txt", "spam.json"]
+                cachedir="where to cache the compiled signatures, None to not cache them"
+                    i.e. "~/.cache/httpdefender"
+
+    @Example    sigdb = SignatureDB("signatures_conf.py", ["bad_bots.txt"], "/var/cache/httpdefender")
+                sigdb.load() -> {"agent": Matcher, "host": CIDRMatcher, ...}
+    """
+    # Bump this when the cache format changes
+    VERSION = 3
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, sigconf="signatures_conf.py", lists=None, cachedir=None):
+        self.sigconf = sigconf
+        self.lists = list(lists or [])
+        self.cachedir = os.path.expanduser(cachedir) if cachedir else None
+        self.matchers = None  # field -> Matcher, once loaded
+        self.cached = False  # True when the matchers came from the cache
+
+    ###########
+    # SOURCES #
+    ###########
+    def sources(self):
+        """
+        Return a list of (field, path) for each signature list, field is None
+        when the list says which fields its signatures are for
+        """
+        _sources = []
+        for _spec in self.lists:
+            _field, _sep, _path = _spec.partition(":")
+            if _sep and (_field in FIELDS or _field == ALLOW):
+                _sources.append((_field, _path))
+            elif _spec.lower().endswith(".json"):
+                _sources.append((None, _spec))
+            else:
+                _sources.append(("agent", _spec))
+        return _sources
+
+    def readsource(self, path):
+        try:
+            _file = open(path, "rb")
+            try:
+                return _file.read()
+            finally:
+                _file.close()
+        except IOError as err:
+            raise SignatureError("Unable to read signatures %s; %s" % (path, err))
+
+    ##########
+    # DIGEST #
+    ##########
+    def digest(self):
+        """
+        Return a hash of the contents of every source, any change to one of them
+        gives a different hash and so a different cache file
+        """
+        # Time ranges given as a local date and time depend on the time zone
+        _hash = hashlib.sha1("%s\0%s\0%s\0" % (self.VERSION, sys.version, time.timezone))
+        for _field, _path in [("conf", self.sigconf)] + self.sources():
+            _hash.update("%s\0%s\0" % (_field, os.path.abspath(_path)))
+            _hash.update(hashlib.sha1(self.readsource(_path)).hexdigest())
+        return _hash.hexdigest()
+
+    def cachepath(self, digest):
+        """
+        Return the cache file for digest, named after the conf so that older
+        builds of the same conf can be found and removed
+        """
+        _prefix = "signatures-%s-" % hashlib.sha1(os.path.abspath(self.sigconf)).hexdigest()[:12]
+        return os.path.join(self.cachedir, _prefix + digest + ".db"), _prefix
+
+    ########
+    # LOAD #
+    ########
+    def load(self):
+        """
+        Return a dictionary of field to Matcher, from the cache when the sources
+        haven't changed, otherwise built from the sources and cached
+        """
+        if self.matchers is not None:
+            return self.matchers
+        _digest = self.digest()
+        if self.cachedir:
+            self.matchers = self.readcache(_digest)
+            if self.matchers is not None:
+                self.cached = True
+                return self.matchers
+        self.matchers = self.build()
+        self.cached = False
+        if self.cachedir:
+            self.writecache(_digest)
+        return self.matchers
+
+    #########
+    # BUILD #
+    #########
+    def build(self):
+        """
+        Merge the signatures of every source, validate them and compile a Matcher
+        for each field that has any
+        """
+        _merged = {}
+        self.merge(_merged, self.loadconf(), self.sigconf)
+        for _field, _path in self.sources():
+            self.merge(_merged, self.loadlist(_field, _path), _path)
+        _matchers = {}
+        for _field, _signatures in _merged.items():
+            if _signatures:
+                try:
+                    _matchers[_field] = matcherfor(_field, _signatures)
+                except (MatchError, IPTreeError, TimeRangeError) as err:
+                    raise SignatureError("%s signatures; %s" % (_field, err))
+        return _matchers
+
+    def merge(self, merged, signatures, path):
+        """
+        Add the signatures dictionary from path to merged, dropping duplicates
+        """
+        if not isinstance(signatures, dict):
+            raise SignatureError("%s; signatures must be a dictionary of field to list" % path)
+        for _field, _signatures in signatures.items():
+            if _field not in FIELDS and _field != ALLOW:
+                raise SignatureError("%s; unknown signature field '%s', choose from %s" % (
+                    path, _field, ", ".join(FIELDS + [ALLOW])))
+            if not isinstance(_signatures, (list, tuple)):
+                raise SignatureError("%s; the %s signatures must be a list" % (path, _field))
+            _list = merged.setdefault(_field, [])
+            _seen = set(_list)
+            for _signature in _signatures:
+                if not isinstance(_signature, basestring):
+                    raise SignatureError("%s; %s signature %r is not a string" % (path, _field, _signature))
+                if _signature not in _seen:
+                    _seen.add(_signature)
+                    _list.append(_signature)
+
+    ############
+    # LOADCONF #
+    ############
+    def loadconf(self):
+        """
+        Load the signature python config file from its path and return its signatures
+        """
+        if not os.path.exists(self.sigconf) or not os.access(self.sigconf, os.R_OK):
+            raise SignatureError("Check signature config path and permissions")
+        _name = "httpdefender_sigconf_%s" % hashlib.sha1(os.path.abspath(self.sigconf)).hexdigest()[:12]
+        try:
+            _conf = imp.load_source(_name, self.sigconf)
+        except Exception as err:
+            raise SignatureError("Unable to load signature config %s; %s" % (self.sigconf, err))
+        finally:
+            # Loaded only to read it, don't leave it in sys.modules
+            sys.modules.pop(_name, None)
+        if not hasattr(_conf, "signatures"):
+            raise SignatureError("%s has no signatures dictionary" % self.sigconf)
+        return _conf.signatures
+
+    ############
+    # LOADLIST #
+    ############
+    def loadlist(self, field, path):
+        """
+        Return the signatures dictionary of a JSON or plain text signature list
+        """
+        _data = self.readsource(path)
+        if field is None or path.lower().endswith(".json"):
+            try:
+                _signatures = json.loads(_data)
+            except ValueError as err:
+                raise SignatureError("Invalid JSON signatures %s; %s" % (path, err))
+            # A plain list is for the field it was given for, agents by default
+            if isinstance(_signatures, list):
+                return {field or "agent": _signatures}
+            return _signatures
+        _signatures = []
+        for _line in _data.splitlines():
+            _line = _line.strip()
+            if _line and not _line.startswith("#"):
+                _signatures.append(_line)
+        return {field: _signatures}
+
+    #########
+    # CACHE #
+    #########
+    def readcache(self, digest):
+        """
+        Return the matchers saved for digest, or None if there aren't any or
+        they can't be read
+        """
+        _path = self.cachepath(digest)[0]
+        if not os.path.exists(_path):
+            return None
+        try:
+            _file = open(_path, "rb")
+            try:
+                _saved = marshal.load(_file)
+            finally:
+                _file.close()
+            if _saved.get("version") != self.VERSION or _saved.get("digest") != digest:
+                return None
+            return dict((_field, matcherfor(_field, _saved["signatures"][_field], plan=_plan))
+                        for _field, _plan in _saved["plans"].items())
+        except (IOError, EOFError, ValueError, TypeError, KeyError, AttributeError, MatchError, IPTreeError,
+                TimeRangeError):
+            # A damaged cache is simply built again
+            return None
+
+    def writecache(self, digest):
+        """
+        Save the matchers for digest, replacing the cache file atomically and removing
+        older builds of the same conf. The cache is only a speed up, so failing to
+        write it isn't an error.
+        """
+        _path, _prefix = self.cachepath(digest)
+        _saved = {"version": self.VERSION, "digest": digest,
+                  "signatures": dict((_field, _matcher.signatures) for _field, _matcher in self.matchers.items()),
+                  "plans": dict((_field, _matcher.plan()) for _field, _matcher in self.matchers.items())}
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            _fd, _tmp = tempfile.mkstemp(prefix=".%s" % _prefix, dir=self.cachedir)
+            try:
+                _file = os.fdopen(_fd, "wb")
+                marshal.dump(_saved, _file)
+                _file.close()
+                os.rename(_tmp, _path)
+            except:
+                os.unlink(_tmp)
+                raise
+            for _name in os.listdir(self.cachedir):
+                if _name.startswith(_prefix) and os.path.join(self.cachedir, _name) != _path:
+                    os.unlink(os.path.join(self.cachedir, _name))
+        except (IOError, OSError, ValueError):
+            pass
@@ -0,0 +1,353 @@
+#!/bin/env python
+#
+#   sinks.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Output sinks writing the blacklist as a single batch
+#   for a firewall, an ipset restore file, an nftables
+#   script or hosts.deny. Each remembers what it has
+#   already asked for in a state file, so a batch only
+#   adds the new offenders and removes the ones that have
+#   gone, rather than loading every IP again one by one.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "time" in vars():
+    import time
+
+if not "tempfile" in vars():
+    import tempfile
+
+if "parseip" not in vars():
+    from lib.iptree import parseip, formatip
+
+
+class SinkError(Exception):
+    pass
+
+
+###############
+# WRITEATOMIC #
+###############
+def writeatomic(path, data):
+    """
+    Write data to a temporary file next to path and rename it over the top, so
+    whatever reads path only ever sees the old or the new contents
+    """
+    _dir = os.path.dirname(os.path.abspath(path))
+    try:
+        _fd, _tmp = tempfile.mkstemp(prefix=".%s." % os.path.basename(path), dir=_dir)
+        try:
+            _file = os.fdopen(_fd, "w")
+            _file.write(data)
+            _file.flush()
+            os.fsync(_file.fileno())
+            _file.close()
+            # mkstemp creates the file 0600, give it the usual permissions
+            _umask = os.umask(0)
+            os.umask(_umask)
+            os.chmod(_tmp, 0666 & ~_umask)
+            os.rename(_tmp, path)
+        except:
+            os.unlink(_tmp)
+            raise
+    except (IOError, OSError) as err:
+        raise SinkError("Unable to write %s; %s" % (path, err))
+
+
+class Sink():
+    """
+    @Summary    The base of the batch output sinks, working out what to add and remove.
+
+    @Guide      The state file holds each entry the sink has added and when it times out, 0 for
+                never. write compares the entries of this run with it; entries that aren't in the
+                state are added and, unless keep is set, entries without a timeout that are no
+                longer offending are removed. An entry with a timeout stays until it expires, the
+                firewall drops it by itself, and if it is still offending after that it is simply
+                added again. The batch is written first and then the state, both atomically.
+                    The state is what the firewall holds once the batch is applied, so until then it
+                is only written to the pending file, state.pending, and commit makes it the state
+                once the batch has been loaded. Until it is committed the next batch is worked out
+                from the last state committed, with the entries of the pending batch added again or
+                removed too, as it may or may not have been applied. Where writing the batch is
+                applying it, i.e. hosts.deny, the state is saved straight away.
+                    Entries that aren't IP addresses, i.e. with -r agent, can't go in a firewall and
+                are skipped, see skipped. Subclasses give the batch for the adds and removes in render.
+
+    @Parameters
+                path="the batch file to write" i.e. "blacklist.ipset"
+                state="the state file. Default; path.state"
+                timeout="seconds each new entry is blocked for, None for good"
+                name="the ipset or nftables set name" i.e. "httpdefender"
+
+    @Example    sink = IPSetSink("blacklist.ipset", timeout=86400)
+                added, removed = sink.write(filter.matches)
+                if subprocess.call(["ipset", "restore", "-f", "blacklist.ipset"]) == 0:
+                    sink.commit()
+    """
+    # True when the firewall expires entries with a timeout itself
+    EXPIRES = True
+    # True when writing the batch is applying it, there is nothing to commit
+    APPLIED = False
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, path, state=None, timeout=None, name="httpdefender"):
+        self.path = path
+        self.state = state or "%s.state" % path
+        self.pending = "%s.pending" % self.state  # The state of the batch written, until it is committed
+        self.timeout = int(timeout) if timeout else None
+        self.name = name
+        self.skipped = []
+
+    #############
+    # LOADSTATE #
+    #############
+    def loadstate(self, path=None):
+        """
+        Return a dictionary of each entry in the state file, or the file at path, to
+        the time it expires
+        """
+        path = path or self.state
+        _state = {}
+        if not os.path.exists(path):
+            return _state
+        try:
+            _file = open(path, "r")
+            try:
+                for _line in _file:
+                    _parts = _line.split()
+                    _ip = len(_parts) == 2 and parseip(_parts[0])
+                    if _ip:
+                        # Written by an older run as it came, i.e. ::ffff:10.0.0.1
+                        _state[formatip(*_ip)] = int(_parts[1])
+            finally:
+                _file.close()
+        except (IOError, ValueError) as err:
+            raise SinkError("Unable to read sink state %s; %s" % (path, err))
+        return _state
+
+    #########
+    # DELTA #
+    #########
+    def delta(self, values, state, now, keep=False):
+        """
+        Return the entries to add, the entries to remove and the entries that expired,
+        updating state to what it will be once the batch is applied. Addresses are
+        written the way formatip gives them
+        """
+        _expired = [_entry for _entry, _expires in state.items() if _expires and _expires <= now]
+        for _entry in _expired:
+            del state[_entry]
+        _add = []
+        _current = set()
+        self.skipped = []
+        for _value in values:
+            _ip = parseip(_value)
+            if _ip is None:
+                self.skipped.append(_value)
+                continue
+            # The one text a firewall takes for the address, i.e. ::ffff:10.0.0.1 is 10.0.0.1 and
+            # goes in the IPv4 set, so the same address is only ever in the state once
+            _value = formatip(*_ip)
+            if _value in _current:
+                continue
+            _current.add(_value)
+            if _value not in state:
+                _add.append(_value)
+                state[_value] = now + self.timeout if self.timeout else 0
+        _remove = []
+        if not keep:
+            _remove = sorted(_entry for _entry, _expires in state.items() if not _expires and _entry not in _current)
+            for _entry in _remove:
+                del state[_entry]
+        return _add, _remove, sorted(_expired)
+
+    #########
+    # WRITE #
+    #########
+    def write(self, values, keep=False, now=None):
+        """
+        Write the batch taking the firewall from the last state to values, returning
+        the lists of entries added and removed
+        """
+        _now = int(now if now is not None else time.time())
+        _state = self.loadstate()
+        _add, _remove, _expired = self.delta(values, _state, _now, keep)
+        if os.path.exists(self.pending):
+            # A batch written but never committed may have been applied, so whatever it had that
+            # we don't now is added again with keep and removed without it, and whatever it took
+            # out that we still have is added again
+            _pending = self.loadstate(self.pending)
+            _removing = set(_remove)
+            for _entry, _expires in sorted(_pending.items()):
+                if _entry in _state or _entry in _removing or (_expires and _expires <= _now):
+                    continue
+                if keep:
+                    _state[_entry] = _expires
+                    _add.append(_entry)
+                elif not _expires:
+                    _remove.append(_entry)
+            _adding = set(_add)
+            _add.extend(sorted(_entry for _entry in _state if _entry not in _pending and _entry not in _adding))
+            _remove = sorted(_remove)
+        if not self.EXPIRES:
+            # Nothing else takes these out, so this batch has to
+            _remove = sorted(_remove + _expired)
+        writeatomic(self.path, self.render(_add, _remove, _state, _now))
+        _data = "".join("%s %s\n" % (_entry, _state[_entry]) for _entry in sorted(_state))
+        if self.APPLIED:
+            writeatomic(self.state, _data)
+        else:
+            writeatomic(self.pending, _data)
+        return _add, _remove
+
+    ##########
+    # COMMIT #
+    ##########
+    def commit(self):
+        """
+        Make the state of the last batch written the one the next batch is worked
+        out from, once it has been applied. Returns False if none was waiting
+        """
+        if self.APPLIED or not os.path.exists(self.pending):
+            return False
+        try:
+            os.rename(self.pending, self.state)
+        except OSError as err:
+            raise SinkError("Unable to commit sink state %s; %s" % (self.pending, err))
+        return True
+
+    ##########
+    # RENDER #
+    ##########
+    def render(self, add, remove, state, now):
+        """
+        Return the batch adding add and removing remove, given the state it leaves
+        and the time now. Every sink overrides this
+        """
+        raise SinkError("%s doesn't render a batch, a sink has to override render" % self.__class__.__name__)
+
+    ##########
+    # FAMILY #
+    ##########
+    def family(self, values, version):
+        """
+        Return the entries of values of the IP version, 4 or 6
+        """
+        return [_value for _value in values if parseip(_value)[0] == version]
+
+
+class IPSetSink(Sink):
+    """
+    An ipset restore file, applied with ipset restore -f path. It creates a hash:ip set
+    for IPv4 and one for IPv6, name and name6, then adds and deletes the entries, every
+    line with -exist so the batch can be applied more than once.
+    """
+
+    ##########
+    # RENDER #
+    ##########
+    def render(self, add, remove, state, now):
+        _timeout = " timeout 0" if self.timeout else ""
+        _lines = []
+        for _version, _name, _family in ((4, self.name, "inet"), (6, self.name + "6", "inet6")):
+            _lines.append("create %s hash:ip family %s%s -exist" % (_name, _family, _timeout))
+            for _entry in self.family(remove, _version):
+                _lines.append("del %s %s -exist" % (_name, _entry))
+            for _entry in self.family(add, _version):
+                if self.timeout:
+                    _lines.append("add %s %s timeout %s -exist" % (_name, _entry, max(state[_entry] - now, 1)))
+                else:
+                    _lines.append("add %s %s -exist" % (_name, _entry))
+        return "".join("%s\n" % _line for _line in _lines)
+
+
+class NFTablesSink(Sink):
+    """
+    An nftables script, applied with nft -f path, which nft runs as one transaction. It
+    declares the table inet name with a set name for IPv4 and name6 for IPv6, flushes them
+    and adds every entry of the state back, with what is left of its timeout, in statements
+    of CHUNK elements each. nft aborts the whole transaction on deleting an element that
+    isn't in the set, i.e. after a reboot, a flush or an element timing out, so rather than
+    deleting the removed entries the sets are rebuilt, and the batch can be applied any
+    number of times and always leaves the sets holding the state.
+    """
+    CHUNK = 1000
+
+    ##########
+    # RENDER #
+    ##########
+    def render(self, add, remove, state, now):
+        _lines = ["table inet %s {" % self.name,
+                  "\tset %s {\n\t\ttype ipv4_addr\n\t\tflags timeout\n\t}" % self.name,
+                  "\tset %s6 {\n\t\ttype ipv6_addr\n\t\tflags timeout\n\t}" % self.name,
+                  "}"]
+        for _version, _name in ((4, self.name), (6, self.name + "6")):
+            _lines.append("flush set inet %s %s" % (self.name, _name))
+            _add = []
+            for _entry in self.family(sorted(state), _version):
+                if state[_entry]:
+                    _add.append("%s timeout %ss" % (_entry, max(state[_entry] - now, 1)))
+                else:
+                    _add.append(_entry)
+            for _start in xrange(0, len(_add), self.CHUNK):
+                _lines.append("add element inet %s %s { %s }" % (
+                    self.name, _name, ", ".join(_add[_start:_start + self.CHUNK])))
+        return "".join("%s\n" % _line for _line in _lines)
+
+
+class HostsDenySink(Sink):
+    """
+    hosts.deny for tcp wrappers. There is nothing to apply, so the batch is the whole file;
+    a block of ALL: address lines between two marker comments is replaced with the entries
+    of the state, and every other line of the file is kept as it is. hosts.deny can't time
+    entries out, so expired entries are taken out here.
+    """
+    EXPIRES = False
+    APPLIED = True
+    BEGIN = "# BEGIN httpdefender, this block is rewritten on every run"
+    END = "# END httpdefender"
+
+    ##########
+    # RENDER #
+    ##########
+    def render(self, add, remove, state, now):
+        _before, _after = [], []
+        if os.path.exists(self.path):
+            try:
+                _file = open(self.path, "r")
+                try:
+                    _lines = _file.read().splitlines()
+                finally:
+                    _file.close()
+            except IOError as err:
+                raise SinkError("Unable to read %s; %s" % (self.path, err))
+            _part = _before
+            for _line in _lines:
+                if _line == self.BEGIN:
+                    _part = None
+                elif _line == self.END and _part is None:
+                    _part = _after
+                elif _part is not None:
+                    _part.append(_line)
+            if _part is None:
+                raise SinkError("%s has no '%s' after '%s'" % (self.path, self.END, self.BEGIN))
+        _block = [self.BEGIN]
+        for _entry in sorted(state):
+            # IPv6 addresses go in brackets
+            _block.append("ALL: [%s]" % _entry if ":" in _entry else "ALL: %s" % _entry)
+        _block.append(self.END)
+        return "".join("%s\n" % _line for _line in _before + _block + _after)
+
+
+# The sinks that can be chosen by name
+SINKS = {"ipset": IPSetSink, "nftables": NFTablesSink, "hostsdeny": HostsDenySink}
@@ -0,0 +1,370 @@
+#!/bin/env python
+#
+#   sketch.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Fixed size probabilistic counters, these let us
+#   count things like requests per IP over millions of
+#   distinct IPs without keeping one object per IP, find
+#   the most frequent of them, remember which we have seen
+#   and count how many there are, all in a fixed space.
+#
+############################
+if not "array" in vars():
+    from array import array
+
+if not "math" in vars():
+    import math
+
+if not "random" in vars():
+    import random
+
+if not "heapq" in vars():
+    import heapq
+
+if not "struct" in vars():
+    import struct
+
+if not "hashlib" in vars():
+    import hashlib
+
+
+class SketchError(Exception):
+    pass
+
+
+def hash128(key):
+    """
+    Return two 64 bit hashes of key from its md5, which unlike hash() are the same
+    in every process and spread well enough for counting leading zeros
+    """
+    if not isinstance(key, str):
+        key = repr(key)
+    return struct.unpack("<QQ", hashlib.md5(key).digest())
+
+
+class CountMinSketch():
+    """
+    @Summary    A count-min sketch, estimates how many times each key has been added using
+                depth rows of width counters.
+
+    @Guide      An estimate is never below the real count, it is above it by at most
+                e / width * (total of all counts) with a probability of 1 - e ** -depth.
+                Memory is fixed at width * depth 4 byte counters however many keys are added.
+
+    @Parameters
+                width="counters per row" i.e. 16384
+                depth="number of rows, each with its own hash" i.e. 4
+
+    @Example    sketch = CountMinSketch(16384, 4)
+                sketch.add("10.0.0.1") -> 1
+    """
+    # The Mersenne prime 2**61 - 1, used for the row hashes
+    PRIME = (1 << 61) - 1
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, width=16384, depth=4):
+        if width < 1 or depth < 1:
+            raise SketchError("A sketch needs a width and depth of at least 1")
+        self.width = width
+        self.depth = depth
+        self.rows = []
+        self.clear()
+        # Per row multipliers and offsets from a fixed seed, so the sketch is the same every run
+        _random = random.Random(width * depth)
+        self.hashes = [(_random.randint(1, self.PRIME - 1), _random.randint(0, self.PRIME - 1))
+                       for _idx in range(depth)]
+
+    def indexes(self, key):
+        """
+        Return the counter index for key in each row
+        """
+        _hash = hash(key) & 0xFFFFFFFFFFFFFFFF
+        return [((_mul * _hash + _add) % self.PRIME) % self.width for _mul, _add in self.hashes]
+
+    def add(self, key, count=1, indexes=None):
+        """
+        Add count to key and return its new estimate, indexes can be passed in if
+        they have already been worked out for a sketch of the same size
+        """
+        _estimate = None
+        for _row, _idx in zip(self.rows, indexes or self.indexes(key)):
+            _value = _row[_idx] + count
+            # Counters saturate rather than wrap around
+            if _value > 0xFFFFFFFF:
+                _value = 0xFFFFFFFF
+            _row[_idx] = _value
+            if _estimate is None or _value < _estimate:
+                _estimate = _value
+        return _estimate
+
+    def estimate(self, key, indexes=None):
+        """
+        Return the estimated count for key
+        """
+        return min(_row[_idx] for _row, _idx in zip(self.rows, indexes or self.indexes(key)))
+
+    def clear(self):
+        self.rows = [array("I", [0]) * self.width for _idx in range(self.depth)]
+
+    @staticmethod
+    def forerror(epsilon, delta):
+        """
+        Return the (width, depth) giving estimates within epsilon * total of the
+        real count with a probability of 1 - delta
+        """
+        return int(math.ceil(math.e / epsilon)), int(math.ceil(math.log(1.0 / delta)))
+
+
+class SpaceSaving():
+    """
+    @Summary    The Space-Saving heavy hitter counter, keeps the most frequent keys of a stream
+                in a fixed number of counters.
+
+    @Guide      Up to capacity keys are counted exactly. When a new key arrives with every counter
+                taken, the key with the smallest count is dropped and the new key takes over its
+                counter, count and all, with that count kept as its error. So a count is never below
+                the real one and above it by at most its error, which is at most total / capacity,
+                and every key seen more than total / capacity times is sure to be held. To be sure
+                of the top n, give a capacity well above n.
+                    The counter with the smallest count is found with a heap that is only put right
+                when a key is dropped, counts only go up so an entry that is out of date is simply
+                pushed back with its real count, and counting a key that is held is one dictionary
+                update.
+
+    @Parameters
+                capacity="the number of keys held" i.e. 1000
+
+    @Example    hitters = SpaceSaving(1000)
+                hitters.add("10.0.0.1")
+                hitters.top(10) -> [("10.0.0.1", 1, 0), ...]
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, capacity=1000):
+        if capacity < 1:
+            raise SketchError("SpaceSaving needs a capacity of at least 1")
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []  # (count, key), a count here can be behind the one in counts
+        self.total = 0
+
+    #######
+    # ADD #
+    #######
+    def add(self, key, count=1):
+        """
+        Count key, count times
+        """
+        self.total += count
+        _counts = self.counts
+        if key in _counts:
+            _counts[key] += count
+            return
+        if len(_counts) < self.capacity:
+            _counts[key] = count
+            self.errors[key] = 0
+            heapq.heappush(self.heap, (count, key))
+            return
+        # Take over the counter with the smallest count
+        _heap = self.heap
+        while True:
+            _count, _key = _heap[0]
+            if _counts[_key] == _count:
+                break
+            heapq.heapreplace(_heap, (_counts[_key], _key))
+        del _counts[_key]
+        del self.errors[_key]
+        _counts[key] = _count + count
+        self.errors[key] = _count
+        heapq.heapreplace(_heap, (_count + count, key))
+
+    #######
+    # TOP #
+    #######
+    def top(self, count=10):
+        """
+        Return (key, count, error) of the count keys with the highest counts, highest first
+        """
+        _top = sorted(self.counts.items(), key=lambda _item: (-_item[1], _item[0]))[:count]
+        return [(_key, _count, self.errors[_key]) for _key, _count in _top]
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class BloomFilter():
+    """
+    @Summary    A Bloom filter, remembers which keys have been added in a fixed number of bits.
+
+    @Guide      Each key sets hashes bits, worked out from the two halves of its md5. A key that was
+                added is always found, but one that wasn't is found too, a false positive, with a
+                probability of about (1 - e ** (-hashes * keys / bits)) ** hashes. forerror gives the
+                bits and hashes keeping this at error for up to capacity keys, about 1.44 * log2(1 /
+                error) bits per key, i.e. 1.8MB for a million keys at 0.001. Past capacity it climbs
+                fast, to 0.057 at twice capacity and 0.73 at five times with those settings, errorrate gives
+                what it is now. Keys can't be taken out.
+                    Used in place of a set of what has been seen, a false positive is a new key taken
+                for one seen before, so about error of the new keys are missed.
+
+    @Parameters
+                capacity="the number of keys it is sized for" i.e. 1000000
+                error="the false positive rate at capacity keys" i.e. 0.001
+
+    @Example    seen = BloomFilter(1000000, 0.001)
+                seen.add("10.0.0.1") -> True
+                "10.0.0.1" in seen -> True
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, capacity=1000000, error=0.001):
+        if capacity < 1:
+            raise SketchError("A Bloom filter needs a capacity of at least 1")
+        if not 0 < error < 1:
+            raise SketchError("A Bloom filter needs an error between 0 and 1")
+        self.capacity = capacity
+        self.error = error
+        self.bits, self.hashes = self.forerror(capacity, error)
+        self.array = array("B", [0]) * ((self.bits + 7) // 8)
+        self.added = 0  # Keys added that weren't already there
+
+    def positions(self, key):
+        """
+        Return the bits of key
+        """
+        _first, _second = hash128(key)
+        _bits = self.bits
+        return [(_first + _idx * _second) % _bits for _idx in xrange(self.hashes)]
+
+    #######
+    # ADD #
+    #######
+    def add(self, key):
+        """
+        Add key, returning True if it wasn't there before
+        """
+        _array = self.array
+        _new = False
+        for _bit in self.positions(key):
+            _byte, _mask = _bit >> 3, 1 << (_bit & 7)
+            if not _array[_byte] & _mask:
+                _array[_byte] |= _mask
+                _new = True
+        if _new:
+            self.added += 1
+        return _new
+
+    def __contains__(self, key):
+        _array = self.array
+        for _bit in self.positions(key):
+            if not _array[_bit >> 3] & (1 << (_bit & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.added
+
+    def errorrate(self):
+        """
+        Return the false positive rate for the keys added so far
+        """
+        return (1 - math.exp(-float(self.hashes) * self.added / self.bits)) ** self.hashes
+
+    @staticmethod
+    def forerror(capacity, error):
+        """
+        Return the (bits, hashes) giving a false positive rate of error with
+        capacity keys added
+        """
+        _bits = int(math.ceil(-capacity * math.log(error) / math.log(2) ** 2))
+        return _bits, max(1, int(round(float(_bits) / capacity * math.log(2))))
+
+
+class HyperLogLog():
+    """
+    @Summary    A HyperLogLog, estimates how many distinct keys have been added in 2 ** precision
+                one byte registers.
+
+    @Guide      The first precision bits of the hash of a key pick a register, and the register keeps
+                the most leading zeros plus one seen in the rest of the hash. The estimate has a
+                relative standard error of 1.04 / sqrt(2 ** precision), so it is within that of the
+                real count about 68% of the time, twice it 95% and three times 99.7%. The default
+                precision of 14 is 16KB of registers and 0.81%, each step up doubles the memory and
+                divides the error by 1.41. Up to 2.5 * 2 ** precision keys, counting the registers
+                still empty gives a better estimate and is used instead.
+                    Two HyperLogLogs of the same precision can be merged, giving the count of the
+                keys added to either.
+
+    @Parameters
+                precision="bits of the hash picking the register, 4 to 18" i.e. 14
+
+    @Example    hosts = HyperLogLog(14)
+                hosts.add("10.0.0.1")
+                hosts.count() -> 1
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise SketchError("A HyperLogLog needs a precision of 4 to 18")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = array("B", [0]) * self.size
+        self.error = 1.04 / math.sqrt(self.size)
+        if self.size >= 128:
+            self.alpha = 0.7213 / (1 + 1.079 / self.size)
+        else:
+            self.alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+
+    #######
+    # ADD #
+    #######
+    def add(self, key):
+        _hash = hash128(key)[0]
+        _rest = 64 - self.precision
+        _idx = _hash >> _rest
+        # Leading zeros plus one of the bits left
+        _rank = _rest - (_hash & ((1 << _rest) - 1)).bit_length() + 1
+        if _rank > self.registers[_idx]:
+            self.registers[_idx] = _rank
+
+    #########
+    # COUNT #
+    #########
+    def count(self):
+        """
+        Return the estimated number of distinct keys added
+        """
+        _size = self.size
+        _estimate = self.alpha * _size * _size / math.fsum(2.0 ** -_register for _register in self.registers)
+        if _estimate <= 2.5 * _size:
+            _zeros = self.registers.count(0)
+            if _zeros:
+                # Linear counting
+                _estimate = _size * math.log(float(_size) / _zeros)
+        return int(round(_estimate))
+
+    def merge(self, other):
+        """
+        Add the keys counted by other, a HyperLogLog of the same precision
+        """
+        if other.precision != self.precision:
+            raise SketchError("Only HyperLogLogs of the same precision can be merged")
+        self.registers = array("B", map(max, self.registers, other.registers))
+
+    def __len__(self):
+        return self.count()
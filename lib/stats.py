@@ -0,0 +1,163 @@
+#!/bin/env python
+#
+#   stats.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   The Stats class collects timings and counts while
+#   httpdefender runs; the wall time of each phase, the
+#   lines parsed and rejected by the log format regex and
+#   the hits and match time of each signature, so a slow
+#   run can be pinned down to the phase or the signature
+#   responsible.
+#
+############################
+if not "time" in vars():
+    import time
+
+if not "json" in vars():
+    import json
+
+if not "contextlib" in vars():
+    import contextlib
+
+
+class Stats():
+    """
+    @Summary    Timings and counters for a run, reported as text or JSON.
+
+    @Guide      Time a phase with "with stats.phase(name):", phases can be nested and each one
+                reports only its own time, not the time of the phases inside it. timeiter does the
+                same for the time spent producing the items of an iterable, so the time spent
+                parsing a streamed log is split out of the filter run consuming it.
+
+    @Example    stats = Stats()
+                with stats.phase("runfilter"):
+                    ...
+                print stats.report("text")
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self):
+        self.phases = {}  # name -> [seconds, times entered]
+        self.order = []  # Phase names in the order they were first seen
+        self.counters = {}
+        self.signatures = {}  # (field, signature) -> [hits, evaluations, seconds]
+        self._stack = []  # Time spent in nested phases, for each open phase
+
+    def addphase(self, name, seconds):
+        if name not in self.phases:
+            self.phases[name] = [0.0, 0]
+            self.order.append(name)
+        self.phases[name][0] += seconds
+        self.phases[name][1] += 1
+
+    #########
+    # PHASE #
+    #########
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager timing the block within it as the phase name
+        """
+        _start = time.time()
+        self._stack.append(0.0)
+        try:
+            yield
+        finally:
+            _elapsed = time.time() - _start
+            self.addphase(name, _elapsed - self._stack.pop())
+            if self._stack:
+                self._stack[-1] += _elapsed
+
+    ############
+    # TIMEITER #
+    ############
+    def timeiter(self, name, iterable):
+        """
+        Generator; yield the items of iterable, timing how long each one took
+        to produce as the phase name
+        """
+        _iter = iter(iterable)
+        _total = 0.0
+        try:
+            while True:
+                _start = time.time()
+                try:
+                    _item = next(_iter)
+                except StopIteration:
+                    _total += time.time() - _start
+                    break
+                _elapsed = time.time() - _start
+                _total += _elapsed
+                # Take it off whichever phase is consuming us
+                if self._stack:
+                    self._stack[-1] += _elapsed
+                yield _item
+        finally:
+            self.addphase(name, _total)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    #############
+    # SIGNATURE #
+    #############
+    def signature(self, field, signature, hits=0, evaluations=0, seconds=0.0):
+        """
+        Add to the hits, evaluations and match time of a signature
+        """
+        _stats = self.signatures.get((field, signature))
+        if _stats is None:
+            _stats = self.signatures[(field, signature)] = [0, 0, 0.0]
+        _stats[0] += hits
+        _stats[1] += evaluations
+        _stats[2] += seconds
+
+    ##########
+    # REPORT #
+    ##########
+    def todict(self):
+        _signatures = []
+        for (_field, _signature), (_hits, _evaluations, _seconds) in self.signatures.items():
+            _signatures.append({"field": _field, "signature": _signature, "hits": _hits,
+                                "evaluations": _evaluations, "seconds": _seconds})
+        # The most expensive first
+        _signatures.sort(key=lambda _sig: (-_sig["seconds"], _sig["field"], _sig["signature"]))
+        return {"phases": [{"name": _name, "seconds": self.phases[_name][0], "calls": self.phases[_name][1]}
+                           for _name in self.order],
+                "counters": self.counters,
+                "signatures": _signatures}
+
+    def report(self, form="text"):
+        """
+        Return the report as text or json
+        """
+        _stats = self.todict()
+        if form == "json":
+            return json.dumps(_stats, indent=2, sort_keys=True)
+
+        _lines = ["phases:"]
+        for _phase in _stats["phases"]:
+            _lines.append("  %-16s %10.4fs" % (_phase["name"], _phase["seconds"]))
+        if _stats["counters"]:
+            _lines.append("counters:")
+            for _name in sorted(_stats["counters"]):
+                _lines.append("  %-16s %10s" % (_name, _stats["counters"][_name]))
+        if _stats["signatures"]:
+            _lines.append("signatures, most expensive first:")
+            _lines.append("  %-10s %-32s %10s %10s %10s %10s" % (
+                "field", "signature", "hits", "evals", "seconds", "us/eval"))
+            for _sig in _stats["signatures"]:
+                _lines.append("  %-10s %-32s %10d %10d %10.4f %10.2f" % (
+                    _sig["field"], _sig["signature"][:32], _sig["hits"], _sig["evaluations"], _sig["seconds"],
+                    _sig["seconds"] * 1e6 / max(_sig["evaluations"], 1)))
+            _dead = len([_sig for _sig in _stats["signatures"] if not _sig["hits"]])
+            _lines.append("%s of %s signatures had no hits" % (_dead, len(_stats["signatures"])))
+        return "\n".join(_lines)
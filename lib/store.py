@@ -0,0 +1,257 @@
+#!/bin/env python
+#
+#   store.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The OffenderStore class keeps every offender across
+#   runs in an sqlite database; how many times it was
+#   flagged, the signatures it matched and when it was
+#   first and last seen. Offences are gathered in memory
+#   and written in batches, each one transaction, and an
+#   offender is dropped once it hasn't been seen for the
+#   time to live, so the blacklist is just a query.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "time" in vars():
+    import time
+
+if not "sqlite3" in vars():
+    import sqlite3
+
+if "TimeDecoder" not in vars():
+    from lib.timestamp import TimeDecoder, TimeError
+
+
+class StoreError(Exception):
+    pass
+
+
+class OffenderStore():
+    """
+    @Summary    A persistent store of offenders, their hit counts, signatures and first and last seen times.
+
+    @Guide      Add it to a Filter with addobserver and it is given every flagged record; the req
+                field of the record is the offender, i.e. the host, and the time of the record is
+                when it was seen, or now if the log has no time. The signatures the record matched
+                come from Filter.explain, a record only a detector flagged is put down to the
+                detector. Nothing is written per record, the counts are gathered in memory and
+                flush writes them all in a single transaction, which happens every batchsize
+                offenders and signatures, every interval seconds and on close.
+                    The writes are an INSERT OR IGNORE followed by an UPDATE adding to the counts,
+                so they work on an sqlite older than the UPSERT syntax, and the database is in WAL
+                mode so a query, i.e. from a firewall script, doesn't hold up the writes.
+                    With a ttl, blacklist only returns the offenders seen within the last ttl seconds
+                and expire deletes the rest, so a ban lifts ttl seconds after the last offence.
+
+    @Parameters
+                path="the sqlite database file" i.e. "/var/lib/httpdefender/offenders.db"
+                logfilter="the Filter whose records are observed, for its log schema and explain"
+                req="the field that is the offender" i.e. "host"
+                ttl="seconds an offender is kept after it was last seen, None for good"
+                batchsize="offenders and signatures gathered before they are written" i.e. 10000
+                interval="most seconds between writes while following a log" i.e. 5.0
+
+    @Example    store = OffenderStore("offenders.db", filter, "host", ttl=86400)
+                filter.addobserver(store)
+                filter.runfilter("host")
+                store.close()
+                store.blacklist() -> ["10.0.0.1", ...]
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS offenders (
+            offender TEXT PRIMARY KEY,
+            hits INTEGER NOT NULL,
+            first_seen INTEGER NOT NULL,
+            last_seen INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS offenders_last_seen ON offenders (last_seen);
+        CREATE TABLE IF NOT EXISTS signatures (
+            offender TEXT NOT NULL,
+            field TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            hits INTEGER NOT NULL,
+            PRIMARY KEY (offender, field, signature)
+        );
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, path, logfilter, req="host", ttl=None, batchsize=10000, interval=5.0):
+        _schema = logfilter.httplog.logschema
+        if req not in _schema:
+            raise StoreError("Unknown offender field '%s'; choose one of %s" % (req, ", ".join(sorted(_schema))))
+        self.path = path
+        self.filter = logfilter
+        self.req = req
+        self.ttl = int(ttl) if ttl else None
+        self.batchsize = batchsize
+        self.interval = interval
+        self.fields = [req, "time"] if "time" in _schema else [req]
+        self._reqidx = _schema[req]
+        self._timeidx = _schema.get("time")
+        self.decoder = TimeDecoder()
+        self.pending = {}  # offender -> [hits, first seen, last seen] not yet written
+        self.pendingsigs = {}  # (offender, field, signature) -> hits not yet written
+        self.flushed = time.time()
+        try:
+            _dir = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(_dir):
+                os.makedirs(_dir)
+            # Transactions are begun and committed here rather than by the module
+            self.db = sqlite3.connect(path, isolation_level=None)
+            # Give back the str values we put in, not unicode
+            self.db.text_factory = str
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(self.SCHEMA)
+        except (sqlite3.Error, OSError) as err:
+            raise StoreError("Unable to open the offender store %s; %s" % (path, err))
+
+    ###########
+    # OBSERVE #
+    ###########
+    def observe(self, record, flagged=False):
+        """
+        Count a flagged record against its offender
+        """
+        if not flagged:
+            return
+        _offender = record[self._reqidx]
+        _when = None
+        if self._timeidx is not None:
+            try:
+                _when = self.decoder.decode(record[self._timeidx])
+            except (TimeError, AttributeError):
+                pass
+        if _when is None:
+            _when = int(time.time())
+        _pending = self.pending.get(_offender)
+        if _pending is None:
+            self.pending[_offender] = [1, _when, _when]
+        else:
+            _pending[0] += 1
+            if _when < _pending[1]:
+                _pending[1] = _when
+            if _when > _pending[2]:
+                _pending[2] = _when
+        _signatures = self.filter.explain(record)
+        if not _signatures:
+            _signatures = [("detector", _detector.__class__.__name__) for _detector in self.filter.detectors]
+        for _field, _signature in _signatures:
+            _key = (_offender, _field, _signature)
+            self.pendingsigs[_key] = self.pendingsigs.get(_key, 0) + 1
+        if len(self.pending) + len(self.pendingsigs) >= self.batchsize:
+            self.flush()
+        elif time.time() - self.flushed >= self.interval:
+            self.flush()
+
+    #########
+    # FLUSH #
+    #########
+    def flush(self):
+        """
+        Write everything gathered since the last flush in one transaction
+        """
+        self.flushed = time.time()
+        if not self.pending and not self.pendingsigs:
+            return
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany("INSERT OR IGNORE INTO offenders (offender, hits, first_seen, last_seen) "
+                                    "VALUES (?, 0, ?, ?)",
+                                    [(_offender, _counts[1], _counts[2])
+                                     for _offender, _counts in self.pending.items()])
+                self.db.executemany("UPDATE offenders SET hits = hits + ?, first_seen = MIN(first_seen, ?), "
+                                    "last_seen = MAX(last_seen, ?) WHERE offender = ?",
+                                    [(_counts[0], _counts[1], _counts[2], _offender)
+                                     for _offender, _counts in self.pending.items()])
+                self.db.executemany("INSERT OR IGNORE INTO signatures (offender, field, signature, hits) "
+                                    "VALUES (?, ?, ?, 0)", self.pendingsigs.keys())
+                self.db.executemany("UPDATE signatures SET hits = hits + ? "
+                                    "WHERE offender = ? AND field = ? AND signature = ?",
+                                    [(_hits,) + _key for _key, _hits in self.pendingsigs.items()])
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as err:
+            raise StoreError("Unable to write the offender store %s; %s" % (self.path, err))
+        self.pending = {}
+        self.pendingsigs = {}
+
+    ##########
+    # EXPIRE #
+    ##########
+    def expire(self, now=None):
+        """
+        Delete the offenders not seen within the ttl, returning how many went
+        """
+        if not self.ttl:
+            return 0
+        _oldest = int(now if now is not None else time.time()) - self.ttl
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.execute("DELETE FROM signatures WHERE offender IN "
+                            "(SELECT offender FROM offenders WHERE last_seen < ?)", (_oldest,))
+            _expired = self.db.execute("DELETE FROM offenders WHERE last_seen < ?", (_oldest,)).rowcount
+            self.db.execute("COMMIT")
+        except sqlite3.Error as err:
+            raise StoreError("Unable to expire the offender store %s; %s" % (self.path, err))
+        return _expired
+
+    #############
+    # BLACKLIST #
+    #############
+    def blacklist(self, now=None, minhits=1):
+        """
+        Return the offenders seen within the ttl and flagged at least minhits
+        times, in the order they were first seen
+        """
+        _oldest = int(now if now is not None else time.time()) - self.ttl if self.ttl else None
+        try:
+            _rows = self.db.execute("SELECT offender FROM offenders WHERE hits >= ? AND last_seen >= ? "
+                                    "ORDER BY first_seen, offender",
+                                    (minhits, _oldest if _oldest is not None else -(1 << 62)))
+            return [_row[0] for _row in _rows]
+        except sqlite3.Error as err:
+            raise StoreError("Unable to read the offender store %s; %s" % (self.path, err))
+
+    def offender(self, offender):
+        """
+        Return the hits, first and last seen times and the signatures with their
+        hits of an offender, None if it isn't in the store
+        """
+        try:
+            _row = self.db.execute("SELECT hits, first_seen, last_seen FROM offenders WHERE offender = ?",
+                                   (offender,)).fetchone()
+            if _row is None:
+                return None
+            _signatures = self.db.execute("SELECT field, signature, hits FROM signatures WHERE offender = ? "
+                                          "ORDER BY hits DESC, field, signature", (offender,)).fetchall()
+        except sqlite3.Error as err:
+            raise StoreError("Unable to read the offender store %s; %s" % (self.path, err))
+        return {"hits": _row[0], "first_seen": _row[1], "last_seen": _row[2],
+                "signatures": [{"field": _field, "signature": _signature, "hits": _hits}
+                               for _field, _signature, _hits in _signatures]}
+
+    #########
+    # CLOSE #
+    #########
+    def close(self):
+        """
+        Write anything still gathered and close the database
+        """
+        if self.db is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,198 @@
+#!/bin/env python
+#
+#   timerange.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Time signatures as ranges rather than regexes, i.e.
+#   "2013-12-13 10:00..2013-12-13 11:00" or every day from
+#   "22:00..06:00". The time of a record is decoded to an
+#   integer once, with a TimeDecoder, and each range is
+#   then a pair of integer comparisons.
+#
+############################
+if not "re" in vars():
+    import re
+
+if not "sys" in vars():
+    import sys
+
+if "TimeDecoder" not in vars():
+    from lib.timestamp import TimeDecoder, TimeError
+
+if "parsetime" not in vars():
+    from lib.timeseek import parsetime, TimeSeekError
+
+if "Matcher" not in vars():
+    from lib.matcher import Matcher
+
+
+class TimeRangeError(Exception):
+    pass
+
+
+# A time of day, HH:MM or HH:MM:SS
+CLOCK = re.compile(r"^(\d{1,2}):(\d{2})(?::(\d{2}))?$")
+# A time relative to now, which has no place in a cached rule
+RELATIVE = re.compile(r"^\d+[smhdw]$")
+# Open ends of a range
+EARLIEST = -sys.maxint - 1
+LATEST = sys.maxint
+
+
+##############
+# PARSERANGE #
+##############
+def parserange(value):
+    """
+    Return ("daily", start, end) in seconds since midnight for a range of times of
+    day, ("between", start, end) in epoch seconds for a range of times, or None if
+    value isn't a range. Ranges are FROM..TO, FROM is included and TO isn't.
+    """
+    _start, _sep, _end = value.strip().partition("..")
+    if not _sep:
+        return None
+    _start, _end = _start.strip(), _end.strip()
+    _clocks = [CLOCK.match(_part) for _part in (_start, _end)]
+    if _clocks[0] and _clocks[1]:
+        _seconds = []
+        for _clock in _clocks:
+            _hour, _minute, _second = int(_clock.group(1)), int(_clock.group(2)), int(_clock.group(3) or 0)
+            if _hour > 24 or _minute > 59 or _second > 59 or _hour * 3600 + _minute * 60 + _second > 86400:
+                return None
+            _seconds.append(_hour * 3600 + _minute * 60 + _second)
+        return "daily", _seconds[0], _seconds[1]
+    if not (_start or _end):
+        return None
+    _times = []
+    for _part, _open in ((_start, EARLIEST), (_end, LATEST)):
+        if not _part:
+            _times.append(_open)
+            continue
+        if RELATIVE.match(_part):
+            return None
+        try:
+            _times.append(parsetime(_part))
+        except TimeSeekError:
+            return None
+    return "between", _times[0], _times[1]
+
+
+class TimeMatcher():
+    """
+    @Summary    The Matcher for time signatures, ranges are compared as integers and anything
+                else is taken as a regex.
+
+    @Guide      A range is FROM..TO, from FROM up to but not including TO. Either side is a time as
+                --since takes it, but not one relative to now; @ and the epoch seconds, a %t
+                timestamp or a local date and time such as 2013-12-13 10:00, and either side can be
+                left off for no limit. Both sides as HH:MM or HH:MM:SS give a range of the day, every
+                day, by the clock in the log's timestamps, and it wraps past midnight when TO is
+                earlier than FROM, i.e. 22:00..06:00.
+                    It has the same match, matchall and signatures as a Matcher, so the Filter can
+                use either. The time of a record is decoded with a TimeDecoder, a timestamp it can't
+                decode only goes to the regexes. Signatures that aren't ranges, i.e. "13/Dec", are
+                matched as regexes with a Matcher of their own.
+
+    @Parameters
+                signatures="list of ranges or regexes"
+                plan="a plan from TimeMatcher.plan, to skip parsing the ranges"
+
+    @Example    matcher = TimeMatcher(["2013-12-13 10:00..2013-12-13 11:00", "22:00..06:00"])
+                matcher.match("13/Dec/2013:23:10:00 +0000") -> 1
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, signatures, plan=None):
+        self.signatures = list(signatures)
+        self.between = []  # (start, end, index) of each range of times
+        self.daily = []  # (start, end, index) of each range of the day
+        self.others = []  # The indexes of the signatures that are regexes
+        self.regexes = None  # A Matcher for those signatures
+        self.decoder = TimeDecoder()
+        if plan is None:
+            self.compile()
+        else:
+            self.loadplan(plan)
+
+    def compile(self):
+        for _sigidx, _signature in enumerate(self.signatures):
+            _range = parserange(_signature)
+            if _range is None:
+                self.others.append(_sigidx)
+            elif _range[0] == "daily":
+                self.daily.append((_range[1], _range[2], _sigidx))
+            else:
+                if _range[1] >= _range[2]:
+                    raise TimeRangeError("'%s' ends before it starts" % _signature)
+                self.between.append((_range[1], _range[2], _sigidx))
+        if self.others:
+            self.regexes = Matcher([self.signatures[_sigidx] for _sigidx in self.others])
+
+    ########
+    # PLAN #
+    ########
+    def plan(self):
+        return {"between": self.between, "daily": self.daily, "others": self.others,
+                "regexes": self.regexes.plan() if self.regexes is not None else None}
+
+    def loadplan(self, plan):
+        self.between = [tuple(_range) for _range in plan["between"]]
+        self.daily = [tuple(_range) for _range in plan["daily"]]
+        self.others = plan["others"]
+        if self.others:
+            self.regexes = Matcher([self.signatures[_sigidx] for _sigidx in self.others], plan=plan["regexes"])
+
+    ##########
+    # RANGES #
+    ##########
+    def ranges(self, value):
+        """
+        Generator; yield the index of each range holding the timestamp value
+        """
+        try:
+            if self.between:
+                _epoch = self.decoder.decode(value)
+                for _start, _end, _sigidx in self.between:
+                    if _start <= _epoch < _end:
+                        yield _sigidx
+            if self.daily:
+                _clock = self.decoder.clock(value)
+                for _start, _end, _sigidx in self.daily:
+                    if _start <= _clock < _end if _start <= _end else _clock >= _start or _clock < _end:
+                        yield _sigidx
+        except TimeError:
+            return
+
+    #########
+    # MATCH #
+    #########
+    def match(self, value):
+        """
+        Return the index of a signature matching value, or None if nothing matches
+        """
+        for _sigidx in self.ranges(value):
+            return _sigidx
+        if self.regexes is not None:
+            _sigidx = self.regexes.match(value)
+            if _sigidx is not None:
+                return self.others[_sigidx]
+        return None
+
+    ############
+    # MATCHALL #
+    ############
+    def matchall(self, value):
+        _sigidxs = list(self.ranges(value))
+        if self.regexes is not None:
+            _sigidxs.extend(self.others[_sigidx] for _sigidx in self.regexes.matchall(value))
+        return sorted(_sigidxs)
+
+    def __len__(self):
+        return len(self.signatures)
@@ -0,0 +1,219 @@
+#!/bin/env python
+#
+#   timeseek.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   Finds the part of a log between two times without
+#   reading the rest of it. Apache writes its logs in time
+#   order, so the file is bisected by byte offset, reading
+#   the %t timestamp of a line at each probe, until the
+#   first line of the window is found; the last hour of a
+#   day's log is then found in a few dozen small reads.
+#
+############################
+if not "os" in vars():
+    import os
+
+if not "re" in vars():
+    import re
+
+if not "time" in vars():
+    import time
+
+if "logepoch" not in vars():
+    from lib.timestamp import logepoch, TimeError, TimeDecoder
+
+
+class TimeSeekError(Exception):
+    pass
+
+
+# The %t timestamp of a line, the first one on the line is taken
+TIMESTAMP = re.compile(r"\[(\d{2}/[A-Z][a-z]{2}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4})\]")
+
+# Decodes the timestamps of lines, mostly from its cache as neighbouring lines share them
+_decoder = TimeDecoder()
+
+# Seconds in each unit of a relative time, i.e. 10m
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+#############
+# PARSETIME #
+#############
+def parsetime(value, now=None):
+    """
+    Return the epoch seconds of a time given on the command line; a time back
+    from now such as 90s, 10m, 2h, 1d or 1w, @ and the epoch seconds, a %t
+    timestamp such as 13/Dec/2013:10:00:00 +0000 or a local date and time such
+    as 2013-12-13 10:00 or 2013-12-13T10:00:00
+    """
+    _value = value.strip()
+    _match = re.match(r"^(\d+)([smhdw])$", _value)
+    if _match:
+        _now = time.time() if now is None else now
+        return int(_now) - int(_match.group(1)) * UNITS[_match.group(2)]
+    if _value.startswith("@") and _value[1:].isdigit():
+        return int(_value[1:])
+    if "/" in _value:
+        try:
+            return logepoch(_value)
+        except TimeError as err:
+            raise TimeSeekError(str(err))
+    for _format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(time.strptime(_value, _format)))
+        except ValueError:
+            pass
+    raise TimeSeekError("Invalid time '%s'; use i.e. 10m, 2h, @1386928800, 2013-12-13 10:00 "
+                        "or 13/Dec/2013:10:00:00 +0000" % value)
+
+
+def linetime(line):
+    """
+    Return the epoch seconds of the %t timestamp in a log line, None if it has none
+    """
+    _match = TIMESTAMP.search(line)
+    if _match is None:
+        return None
+    try:
+        return _decoder.decode(_match.group(1))
+    except TimeError:
+        return None
+
+
+#############
+# FIRSTTIME #
+#############
+def firsttime(log, lines=100):
+    """
+    Return the time of the first line with a timestamp in the first lines read
+    from log, an open file, i.e. from openlogfile so it can be compressed, or
+    None if there isn't one
+    """
+    _tail = ""
+    while lines > 0:
+        _chunk = log.read(65536)
+        if not _chunk:
+            return linetime(_tail) if _tail else None
+        _split = (_tail + _chunk).split("\n")
+        _tail = _split.pop()
+        for _line in _split[:lines]:
+            _time = linetime(_line)
+            if _time is not None:
+                return _time
+        lines -= len(_split)
+    return None
+
+
+class TimeSeeker():
+    """
+    @Summary    Bisects an uncompressed log by byte offset to find the lines between two times.
+
+    @Guide      Each probe seeks to the middle of the range left, moves on to the start of the next
+                line and reads lines from there until one has a timestamp, then halves the range
+                on whichever side of the time that line is. Once the range is down to BLOCK bytes
+                it is read line by line. Lines with no timestamp are passed over, and only the few
+                lines at each probe are read, so a seek costs about log2(size / BLOCK) small reads.
+                    The log is taken to be in time order. Apache stamps a line with the time the
+                request came in but writes it when it is done, so a slow request can be written a
+                little after later ones and land just the other side of the edge of the window.
+
+    @Parameters
+                path="the path of an uncompressed log" i.e. "/var/log/httpd/access_log"
+
+    @Example    seeker = TimeSeeker("/var/log/httpd/access_log")
+                start, end = seeker.window(parsetime("10m"), None)
+                httplog.readlog("/var/log/httpd/access_log", start, end)
+    """
+    BLOCK = 65536
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.size = os.path.getsize(path)
+        except OSError as err:
+            raise TimeSeekError("Unable to open log %s; %s" % (path, err))
+        self.probes = 0  # Lines read to find the window, to show what it cost
+
+    ##########
+    # WINDOW #
+    ##########
+    def window(self, since=None, until=None):
+        """
+        Return the (start, end) byte range of the lines from since up to and
+        including until, either can be None for the start or end of the log
+        """
+        _log = open(self.path, "rb")
+        try:
+            _start = self.seek(_log, since) if since is not None else 0
+            _end = self.seek(_log, until, after=True) if until is not None else self.size
+        finally:
+            _log.close()
+        return _start, max(_start, _end)
+
+    ########
+    # SEEK #
+    ########
+    def seek(self, log, epoch, after=False):
+        """
+        Return the offset of the first line timestamped at or after epoch, or after
+        it with after, the size of the log if there is none
+        """
+        if after:
+            _wanted = lambda _time: _time > epoch
+        else:
+            _wanted = lambda _time: _time >= epoch
+        _lo, _hi = 0, self.size
+        while _hi - _lo > self.BLOCK:
+            _mid = (_lo + _hi) // 2
+            _start, _time, _next = self.probe(log, _mid, _hi)
+            if _start >= _hi:
+                # One line runs from the middle to the end of the range
+                break
+            if _time is None or _wanted(_time):
+                # Any lines passed over to find the timestamp have none, so _start will do
+                _hi = _start
+            else:
+                _lo = _next
+        # Read the rest line by line
+        log.seek(_lo)
+        _offset = _lo
+        while _offset < _hi:
+            _line = log.readline()
+            if not _line:
+                break
+            self.probes += 1
+            _time = linetime(_line)
+            if _time is not None and _wanted(_time):
+                return _offset
+            _offset += len(_line)
+        return _hi
+
+    def probe(self, log, offset, end):
+        """
+        Return the start of the first line at or after offset, the time of the first
+        line from there with a timestamp, and the start of the line after that one
+        """
+        if offset:
+            # Step back one byte, so a line starting right at offset is kept
+            log.seek(offset - 1)
+            log.readline()
+        else:
+            log.seek(0)
+        _start = _offset = log.tell()
+        while _offset < end:
+            _line = log.readline()
+            if not _line:
+                break
+            self.probes += 1
+            _time = linetime(_line)
+            _offset += len(_line)
+            if _time is not None:
+                return _start, _time, _offset
+        return _start, None, _offset
@@ -0,0 +1,146 @@
+#!/bin/env python
+#
+#   timestamp.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Turns the apache %t timestamp that HTTPLog puts in
+#   the time field, i.e. 13/Dec/2013:10:00:00 +0000,
+#   into an integer number of seconds since the epoch,
+#   and back. TimeDecoder caches what it has decoded by
+#   second and minute, as consecutive lines share them.
+#
+############################
+if not "calendar" in vars():
+    import calendar
+
+if not "time" in vars():
+    import time
+
+
+class TimeError(Exception):
+    pass
+
+
+# Month abbreviations as apache writes them
+MONTHS = dict((_month, _idx) for _idx, _month in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1))
+
+
+############
+# LOGEPOCH #
+############
+def logepoch(value):
+    """
+    Return the epoch seconds of a %t timestamp such as 13/Dec/2013:10:00:00 +0000,
+    the leading [ and trailing ] are optional
+    """
+    try:
+        _date, _zone = value.strip("[]").split(" ")
+        _day, _month, _rest = _date.split("/", 2)
+        _year, _hour, _minute, _second = _rest.split(":")
+        _epoch = calendar.timegm((int(_year), MONTHS[_month], int(_day),
+                                  int(_hour), int(_minute), int(_second)))
+        # Take the zone offset off to get back to UTC
+        _offset = int(_zone[1:3]) * 3600 + int(_zone[3:5]) * 60
+    except (ValueError, KeyError, AttributeError) as err:
+        raise TimeError("Invalid log timestamp '%s'; %s" % (value, err))
+    if _zone[0] == "-":
+        return _epoch + _offset
+    return _epoch - _offset
+
+
+# Month abbreviations by number, for writing a timestamp back out
+MONTHNAMES = dict((_idx, _month) for _month, _idx in MONTHS.items())
+
+
+def logstamp(epoch, zone="+0000"):
+    """
+    Return the %t timestamp, without its brackets, of epoch seconds in zone
+    """
+    _offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+    _time = time.gmtime(epoch - _offset if zone[0] == "-" else epoch + _offset)
+    return "%02d/%s/%04d:%02d:%02d:%02d %s" % (_time.tm_mday, MONTHNAMES[_time.tm_mon], _time.tm_year,
+                                               _time.tm_hour, _time.tm_min, _time.tm_sec, zone)
+
+
+class TimeDecoder():
+    """
+    @Summary    Turns %t timestamps into epoch seconds, caching them so most lines cost a dictionary lookup.
+
+    @Guide      Lines next to each other in a log nearly always share their second, so every
+                timestamp decoded is kept, and the first one of each new second is worked out
+                from the minute it is in; the seconds are added to the epoch of the minute, and
+                logepoch only runs once a minute. clock gives the time of day as the log shows
+                it, in seconds since its midnight, for rules that apply every day.
+                    The caches are emptied whenever they reach size entries, so they stay small
+                however long the log is. Anything that isn't a %t timestamp raises TimeError,
+                as logepoch does.
+
+    @Parameters
+                size="how many timestamps to keep" i.e. 4096
+
+    @Example    decoder = TimeDecoder()
+                decoder.decode("13/Dec/2013:10:00:05 +0000") -> 1386928805
+                decoder.clock("13/Dec/2013:10:00:05 +0000") -> 36005
+    """
+
+    ########
+    # INIT #
+    ########
+    def __init__(self, size=4096):
+        self.size = size
+        self.epochs = {}  # timestamp -> epoch seconds
+        self.minutes = {}  # timestamp without its seconds -> epoch of that minute
+        self.clocks = {}  # timestamp -> seconds since midnight in the log's own time
+
+    ##########
+    # DECODE #
+    ##########
+    def decode(self, value):
+        """
+        Return the epoch seconds of a %t timestamp
+        """
+        _epoch = self.epochs.get(value)
+        if _epoch is None:
+            _epoch = self.miss(value)
+        return _epoch
+
+    def miss(self, value):
+        _stamp = value.strip("[]")
+        if len(_stamp) != 26 or _stamp[17] != ":" or not _stamp[18:20].isdigit():
+            _epoch = logepoch(_stamp)
+        else:
+            _key = _stamp[:17] + _stamp[20:]
+            _minute = self.minutes.get(_key)
+            if _minute is None:
+                if len(self.minutes) >= self.size:
+                    self.minutes.clear()
+                _minute = self.minutes[_key] = logepoch(_stamp[:17] + ":00" + _stamp[20:])
+            _epoch = _minute + int(_stamp[18:20])
+        if len(self.epochs) >= self.size:
+            self.epochs.clear()
+        self.epochs[value] = _epoch
+        return _epoch
+
+    #########
+    # CLOCK #
+    #########
+    def clock(self, value):
+        """
+        Return the seconds since midnight of a %t timestamp, in the log's own time
+        """
+        _clock = self.clocks.get(value)
+        if _clock is None:
+            _stamp = value.strip("[]")
+            # Check the whole timestamp first, the clock is then just the digits of it
+            self.decode(value)
+            _clock = int(_stamp[12:14]) * 3600 + int(_stamp[15:17]) * 60 + int(_stamp[18:20])
+            if len(self.clocks) >= self.size:
+                self.clocks.clear()
+            self.clocks[value] = _clock
+        return _clock
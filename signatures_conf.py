@@ -242,7 +242,11 @@ signatures = {
     ],
     "host" : [
         # Place IP's here that you want to match against i.e
-        # "192.168.52.1"
+        # "192.168.52.1", IPv6 addresses and CIDR ranges work
+        # too i.e. "203.0.113.0/24" or "2001:db8::/32", these
+        # are looked up in an IP tree, so a list of tens of
+        # thousands of ranges costs no more than a few. Anything
+        # that isn't an address or range is taken as a regex.
     ],
     "remotelog" : [
         # Remotelog rarely shows up, and usually always appears
@@ -280,6 +284,21 @@ signatures = {
         # date or time.
         # "Apr",
         # ".+10:\d{2}:\d{2}.+" # Between 10:00, 10:59
-        # "13/Dec"
+        # "13/Dec",
+        # Ranges are compared as numbers rather than text, from
+        # the first time up to but not including the second,
+        # either side can be left off, and times of day apply
+        # every day, wrapping past midnight i.e.
+        # "2013-12-13 10:00..2013-12-13 11:00",
+        # "@1386928800..",
+        # "22:00..06:00"
+    ],
+    "allow" : [
+        # Hosts here are never matched, whatever else they do,
+        # i.e. your own networks and monitoring. Only addresses
+        # and CIDR ranges, IPv4 or IPv6, can go here.
+        # "127.0.0.1",
+        # "10.0.0.0/8",
+        # "::1"
     ]
 }
\ No newline at end of file
@@ -0,0 +1,37 @@
+#!/bin/env python
+#
+#   test_logformat.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   Checks LogFormat only compiles formats with one way
+#   to match a line, so hostile lines stay cheap.
+#   Run from the top of the repository with;
+#       python -m unittest discover -s tests -t .
+#
+############################
+import unittest
+from lib.logformat import LogFormat, LogFormatError
+
+
+class LogFormatTest(unittest.TestCase):
+
+    def test_adjacent_directives_refused(self):
+        for _format in ("%h%l%u %>s", "%b%D", "%h %l%u", "%h%{X-Forwarded-For}i"):
+            self.assertRaises(LogFormatError, LogFormat, _format)
+
+    def test_bracketed_time_splits(self):
+        _logformat = LogFormat("%h%t %>s")
+        _groups = _logformat.compile().match("10.0.0.1[13/Dec/2013:10:00:00 +0000] 200").groups()
+        self.assertEqual(_groups, ("10.0.0.1", "13/Dec/2013:10:00:00 +0000", "200"))
+
+    def test_worstcase_bounded(self):
+        # The slowest hostile line for a format is still well under a millisecond a match
+        for _format in ('%h %l %u %t \\"%r\\" %>s %b', "%h%t %>s", "%t%h %>s"):
+            _worst = LogFormat(_format).worstcase(4096)
+            self.assertLess(_worst["worstseconds"], 0.005, "%s on %s" % (_format, _worst["worst"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/bin/env python
+#
+#   test_sinks.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   Checks the batches the sinks write hold every address
+#   in the form its firewall set takes.
+#   Run from the top of the repository with;
+#       python -m unittest discover -s tests -t .
+#
+############################
+import os
+import shutil
+import tempfile
+import unittest
+from lib.sinks import IPSetSink, NFTablesSink
+
+
+class SinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="httpdefender-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, name):
+        _file = open(os.path.join(self.dir, name), "r")
+        try:
+            return _file.read().splitlines()
+        finally:
+            _file.close()
+
+    def test_mapped_ipv4_is_dotted_quad(self):
+        _sink = IPSetSink(os.path.join(self.dir, "blacklist.ipset"))
+        _add, _remove = _sink.write(["::ffff:10.0.0.1", "10.0.0.1", "2001:DB8::1", "Bandit"], now=1000)
+        self.assertEqual((_add, _remove), (["10.0.0.1", "2001:db8::1"], []))
+        self.assertEqual(_sink.skipped, ["Bandit"])
+        self.assertEqual(self.read("blacklist.ipset"), [
+            "create httpdefender hash:ip family inet -exist",
+            "add httpdefender 10.0.0.1 -exist",
+            "create httpdefender6 hash:ip family inet6 -exist",
+            "add httpdefender6 2001:db8::1 -exist"])
+        self.assertEqual(self.read("blacklist.ipset.state.pending"), ["10.0.0.1 0", "2001:db8::1 0"])
+
+    def test_mapped_ipv4_in_old_state(self):
+        # A state written before addresses were normalised still matches this run
+        _sink = NFTablesSink(os.path.join(self.dir, "blacklist.nft"))
+        _file = open(_sink.state, "w")
+        _file.write("::ffff:10.0.0.1 0\n")
+        _file.close()
+        self.assertEqual(_sink.write(["10.0.0.1"], now=1000), ([], []))
+        _batch = self.read("blacklist.nft")
+        self.assertIn("add element inet httpdefender httpdefender { 10.0.0.1 }", _batch)
+        self.assertFalse([_line for _line in _batch if "::ffff:" in _line])
+
+
+if __name__ == "__main__":
+    unittest.main()
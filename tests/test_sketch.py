@@ -0,0 +1,111 @@
+#!/bin/env python
+#
+#   test_sketch.py
+#   Author:         Leslie.A.Cordell
+#   CreationDate:        2013/12/14
+#   ModifiedDate:        2013/12/14
+#
+#   The MIT License (MIT)
+#   Copyright (c) 2013 Leslie.A.Cordell
+#
+#   Checks the error bounds the sketches document hold,
+#   on fixed keys so every run gives the same counts.
+#   Run from the top of the repository with;
+#       python -m unittest discover -s tests -t .
+#
+############################
+import unittest
+from lib.sketch import BloomFilter, HyperLogLog, CountMinSketch, SpaceSaving, SketchError
+
+
+def hosts(count, prefix=""):
+    """
+    Return count distinct IPv4 addresses, prefixed so sets of them don't overlap
+    """
+    return ["%s10.%d.%d.%d" % (prefix, _idx >> 16, (_idx >> 8) & 255, _idx & 255) for _idx in xrange(count)]
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        _bloom = BloomFilter(10000, 0.01)
+        _keys = hosts(10000)
+        for _key in _keys:
+            _bloom.add(_key)
+        self.assertTrue(all(_key in _bloom for _key in _keys))
+
+    def test_false_positive_rate_at_capacity(self):
+        # Full to capacity, the share of keys never added that are found stays about error
+        for _capacity, _error in ((20000, 0.01), (20000, 0.001)):
+            _bloom = BloomFilter(_capacity, _error)
+            for _key in hosts(_capacity):
+                _bloom.add(_key)
+            _others = hosts(100000, "x")
+            _rate = sum(1 for _key in _others if _key in _bloom) / float(len(_others))
+            self.assertLess(_rate, _error * 1.5, "%s false positives at error %s" % (_rate, _error))
+            self.assertAlmostEqual(_bloom.errorrate(), _error, delta=_error * 0.1)
+
+    def test_add_returns_new(self):
+        _bloom = BloomFilter(100, 0.01)
+        self.assertTrue(_bloom.add("10.0.0.1"))
+        self.assertFalse(_bloom.add("10.0.0.1"))
+        self.assertEqual(len(_bloom), 1)
+
+    def test_forerror_size(self):
+        # About 1.44 * log2(1 / error) bits per key, 1.8MB for a million keys at 0.001
+        _bits, _hashes = BloomFilter.forerror(1000000, 0.001)
+        self.assertAlmostEqual(_bits / 8.0 / 1e6, 1.8, delta=0.01)
+        self.assertEqual(_hashes, 10)
+
+    def test_bad_parameters(self):
+        self.assertRaises(SketchError, BloomFilter, 0, 0.01)
+        self.assertRaises(SketchError, BloomFilter, 100, 0)
+        self.assertRaises(SketchError, BloomFilter, 100, 1)
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_error_bound(self):
+        # Each estimate is within three standard errors, 1.04 / sqrt(2 ** precision), of the real count
+        for _precision in (10, 14):
+            for _count in (100, 5000, 100000):
+                _hll = HyperLogLog(_precision)
+                for _key in hosts(_count, "p%s-" % _precision):
+                    _hll.add(_key)
+                _bound = 3 * 1.04 / (2 ** _precision) ** 0.5
+                self.assertAlmostEqual(_hll.error, _bound / 3)
+                self.assertLessEqual(abs(_hll.count() - _count) / float(_count), _bound,
+                                     "%s for %s keys at precision %s" % (_hll.count(), _count, _precision))
+
+    def test_duplicates_not_counted(self):
+        _hll = HyperLogLog(14)
+        for _repeat in xrange(5):
+            for _key in hosts(1000):
+                _hll.add(_key)
+        self.assertLessEqual(abs(_hll.count() - 1000), 3 * _hll.error * 1000)
+
+    def test_merge(self):
+        _first, _second = HyperLogLog(12), HyperLogLog(12)
+        for _key in hosts(6000)[:4000]:
+            _first.add(_key)
+        for _key in hosts(6000)[2000:]:
+            _second.add(_key)
+        _first.merge(_second)
+        self.assertLessEqual(abs(_first.count() - 6000), 3 * _first.error * 6000)
+
+    def test_bad_parameters(self):
+        self.assertRaises(SketchError, HyperLogLog, 3)
+        self.assertRaises(SketchError, HyperLogLog, 19)
+        self.assertRaises(SketchError, HyperLogLog(10).merge, HyperLogLog(12))
+
+
+class CounterTest(unittest.TestCase):
+
+    def test_bad_parameters(self):
+        self.assertRaises(SketchError, CountMinSketch, 0, 4)
+        self.assertRaises(SketchError, CountMinSketch, 16, 0)
+        self.assertRaises(SketchError, SpaceSaving, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()